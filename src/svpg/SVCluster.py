@@ -1,86 +1,169 @@
-from random import sample
-
 import numpy as np
 from scipy.cluster.hierarchy import linkage, fcluster
 
+from svpg.SVSignature import SV_TYPE_CODE
+
+# largest bin clustered with plain average linkage, see cluster_bin
+MAX_LINKAGE_SIZE = 100
+
 def form_bins(sv_signatures, max_distance):
-    """Form partitions of signatures using mean distance."""
-    sorted_signatures = sorted(sv_signatures, key=lambda evi: evi.get_key())
-    grouped_bin, current_group = [], []
-    for i, sv_sig in enumerate(sorted_signatures):
-        if i == 0:
-            current_group.append(sv_sig)
-        else:
-            if current_group[-1].downstream_distance_to(sv_sig) < max_distance:
-                current_group.append(sv_sig)
-            else:
-                grouped_bin.append(current_group)
-                current_group = [sv_sig]
-    if current_group:
-        grouped_bin.append(current_group)
-
-    bin_depth = [len(bin) for bin in grouped_bin]
+    """Form partitions of signatures using mean distance.
+
+    `sv_signatures` is a SignatureTable of one SV type. Signatures are sorted by (contig, start, end), or
+    (contig, start) for INS and BND, and a new bin starts where the gap to the previous signature on the
+    same contig reaches `max_distance`; the gap is measured from the previous start for INS and from the previous
+    end otherwise. Each bin is a sub-table.
+    """
+    rank = np.argsort(np.argsort(np.array(sv_signatures.contigs, dtype=object)))[sv_signatures.contig]
+    by_start = np.isin(sv_signatures.sv_type, [SV_TYPE_CODE["INS"], SV_TYPE_CODE["BND"]])
+    end_key = np.where(by_start, 0, sv_signatures.end)
+    order = np.lexsort((end_key, sv_signatures.start, rank, sv_signatures.sv_type))
+    sorted_signatures = sv_signatures.take(order)
+
+    # gap to the next signature: from the start of an INS, from the end of others (pos1 + 1 for BND)
+    reach = np.where(sorted_signatures.sv_type == SV_TYPE_CODE["INS"], sorted_signatures.start, sorted_signatures.end)
+    split = ((sorted_signatures.sv_type[1:] != sorted_signatures.sv_type[:-1]) |
+             (sorted_signatures.contig[1:] != sorted_signatures.contig[:-1]) |
+             (sorted_signatures.start[1:] - reach[:-1] >= max_distance))
+    bounds = np.concatenate(([0], np.flatnonzero(split) + 1, [len(sorted_signatures)])) if len(sorted_signatures) else [0]
+    grouped_bin = [sorted_signatures.take(np.arange(lo, hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
     try:
-        mean_depth = sum(bin_depth) / len(bin_depth)
+        mean_depth = len(sorted_signatures) / len(grouped_bin)
     except ZeroDivisionError:
         mean_depth = 0
 
     return grouped_bin, mean_depth
 
-def span_position_distance(signature1, signature2, type, param):
-    span1 = signature1.get_source()[2] - signature1.get_source()[1]
-    span2 = signature2.get_source()[2] - signature2.get_source()[1]
-    center1 = (signature1.get_source()[1] + signature1.get_source()[2]) // 2
-    center2 = (signature2.get_source()[1] + signature2.get_source()[2]) // 2
-    position_distance = abs(center1 - center2) // (max(span1, span2) * param)
-    node_distance = 0
-    if type == 'BND':
-        if signature1.get_destination()[0] != signature2.get_destination()[0]:
-            return 999
-        dir1 = (signature1.source_direction, signature1.dest_direction)
-        dir2 = (signature2.source_direction, signature2.dest_direction)
-        if dir1 != dir2:
-            return 999
-        dist1 = abs(signature1.get_source()[1] - signature2.get_source()[1])
-        dist2 = abs(signature1.get_destination()[1] - signature2.get_destination()[1])
-        if max(dist1, dist2) == 0:
-            return 0
-
-        return dist1 // (max(dist1, dist2) * param) + dist2 // (max(dist1, dist2) * param)
-    elif type == 'INS' or type == 'DEL':
-        if signature1.node_ls and signature2.node_ls:
-            path1, path2 = signature1.node_ls, signature2.node_ls
-            node_distance = 0.05 * (1 - len(set(path1).intersection(set(path2))) / len(set(path1).union(set(path2))))
-            # node_distance = len(set(path1).symmetric_difference(set(path2))) / max(len(path1), len(path2)) * 0.1
-
-    span_distance = abs(span1 - span2) / max(span1, span2)
-
-    return position_distance + span_distance + node_distance
+def _node_sets(signatures, rows):
+    """(row position, node) pairs of the distinct pan-genome nodes of the given rows."""
+    starts = signatures.node_offset[rows]
+    counts = signatures.node_offset[rows + 1] - starts
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    nodes = signatures.nodes[offsets + np.arange(counts.sum())]
+    positions = np.repeat(np.arange(len(rows)), counts)
+    order = np.lexsort((nodes, positions))
+    positions, nodes = positions[order], nodes[order]
+    distinct = np.ones(len(nodes), dtype=bool)
+    distinct[1:] = (positions[1:] != positions[:-1]) | (nodes[1:] != nodes[:-1])
+    return positions[distinct], nodes[distinct], counts > 0
+
+
+def node_jaccard(signatures, rows_a, rows_b):
+    """Jaccard similarity of the pan-genome node sets of rows_a x rows_b, and which rows have nodes."""
+    pos_a, nodes_a, has_a = _node_sets(signatures, rows_a)
+    pos_b, nodes_b, has_b = _node_sets(signatures, rows_b)
+    node_ids = np.unique(nodes_b)
+    incidence_b = np.zeros((len(rows_b), len(node_ids)), dtype=np.int64)
+    incidence_b[pos_b, np.searchsorted(node_ids, nodes_b)] = 1
+    shared = np.isin(nodes_a, node_ids)
+    incidence_a = np.zeros((len(rows_a), len(node_ids)), dtype=np.int64)
+    incidence_a[pos_a[shared], np.searchsorted(node_ids, nodes_a[shared])] = 1
+    inter = incidence_a @ incidence_b.T
+    union = (np.bincount(pos_a, minlength=len(rows_a))[:, None] +
+             np.bincount(pos_b, minlength=len(rows_b))[None, :] - inter)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return inter / union, has_a, has_b
+
+
+def pair_distances(signatures, rows_a, rows_b, type, param):
+    """Distance matrix between rows_a and rows_b of a SignatureTable of one SV type.
+
+    The distance of two signatures is the floored center distance relative to the larger span, plus the
+    relative span difference, plus 0.05 times the Jaccard distance of their pan-genome nodes for INS and
+    DEL. BND pairs use the floored source and destination distances relative to the larger of the two,
+    and 999 for different destination contigs or directions.
+    """
+    a, b = rows_a[:, None], rows_b[None, :]
+    start, end = signatures.start, signatures.end
+    span = end - start
+    center = (start + end) // 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if type == 'BND':
+            dist1 = np.abs(start[a] - start[b])
+            dist2 = np.abs(signatures.pos2[a] - signatures.pos2[b])
+            scale = np.maximum(dist1, dist2) * param
+            distance = np.where(np.maximum(dist1, dist2) == 0, 0.0, dist1 // scale + dist2 // scale)
+            mismatch = ((signatures.contig2[a] != signatures.contig2[b]) |
+                        (signatures.direction[a] != signatures.direction[b]) |
+                        (signatures.direction2[a] != signatures.direction2[b]))
+            return np.where(mismatch, 999.0, distance)
+
+        max_span = np.maximum(span[a], span[b])
+        position_distance = np.abs(center[a] - center[b]) // (max_span * param)
+        span_distance = np.abs(span[a] - span[b]) / max_span
+        distance = position_distance + span_distance
+    if type == 'INS' or type == 'DEL':
+        jaccard, has_a, has_b = node_jaccard(signatures, rows_a, rows_b)
+        both = has_a[:, None] & has_b[None, :]
+        distance = np.where(both, distance + 0.05 * (1 - jaccard), distance)
+    return distance
+
+
+def span_position_distance(signatures, type, param):
+    """Condensed pairwise distance vector (the layout of scipy's pdist) of a SignatureTable of one SV type."""
+    rows = np.arange(len(signatures))
+    i, j = np.triu_indices(len(signatures), k=1)
+    return pair_distances(signatures, rows, rows, type, param)[i, j]
+
+
+def depth_param(size, mean_len):
+    """Distance parameter of a linkage over `size` signatures of bins with mean depth `mean_len`."""
+    return (abs(size - mean_len)) / max(size, mean_len)+mean_len
+
+
+def linkage_clusters(signatures, element_type, param, threshold=0.3):
+    """Average-linkage cluster labels (0-based) of a small SignatureTable."""
+    Z = linkage(span_position_distance(signatures, element_type, param), method="average")
+    return fcluster(Z, threshold, criterion='distance') - 1
+
+
+def cluster_bin(bin, mean_len, max_linkage=MAX_LINKAGE_SIZE, threshold=0.3, block_size=10000):
+    """Cluster the signatures of one bin, returning the clusters as sub-tables.
+
+    Bins of up to `max_linkage` signatures are clustered with average linkage. Larger bins are clustered
+    from `max_linkage` signatures evenly spaced over the sorted bin; every other signature joins the
+    cluster with the smallest average distance to it if that is within `threshold`. The signatures that
+    join none are split, in bin order, into windows of `max_linkage` and each window is clustered with
+    average linkage, so the work stays linear in the bin size. The result only depends on the bin's order.
+    """
+    n = len(bin)
+    if n == 1:
+        return [bin]
+    element_type = bin[0].type
+
+    if n <= max_linkage:
+        labels = linkage_clusters(bin, element_type, depth_param(n, mean_len), threshold)
+        return [bin.take(np.flatnonzero(labels == k)) for k in range(labels.max() + 1)]
+
+    sample_rows = np.unique(np.linspace(0, n - 1, max_linkage).round().astype(np.int64))
+    param = depth_param(len(sample_rows), mean_len)
+    labels = np.full(n, -1, dtype=np.int64)
+    labels[sample_rows] = linkage_clusters(bin.take(sample_rows), element_type, param, threshold)
+    n_clusters = labels.max() + 1
+    membership = np.zeros((len(sample_rows), n_clusters))
+    membership[np.arange(len(sample_rows)), labels[sample_rows]] = 1
+    membership /= membership.sum(axis=0)
+
+    rest = np.flatnonzero(labels < 0)
+    for block in range(0, len(rest), block_size):
+        rows = rest[block:block + block_size]
+        with np.errstate(invalid='ignore'):
+            average = pair_distances(bin, rows, sample_rows, element_type, param) @ membership
+        best = average.argmin(axis=1)
+        joined = average[np.arange(len(rows)), best] <= threshold
+        labels[rows[joined]] = best[joined]
+
+    clusters = [bin.take(np.flatnonzero(labels == k)) for k in range(n_clusters)]
+    leftover = np.flatnonzero(labels < 0)
+    for window in range(0, len(leftover), max_linkage):
+        clusters.extend(cluster_bin(bin.take(leftover[window:window + max_linkage]), mean_len, max_linkage, threshold))
+    return clusters
+
 
 def cluster_data(bins, mean_len):
     clusters_final = []
     for bin in bins:
-        if len(bin) == 1:
-            clusters_final.append(bin)
-            continue
-        elif len(bin) > 100:
-            partition_sample = sample(bin, 100)
-        else:
-            partition_sample = bin
-
-        element_type = partition_sample[0].type
-        param = (abs(len(partition_sample) - mean_len)) / max(len(partition_sample), mean_len)+mean_len
-
-        distance_data = []
-        for i in range(len(partition_sample) - 1):
-            for j in range(i + 1, len(partition_sample)):
-                distance_data.append(
-                    span_position_distance(partition_sample[i], partition_sample[j], element_type, param))
-        Z = linkage(np.array(distance_data), method="average")
-        cluster_indices = list(fcluster(Z, 0.3, criterion='distance'))
-        new_clusters = [[] for i in range(max(cluster_indices))]
-        for signature_index, cluster_index in enumerate(cluster_indices):
-            new_clusters[cluster_index - 1].append(partition_sample[signature_index])
-        clusters_final.extend(new_clusters)
+        clusters_final.extend(cluster_bin(bin, mean_len))
 
     return clusters_final
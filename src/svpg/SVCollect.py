@@ -1,9 +1,18 @@
+import os
+import re
+import math
+import struct
+from collections import namedtuple
 import logging
+import numpy as np
 import pysam
 
-from svpg.SVSignature import SignatureDeletion, SignatureInsertion
+from svpg.SVSignature import SignatureDeletion, SignatureInsertion, SignatureTable, READ_FLANK
 from svpg.util import analyze_cigar_indel, merge_cigar
 
+BAI_WINDOW = 16384  # width of a window in the BAI linear index
+CIGAR_PATTERN = re.compile(r'(\d+)([MIDNSHP=X])')
+
 def decompose_cigars(alignment, bam, query_name, min_length):
     """Parse BAM record to extract SVs from CIGAR."""
     sv_signatures = []
@@ -22,6 +31,26 @@ def decompose_cigars(alignment, bam, query_name, min_length):
 
     return sv_signatures
 
+def trim_read_seqs(sigs, flank=READ_FLANK):
+    """Replace the whole read held by CIGAR signatures of one alignment with windows of `flank` bases around them.
+
+    Windows that overlap are merged, so every base of the read is kept at most once.
+    """
+    windows = []
+    for sig in sorted(sigs, key=lambda sig: sig.pos_read):
+        lo = max(sig.pos_read - flank, 0)
+        hi = min(sig.pos_read + sig.svlen + flank, sig.read_len)
+        if windows and lo <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], hi)
+            windows[-1][2].append(sig)
+        else:
+            windows.append([lo, hi, [sig]])
+    for lo, hi, members in windows:
+        window_seq = members[0].read_seq[lo:hi]
+        for sig in members:
+            sig.read_seq, sig.seq_offset = window_seq, lo
+    return sigs
+
 def analyze_split_indel(alignment_current, alignment_next, ultra_ins_flag=False):
     """Parse BAM record to extract SVs from inter-alignment."""
     distance_on_read = alignment_next['q_start'] - alignment_current['q_end']
@@ -80,16 +109,27 @@ def analyze_split_indel(alignment_current, alignment_next, ultra_ins_flag=False)
 
     return split_signature
 
-def decompose_split(primary, supplementaries, bam):
+# the coordinates of one alignment of a split read that decompose_split needs, as pysam reports them
+SplitAlignment = namedtuple('SplitAlignment', ['reference_name', 'reference_start', 'reference_end', 'is_reverse',
+                                               'mapping_quality', 'query_alignment_start', 'query_alignment_end',
+                                               'read_length'])
+
+def primary_split_alignment(alignment):
+    return SplitAlignment(alignment.reference_name, alignment.reference_start, alignment.reference_end,
+                          alignment.is_reverse, alignment.mapping_quality, alignment.query_alignment_start,
+                          alignment.query_alignment_end, alignment.infer_read_length())
+
+def decompose_split(primary, supplementaries):
     """Parse BAM record to extract SVs from split_reads."""
     read_name = primary.query_name
-    alignments = [primary] + supplementaries
+    read_seq = primary.query_sequence
+    alignments = [primary_split_alignment(primary)] + supplementaries
     alignment_list = []
     sig_list = []
     for alignment in alignments:
         if alignment.is_reverse:
-            q_start = alignment.infer_read_length() - alignment.query_alignment_end
-            q_end = alignment.infer_read_length() - alignment.query_alignment_start
+            q_start = alignment.read_length - alignment.query_alignment_end
+            q_end = alignment.read_length - alignment.query_alignment_start
         else:
             q_start = alignment.query_alignment_start
             q_end = alignment.query_alignment_end
@@ -98,13 +138,13 @@ def decompose_split(primary, supplementaries, bam):
             'read_name': read_name,
             'q_start': q_start,
             'q_end': q_end,
-            'ref_chr': bam.getrname(alignment.reference_id),
+            'ref_chr': alignment.reference_name,
             'ref_start': alignment.reference_start,
             'ref_end': alignment.reference_end,
             'is_reverse': alignment.is_reverse,
             'mapping_quality': alignment.mapping_quality,
-            'infer_read_length': alignment.infer_read_length(),
-            'atgc_seq': primary.query_sequence,
+            'infer_read_length': alignment.read_length,
+            'atgc_seq': read_seq,
         }
         alignment_list.append(alignment_dict)
 
@@ -117,6 +157,36 @@ def decompose_split(primary, supplementaries, bam):
 
     return sig_list
 
+def parse_sa_cigar(cigar, query_length):
+    """Query and reference extent of an SA CIGAR string.
+
+    Returns (query_alignment_start, query_alignment_end, inferred read length, reference length) as pysam
+    reports them for an alignment with this CIGAR whose query_sequence has `query_length` bases.
+    """
+    ops = [(int(length), op) for length, op in CIGAR_PATTERN.findall(cigar)]
+    q_start = 0
+    for length, op in ops:
+        if op == 'S':
+            q_start += length
+        elif op != 'H':
+            break
+    if query_length:
+        q_end = query_length
+        for length, op in reversed(ops[1:]):
+            if op == 'S':
+                q_end -= length
+            elif op != 'H':
+                break
+    else:
+        # without a sequence pysam counts the aligned bases and only a soft clip met before any of them
+        q_end = 0
+        for length, op in ops:
+            if op in 'MI=X' or (op == 'S' and q_end == 0):
+                q_end += length
+    read_length = sum(length for length, op in ops if op in 'MIS=XH')
+    ref_length = sum(length for length, op in ops if op in 'MDN=X') or 1  # as htslib's bam_endpos
+    return q_start, q_end, read_length, ref_length
+
 def retrieve_other_alignments(main_alignment, bam):
     """Reconstruct other alignments of the same read for a given alignment from the SA tag"""
     if main_alignment.get_cigar_stats()[0][5] > 0:
@@ -125,6 +195,7 @@ def retrieve_other_alignments(main_alignment, bam):
         sa_tag = main_alignment.get_tag("SA").split(";")
     except KeyError:
         return []
+    query_length = main_alignment.query_length
     other_alignments = []
     # For each other alignment encoded in the SA tag
     for element in sa_tag:
@@ -133,41 +204,22 @@ def retrieve_other_alignments(main_alignment, bam):
         if len(fields) != 6:
             continue
         rname = fields[0]
-        pos = int(fields[1])
-        strand = fields[2]
+        if bam.get_tid(rname) < 0:
+            continue
+        pos = int(fields[1]) - 1
         # CIGAR string encoded in SA tag is shortened
-        cigar = fields[3]
+        q_start, q_end, read_length, ref_length = parse_sa_cigar(fields[3], query_length)
         mapq = int(fields[4])
-        nm = int(fields[5])
-
-        # Generate an aligned segment from the information
-        a = pysam.AlignedSegment()
-        a.query_name = main_alignment.query_name
-        a.query_sequence = main_alignment.query_sequence
-        if strand == "+":
-            a.flag = 2048
-        else:
-            a.flag = 2064
-        a.reference_id = bam.get_tid(rname)
-        a.reference_start = pos - 1
-        try:
-            a.mapping_quality = mapq
-        except OverflowError:
-            a.mapping_quality = 0
-        a.cigarstring = cigar
-        a.next_reference_id = -1
-        a.next_reference_start = -1
-        a.template_length = 0
-        a.query_qualities = main_alignment.query_qualities
-        a.set_tags([("NM", nm, "i")])
-
-        other_alignments.append(a)
+        if not 0 <= mapq <= 255:
+            mapq = 0
+        other_alignments.append(SplitAlignment(rname, pos, pos + ref_length, fields[2] == "-", mapq,
+                                               q_start, q_end, read_length))
 
     return other_alignments
 
 def read_bam(contig, start, end, options):
     """Parse BAM record to extract SVs."""
-    bam = pysam.AlignmentFile(options.bam, threads=options.num_threads)
+    bam = pysam.AlignmentFile(options.bam, threads=options.bam_threads)
     sv_signatures, sv_signatures_inter = [], []
     for current_alignment in bam.fetch(contig, start, end):
         try:
@@ -176,12 +228,11 @@ def read_bam(contig, start, end, options):
             sigs = decompose_cigars(current_alignment, bam, current_alignment.query_name, 50)
             if sigs:
                 sigs = merge_cigar(sigs, max_merge=options.max_merge_threshold)
-                sv_signatures.extend(sigs)
+                sv_signatures.extend(trim_read_seqs(sigs))
             if not current_alignment.is_supplementary:
                 supplementary_alignments = retrieve_other_alignments(current_alignment, bam)
-                good_suppl_alns = [aln for aln in supplementary_alignments if
-                                   not aln.is_unmapped and aln.mapping_quality >= options.min_mapq]
-                sig_list = decompose_split(current_alignment, good_suppl_alns, bam)
+                good_suppl_alns = [aln for aln in supplementary_alignments if aln.mapping_quality >= options.min_mapq]
+                sig_list = decompose_split(current_alignment, good_suppl_alns)
                 sv_signatures_inter.extend(sig_list)
 
         except StopIteration:
@@ -190,6 +241,67 @@ def read_bam(contig, start, end, options):
             logging.warning('Execution interrupted by user. Stop detection and continue with next step..')
             break
 
-    sv_signatures = sv_signatures + sv_signatures_inter
+    return SignatureTable.from_signatures(sv_signatures + sv_signatures_inter)
 
-    return sv_signatures
+
+def read_bai_offsets(bai_path):
+    """Compressed file offset of every 16 kb window of each reference, from the linear index of a BAI file."""
+    with open(bai_path, 'rb') as fp:
+        data = fp.read()
+    if data[:4] != b'BAI\1':
+        raise ValueError(f"Not a BAI index: {bai_path}")
+    n_ref, = struct.unpack_from('<i', data, 4)
+    pos = 8
+    offsets = []
+    for _ in range(n_ref):
+        n_bin, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        for _ in range(n_bin):
+            n_chunk, = struct.unpack_from('<i', data, pos + 4)
+            pos += 8 + 16 * n_chunk
+        n_intv, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        offsets.append(np.frombuffer(data, dtype='<u8', count=n_intv, offset=pos) >> 16)
+        pos += 8 * n_intv
+    return offsets
+
+
+def plan_bam_tiles(bam, bam_path, contigs, n_tiles):
+    """Split the selected contigs into about `n_tiles` tiles holding similar numbers of mapped reads.
+
+    Every contig gets a share of the tiles proportional to its mapped reads from the index statistics.
+    Within a contig the tile boundaries follow the BAI linear index, whose compressed file offsets grow
+    with the alignments stored per 16 kb window; without a BAI file the tiles have equal lengths.
+    Returns (contig, start, end, estimated reads) tuples in genomic order.
+    """
+    stats = [ref for ref in bam.get_index_statistics() if ref.mapped > 0 and ref.contig in contigs]
+    if not stats:
+        return []
+    window_offsets = None
+    for bai_path in (bam_path + '.bai', os.path.splitext(bam_path)[0] + '.bai'):
+        try:
+            window_offsets = read_bai_offsets(bai_path)
+            break
+        except (OSError, ValueError, struct.error):
+            continue
+
+    reads_per_tile = max(1, sum(ref.mapped for ref in stats) // n_tiles)
+    tiles = []
+    for ref in stats:
+        ref_len = bam.get_reference_length(ref.contig)
+        n = min(math.ceil(ref.mapped / reads_per_tile), max(1, ref_len // BAI_WINDOW))
+        offsets = window_offsets[bam.get_tid(ref.contig)] if window_offsets is not None else []
+        if n > 1 and len(offsets) > 1:
+            offsets = offsets.astype(np.float64)
+            steps = np.diff(offsets)
+            weights = np.append(steps, np.median(steps)).clip(0) + 1
+            cumulative = np.cumsum(weights)
+            cuts = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, n) / n) + 1
+            bounds = np.unique(np.concatenate(([0], np.minimum(cuts * BAI_WINDOW, ref_len), [ref_len])))
+            share = np.array([weights[lo // BAI_WINDOW:-(-hi // BAI_WINDOW)].sum() for lo, hi in zip(bounds[:-1], bounds[1:])])
+        else:
+            bounds = np.linspace(0, ref_len, n + 1).astype(np.int64)
+            share = np.diff(bounds).astype(np.float64)
+        share = share / share.sum() * ref.mapped
+        tiles.extend((ref.contig, int(lo), int(hi), int(reads)) for lo, hi, reads in zip(bounds[:-1], bounds[1:], share) if hi > lo)
+    return tiles
@@ -1,4 +1,6 @@
 from math import log10
+from collections import defaultdict
+from itertools import groupby
 import numpy as np
 import pysam
 
@@ -6,45 +8,38 @@ err = 0.2
 prior = float(1/3)
 Genotype = ["0/0", "0/1", "1/1"]
 
-def log10sumexp(log10_probs):
-    # Normalization of Genotype likelihoods
-    m = max(log10_probs)
-    return m + log10(sum(pow(10.0, x-m) for x in log10_probs))
-
-def normalize_log10_probs(log10_probs):
-    # Adjust the Genotype likelihoods
-    log10_probs = np.array(log10_probs)
-    lse = log10sumexp(log10_probs)
-    return np.minimum(log10_probs - lse, 0.0)
-
-def rescale_read_counts(c0, c1, max_allowed_reads=100):
-    """Ensures that n_total <= max_allowed_reads, rescaling if necessary."""
-    Total = c0 + c1
-    if Total > max_allowed_reads:
-        c0 = int(max_allowed_reads * float(c0/Total))
-        c1 = max_allowed_reads - c0
-    return c0, c1
+def genotype_likelihoods(ref_counts, alt_counts, platform):
+    """Genotype likelihoods for arrays of reference and variant read counts, computed in log10 space.
 
-def cal_GL(c0, c1, type, platform):
+    Returns the index into Genotype, the PL (n x 3), GQ and QUAL arrays.
+    """
     if platform == "hifi":
         err = 0.01
     else:
         err = 0.1
-    # Approximate adjustment of events with larger read depth
-    c0, c1 = rescale_read_counts(c0, c1)
+    c0 = np.asarray(ref_counts, dtype=np.float64)
+    c1 = np.asarray(alt_counts, dtype=np.float64)
 
-    ori_GL00 = np.float64(pow((1 - err), c0) * pow(err, c1) * (1 - prior) / 2)
-    ori_GL11 = np.float64(pow(err, c0) * pow((1 - err), c1) * (1 - prior) / 2)
-    ori_GL01 = np.float64(pow(0.5, c0 + c1) * prior)
+    log10_GL = np.column_stack((c0 * log10(1 - err) + c1 * log10(err) + log10((1 - prior) / 2),
+                                (c0 + c1) * log10(0.5) + log10(prior),
+                                c0 * log10(err) + c1 * log10(1 - err) + log10((1 - prior) / 2)))
 
     # normalized genotype likelihood
-    prob = list(normalize_log10_probs([log10(ori_GL00), log10(ori_GL01), log10(ori_GL11)]))
-    GL_P = [pow(10, i) for i in prob]
-    PL = [int(np.around(-10 * log10(i))) for i in GL_P]
-    GQ = [int(-10 * log10(GL_P[1] + GL_P[2])), int(-10 * log10(GL_P[0] + GL_P[2])), int(-10 * log10(GL_P[0] + GL_P[1]))]
-    QUAL = abs(np.around(-10 * log10(GL_P[0]), 1))
+    ln_GL = log10_GL * np.log(10)
+    prob = np.minimum((ln_GL - np.logaddexp.reduce(ln_GL, axis=1)[:, None]) / np.log(10), 0.0)
+    PL = np.around(-10 * prob).astype(np.int64)
+    ln_prob = prob * np.log(10)
+    GQ = np.column_stack((np.logaddexp(ln_prob[:, 1], ln_prob[:, 2]),
+                          np.logaddexp(ln_prob[:, 0], ln_prob[:, 2]),
+                          np.logaddexp(ln_prob[:, 0], ln_prob[:, 1])))
+    GQ = np.trunc(-10 * GQ / np.log(10)).astype(np.int64).max(axis=1)
+    QUAL = np.abs(np.around(-10 * prob[:, 0], 1))
+
+    return prob.argmax(axis=1), PL, GQ, QUAL
 
-    return Genotype[prob.index(max(prob))], "%d,%d,%d" % (PL[0], PL[1], PL[2]), max(GQ), QUAL
+def cal_GL(c0, c1, type, platform):
+    GT, PL, GQ, QUAL = genotype_likelihoods([c0], [c1], platform)
+    return Genotype[GT[0]], "%d,%d,%d" % tuple(PL[0]), int(GQ[0]), QUAL[0]
 
 def threshold_ref_count(num):
     if num <= 2:
@@ -56,58 +51,117 @@ def threshold_ref_count(num):
     else:
         return 5*num
 
-def genotype(candidates, type, options):
-    bam = pysam.AlignmentFile(options.bam, threads=options.num_threads)
-
-    for nr, candidate in enumerate(candidates):
-        reads_supporting_variant = set(candidate.members)
-
-        if type != "BND":
-            max_bias = 1000
-            contig, start, end = candidate.get_source()
-        else:
-            up_bound = threshold_ref_count(len(reads_supporting_variant))
-            max_bias = 100
-            contig, start = candidate.get_source()
-            end = start + 1
-        contig_length = bam.get_reference_length(contig)
+def reference_window(candidate, contig_length):
+    """Locus and read window in which alignments are tested for supporting the reference allele of a candidate.
+
+    Returns (start, end, max_bias, up_bound, window_start, window_end) or None if the window is outside the contig.
+    """
+    if candidate.type != "BND":
+        max_bias = 1000
+        contig, start, end = candidate.get_source()
+        up_bound = None
+    else:
+        up_bound = threshold_ref_count(len(set(candidate.members)))
+        max_bias = 100
+        contig, start = candidate.get_source()
+        end = start + 1
+    window_start, window_end = max(0, start - max_bias), min(contig_length, end + max_bias)
+    if window_end < 0 or window_start > window_end:
+        return None
+    return start, end, max_bias, up_bound, window_start, window_end
+
+def supports_reference(type, start, end, max_bias, aln_start, aln_end):
+    if type == "DEL":
+        minimum_overlap = min((end - start) / 2, 2000)
+        return (aln_start < (end - minimum_overlap) and aln_end > (end + max_bias) or
+                aln_start < (start - max_bias) and aln_end > (start + minimum_overlap))
+    return aln_start < (start - max_bias) and aln_end > (end + max_bias)
+
+def plan_genotype_tiles(candidates, n_tiles, min_tile_size=100):
+    """Group candidates into tiles of neighbouring loci on one contig, each genotyped by a single BAM sweep.
+
+    Returns lists of indices into `candidates`.
+    """
+    order = sorted(range(len(candidates)), key=lambda i: (candidates[i].contig, candidates[i].start))
+    tile_size = max(min_tile_size, -(-len(order) // max(1, n_tiles)))
+    tiles = []
+    for contig, group in groupby(order, key=lambda i: candidates[i].contig):
+        group = list(group)
+        tiles.extend(group[k:k + tile_size] for k in range(0, len(group), tile_size))
+    return tiles
+
+def genotype(candidates, options, max_alignments=500):
+    """Genotype candidates of all SV types in one coordinate-sorted pass over the BAM per contig.
+
+    Each alignment is only tested against the candidates whose window it overlaps. As with a separate fetch per
+    candidate, a candidate considers the first `max_alignments` usable alignments of its window that do not belong to
+    its supporting reads, and breakends stop once `threshold_ref_count` reference reads are found.
+    """
+    bam = pysam.AlignmentFile(options.bam, threads=options.bam_threads)
+
+    by_contig = defaultdict(list)
+    for candidate in candidates:
+        by_contig[candidate.contig].append(candidate)
+
+    for contig, contig_candidates in by_contig.items():
         try:
-            alignment_it = bam.fetch(contig=contig, start=max(0, start-max_bias), stop=min(contig_length, end+max_bias))
-        except ValueError:
+            contig_length = bam.get_reference_length(contig)
+        except KeyError:
             continue
-        #  Count reads that overlap the locus and therefore support the reference
-        aln_no = 0
-        reads_supporting_reference = set()
-
-        while aln_no < 500:
-            try:
-                current_alignment = next(alignment_it)
-            except StopIteration:
-                break
-            if current_alignment.query_name in reads_supporting_variant:
-                continue
+        windows = [(candidate, reference_window(candidate, contig_length)) for candidate in contig_candidates]
+        windows = sorted([(window, candidate) for candidate, window in windows if window is not None], key=lambda w: w[0][4])
+        if not windows:
+            continue
+        window_start = [window[4] for window, _ in windows]
+        window_end = [window[5] for window, _ in windows]
+        reads_supporting_variant = [set(candidate.members) for _, candidate in windows]
+        reads_supporting_reference = [set() for _ in windows]
+        aln_no = [0] * len(windows)
+        done = [False] * len(windows)
+
+        # candidates are activated in window order once an alignment reaches their window and retired when the sweep
+        # has passed their window end, so `active` stays sorted by window start
+        active, pending = [], 0
+        for current_alignment in bam.fetch(contig=contig, start=min(window_start), stop=max(window_end)):
             if current_alignment.is_unmapped or current_alignment.is_secondary or current_alignment.mapping_quality < options.min_mapq:
                 continue
-            aln_no += 1
-            if type == "DEL":
-                minimum_overlap = min((end - start) / 2, 2000)
-                if (current_alignment.reference_start < (end - minimum_overlap) and current_alignment.reference_end > (
-                        end + max_bias) or
-                        current_alignment.reference_start < (start - max_bias) and current_alignment.reference_end > (
-                                start + minimum_overlap)):
-                    reads_supporting_reference.add(current_alignment.query_name)
-            else:
-                if current_alignment.reference_start < (start - max_bias) and current_alignment.reference_end > (end + max_bias):
-                    reads_supporting_reference.add(current_alignment.query_name)
-                    if type == 'BND':
-                        if len(reads_supporting_reference) >= up_bound:
-                            break
-
-        GT, GL, GQ, QUAL = cal_GL(len(reads_supporting_reference), len(reads_supporting_variant), type, options.read)
-
-        candidate.support_fraction = len(reads_supporting_variant) / (len(reads_supporting_variant) + len(reads_supporting_reference))
-        candidate.genotype = GT
-        candidate.ref_reads = len(reads_supporting_reference)
-        candidate.alt_reads = len(reads_supporting_variant)
-
-    return candidates
\ No newline at end of file
+            aln_start = current_alignment.reference_start
+            aln_end = current_alignment.reference_end or aln_start + 1
+            while pending < len(windows) and window_start[pending] < aln_end:
+                active.append(pending)
+                pending += 1
+
+            query_name = current_alignment.query_name
+            retired = False
+            for i in active:
+                if window_start[i] >= aln_end:
+                    break
+                if done[i] or window_end[i] <= aln_start:
+                    retired = True
+                    continue
+                if query_name in reads_supporting_variant[i]:
+                    continue
+                aln_no[i] += 1
+                (start, end, max_bias, up_bound, _, _), candidate = windows[i]
+                if supports_reference(candidate.type, start, end, max_bias, aln_start, aln_end):
+                    reads_supporting_reference[i].add(query_name)
+                    if up_bound is not None and len(reads_supporting_reference[i]) >= up_bound:
+                        done[i] = retired = True
+                if aln_no[i] >= max_alignments:
+                    done[i] = retired = True
+            if retired:
+                active = [i for i in active if not done[i] and window_end[i] > aln_start]
+            if pending == len(windows) and not active:
+                break
+
+        ref_reads = np.array([len(reads) for reads in reads_supporting_reference])
+        alt_reads = np.array([len(reads) for reads in reads_supporting_variant])
+        GT, PL, GQ, QUAL = genotype_likelihoods(ref_reads, alt_reads, options.read)
+        support_fraction = alt_reads / (alt_reads + ref_reads)
+        for i, (_, candidate) in enumerate(windows):
+            candidate.support_fraction = float(support_fraction[i])
+            candidate.genotype = Genotype[GT[i]]
+            candidate.ref_reads = int(ref_reads[i])
+            candidate.alt_reads = int(alt_reads[i])
+
+    return candidates
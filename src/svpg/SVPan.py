@@ -1,11 +1,23 @@
+import os
 import re
-from collections import defaultdict
+import heapq
+import pickle
+import logging
+import tempfile
+import threading
+import subprocess
+from array import array
+from bisect import bisect_right
+from hashlib import blake2b
+from itertools import accumulate, groupby
+from operator import itemgetter
 import numpy as np
 
-from svpg.SVSignature import SignatureDeletion, SignatureInsertion, SignatureDuplicationTandem, SignatureInversion, SignatureTranslocation
+from svpg.SVSignature import SignatureDeletion, SignatureInsertion, SignatureDuplicationTandem, SignatureInversion, SignatureTranslocation, SignatureTable
 from svpg.util import analyze_cigar_indel, merge_cigar, chr_to_sort_key
 
 CIGAR_PATTERN = re.compile(r'(\d+)([MIDNSHP=X])')
+PATH_PATTERN = re.compile(r'[<>][^<>]+')
 
 class Gaf:
     def __init__(self):
@@ -39,14 +51,23 @@ def parse_gaf_line(tokens, gfa_node):
     gafline.query_length = int(tokens[1])
     gafline.query_start = int(tokens[2])
     gafline.query_end = int(tokens[3])
-    gafline.path = re.findall(r'[<>][^<>]+', tokens[5])
+    gafline.path = PATH_PATTERN.findall(tokens[5])
     try:
         gafline.strand = '+' if gafline.path[0][0] == '>' else '-'
         # gafline.strand = tokens[4]
     except IndexError:
         raise ValueError(f"Please check the GAF file format. SVPG expects standard GAF format, refer to readme for GFA and rGFA format.")
-    gafline.contig = gfa_node[gafline.path[0][1:]].contig
-    gafline.offset = gfa_node[gafline.path[0][1:]].offset
+    # resolve the path to node table rows once, all later lookups are list indexing
+    rows = gfa_node.path_rows(gafline.path)
+    gafline.node_id = gfa_node.node_id[rows].tolist()
+    gafline.node_len = gfa_node.length[rows].tolist()
+    gafline.node_offset = gfa_node.offset[rows].tolist()
+    gafline.node_sr = gfa_node.sr[rows].tolist()
+    gafline.node_contig = gfa_node.contig_code[rows].tolist()
+    gafline.node_row = rows
+    gafline.cum_len = list(accumulate(gafline.node_len, initial=0))
+    gafline.contig = gfa_node.contigs[gafline.node_contig[0]]
+    gafline.offset = gafline.node_offset[0]
     gafline.path_length = int(tokens[6])
     gafline.path_start = int(tokens[7])
     gafline.path_end = int(tokens[8])
@@ -64,16 +85,34 @@ def parse_gaf_line(tokens, gfa_node):
 
     return gafline
 
-def decompose_split(g_list, gfa_node):
-    """Parse GAF record to extract SVs from split_reads."""
+def split_record(g):
+    """Reduce a GAF alignment to the linear coordinates used by decompose_split:
+    (q_start, q_end, read_name, ref_id, ref_start, ref_end, is_reverse_start, is_reverse_end)."""
+    strand_start = g.strand
+    strand_end = '+' if g.path[-1][0] == '>' else '-'
+
+    ref_start = g.offset + g.path_start if strand_start == '+' else g.offset + g.node_len[0] - g.path_start
+    # ref_end = g.offset + g.path_end if strand_end == '+' else g.offset + g.node_len[-1] - g.path_end
+    if strand_end == '+':
+        ref_end = g.offset + g.path_end
+    else:
+        if len(g.path) == 1:
+            ref_end = g.offset + g.node_len[-1] - g.path_end
+        else:
+            ref_end = g.node_offset[-1] + g.node_len[-1] - (g.path_end - g.cum_len[-2])
+    ref_start, ref_end = min(ref_start, ref_end), max(ref_start, ref_end)
+
+    return (g.query_start, g.query_end, g.query_name, g.contig, ref_start, ref_end, strand_start == '-', strand_end == '-')
+
+def decompose_split(records):
+    """Parse the split_record()s of one read to extract SVs from split_reads."""
     alignment_list, split_signature = [], []
-    g_list = sorted(g_list, key=lambda g: g.query_start)
+    records = sorted(records, key=lambda r: r[0])
 
     # === Filter short alignments at both ends ===
-    zen = len(g_list)
-    for j in range(len(g_list) - 1, -1, -1):
-        y = g_list[j]
-        aln_len = y.query_end - y.query_start
+    zen = len(records)
+    for j in range(len(records) - 1, -1, -1):
+        aln_len = records[j][1] - records[j][0]
         if aln_len < 2000:
             zen = j
         else:
@@ -83,8 +122,7 @@ def decompose_split(g_list, gfa_node):
 
     zst = 0
     for j in range(zen):
-        y = g_list[j]
-        aln_len = y.query_end - y.query_start
+        aln_len = records[j][1] - records[j][0]
         if aln_len < 2000:
             zst = j + 1
         else:
@@ -92,31 +130,16 @@ def decompose_split(g_list, gfa_node):
     if zen - zst < 2:
         return []
 
-    g_list = g_list[zst:zen]
-    for g in g_list:
-        strand_start = g.strand
-        strand_end = '+' if g.path[-1][0] == '>' else '-'
-
-        ref_start = g.offset + g.path_start if strand_start == '+' else g.offset + gfa_node[g.path[0][1:]].len - g.path_start
-        # ref_end = g.offset + g.path_end if strand_end == '+' else g.offset + gfa_node[g.path[-1][1:]].len - g.path_end
-        if strand_end == '+':
-            ref_end = g.offset + g.path_end
-        else:
-            if len(g.path) == 1:
-                ref_end = g.offset + gfa_node[g.path[-1][1:]].len - g.path_end
-            else:
-                ref_end = gfa_node[g.path[-1][1:]].offset + gfa_node[g.path[-1][1:]].len - (g.path_end - sum(gfa_node[n[1:]].len for n in g.path[:-1]))
-        ref_start, ref_end = min(ref_start, ref_end), max(ref_start, ref_end)
-
+    for q_start, q_end, read_name, ref_id, ref_start, ref_end, is_reverse_start, is_reverse_end in records[zst:zen]:
         alignment_dict = {
-            'read_name': g.query_name,
-            'q_start': g.query_start,
-            'q_end': g.query_end,
-            'ref_id': g.contig,
+            'read_name': read_name,
+            'q_start': q_start,
+            'q_end': q_end,
+            'ref_id': ref_id,
             'ref_start': ref_start,
             'ref_end': ref_end,
-            'is_reverse_start': strand_start == '-',
-            'is_reverse_end': strand_end == '-',
+            'is_reverse_start': is_reverse_start,
+            'is_reverse_end': is_reverse_end,
         }
         alignment_list.append(alignment_dict)
     sorted_alignment_list = sorted(alignment_list, key=lambda aln: (aln['q_start'], aln['q_end']))
@@ -272,16 +295,15 @@ def decompose_split(g_list, gfa_node):
 
     return split_signature
 
-def pan_node_offset(pan_node, node_list, gfa_node):
-    """ Find contig and coordinates for pan_node according to linear_node """
+def pan_node_offset(g, node_index, gfa_node):
+    """ Find contig and coordinates for the pan node at g.path[node_index] according to linear_node """
     pan_len = 0
-    for node in node_list[node_list.index(pan_node):]:
-        node_id = node[1:]
-        if gfa_node[node[1:]].sr == 0:
-            node_contig = gfa_node[node_id].contig
-            node_offset = gfa_node[node_id].offset - pan_len
+    for i in range(g.path.index(g.path[node_index]), len(g.path)):
+        if g.node_sr[i] == 0:
+            node_contig = gfa_node.contigs[g.node_contig[i]]
+            node_offset = g.node_offset[i] - pan_len
             return (node_contig, node_offset)
-        pan_len += gfa_node[node_id].len
+        pan_len += g.node_len[i]
     else:
         return None
 
@@ -295,23 +317,18 @@ def extract_tsd_alt(ds_seq):
     else:
         return "", ds_seq, ""
 
-def get_node_index_for_pos(pos, cum_lengths):
-    for i in range(len(cum_lengths)-1):
-        if cum_lengths[i] <= pos < cum_lengths[i+1]:
-            return i
+def get_node_index_for_pos(pos, cum_lengths, lo=0):
+    i = bisect_right(cum_lengths, pos, lo) - 1
+    if lo <= i < len(cum_lengths) - 1 and cum_lengths[i] <= pos < cum_lengths[i + 1]:
+        return i
     return None
 
 def decompose_cigars(g, gfa_node, options, min_indel_length=50):
     sigs = []
     node_list = g.path  # ['>s1','>s2']
+    first_node_len = g.node_len[0]
 
-    first_node = node_list[0]
-    first_node_len = gfa_node[first_node[1:]].len
-
-    hap_contigs = set()
-    for node in node_list:
-        node_contig = gfa_node[node[1:]].contig
-        hap_contigs.add(node_contig)
+    hap_contigs = set(g.node_contig)
     if options.read == 'hifi':
         if g.strand == '-' and len(hap_contigs) >= 2:## if g.strand == '-':return []
             return []
@@ -328,11 +345,8 @@ def decompose_cigars(g, gfa_node, options, min_indel_length=50):
     else:
         return []
 
-    effective_first_len = first_node_len - g.path_start
-    cum_lengths = [0, effective_first_len]
-    for node in node_list[1:]:
-        node_len = gfa_node[node[1:]].len
-        cum_lengths.append(cum_lengths[-1] + node_len)
+    # path coordinates of node boundaries, relative to path_start
+    cum_lengths = [0] + [cum - g.path_start for cum in g.cum_len[1:]]
 
     ref_chr = g.contig
     global_ref = g.offset + g.path_start
@@ -363,36 +377,27 @@ def decompose_cigars(g, gfa_node, options, min_indel_length=50):
                 else:
                     start = global_ref - pos_ref - length
             else:  # find global_ref according to node offset
-                start_index = max(0, last_found_node_index)
-                for i in range(start_index, len(node_list)):
-                    node = node_list[i]
-                    node_name = node[1:]
-                    node_len = gfa_node[node_name].len
-
-                    node_start_ref = cum_lengths[i]
-                    node_end_ref = cum_lengths[i + 1]
-
-                    if node_start_ref <= pos_ref < node_end_ref:
-                        last_found_node_index = i
-
-                        if gfa_node[node_name].sr == 0:  # the node is a linear node
-                            global_ref = gfa_node[node_name].offset
-                        else:  # the node is a pan node
-                            node_result = pan_node_offset(node, node_list, gfa_node)
-                            if not node_result:
-                                break
-                            else:
-                                global_ref = node_result[1]
-
-                        local_ref = pos_ref - node_start_ref
-                        if node[0] == '>':  # the node is forward
+                i = get_node_index_for_pos(pos_ref, cum_lengths, max(0, last_found_node_index))
+                if i is not None:
+                    last_found_node_index = i
+                    node_len = g.node_len[i]
+                    if g.node_sr[i] == 0:  # the node is a linear node
+                        global_ref = g.node_offset[i]
+                        node_result = True
+                    else:  # the node is a pan node
+                        node_result = pan_node_offset(g, i, gfa_node)
+                        if node_result:
+                            global_ref = node_result[1]
+
+                    if node_result:
+                        local_ref = pos_ref - cum_lengths[i]
+                        if node_list[i][0] == '>':  # the node is forward
                             start = global_ref + local_ref
                         else:  # the node is reverse
                             if typ == "INS":
                                 start = global_ref + node_len - local_ref
                             else:
                                 start = global_ref + node_len - local_ref - length
-                        break
         if start is None:
             continue
 
@@ -414,160 +419,421 @@ def calculate_euclidean_distance_sigs(sig1, sig2, weights=[1, 5]):
     return dist
 
 
-def read_gaf(gfa_node, options):
-    """Parse SVsignatures GAF record to extract SVs."""
-    sv_signatures = []
-    read_dict = {}
-    j, k, e = 0, 0, 0
-    min_sv_size = options.min_sv_size
-    with open(options.working_dir + '/signatures.gaf', 'r') as gaf_file:
-        for line in gaf_file:
-            tokens = line.strip().split('\t')
-            if tokens[4] == '*':
-                continue
+def query_hash(name):
+    """Stable 64-bit hash of a query name."""
+    return int.from_bytes(blake2b(name.encode(), digest_size=8).digest(), 'little', signed=True)
 
-            g = parse_gaf_line(tokens, gfa_node)
-            if g.mapping_quality < options.min_mapq:
-                continue
 
-            node_list = g.path  # ['>s1','>s2','>s3']
-            if gfa_node[node_list[0][1:]].sr != 0:
-                continue
+def duplicate_count(hashes):
+    """Number of repeated values in an array of query name hashes."""
+    hashes = np.asarray(hashes, dtype=np.int64)
+    return len(hashes) - len(np.unique(hashes))
 
-            if tokens[0] in read_dict:
-                read_dict[tokens[0]].append(g)
-            else:
-                read_dict[tokens[0]] = [g]
-
-            node_sr = [gfa_node[node[1:]].sr for node in node_list]
-            sigs = []
-
-            if sum(node_sr) == 0:
-                for node_current, node_next in zip(node_list[:-1], node_list[1:]):
-                    # map to non-adjacent nodes, ['>s1', '>s3']
-                    split_node_temp = list(range(min(int(node_current[2:]), int(node_next[2:])) + 1,
-                                                 max(int(node_current[2:]), int(node_next[2:]))))
-                    if len(split_node_temp) > 0:
-                        if node_current[0] == '>':  # ['>s1', '>s3']
-                            start = gfa_node[node_current[1:]].offset + gfa_node[node_current[1:]].len
-                            end = gfa_node[node_next[1:]].offset
-                        else:  # ['<s3', '>s1']
-                            start = gfa_node[node_next[1:]].offset
-                            end = gfa_node[node_current[1:]].offset
-                        sigs.append(SignatureDeletion(g.contig, start, end - start, "ref_split", g.query_name, pan_node=split_node_temp))
-
-                sigs_cigar = decompose_cigars(g, gfa_node, options, min_sv_size)
-                sigs.extend(sigs_cigar)
-            else:
-                sigs_liner_pan = decompose_cigars(g, gfa_node, options, min_indel_length=10)
-                sigs_cigar = [sig for sig in sigs_liner_pan if sig.svlen >= min_sv_size]
-
-                linear_index = [i for i, x in enumerate(node_sr) if x == 0]
-                linear_node = [node_list[i] for i in linear_index]
-                for node_current, node_next in zip(linear_node[:-1], linear_node[1:]):
-                    if node_current[0] == '>':
-                        start = gfa_node[node_current[1:]].offset + gfa_node[node_current[1:]].len
-                        # Only retaining the cigar SVs of the linear nodes
-                        sigs_cigar = [sig for sig in sigs_cigar if
-                                      not (start <= sig.start <= gfa_node[node_next[1:]].offset)]
-                    else:
-                        start = gfa_node[node_next[1:]].offset
-                        sigs_cigar = [sig for sig in sigs_cigar if
-                                      not (start <= sig.start <= gfa_node[node_current[1:]].offset)]
-                    split_node_temp = list(range(min(int(node_current[2:]), int(node_next[2:])) + 1,
-                                                 max(int(node_current[2:]), int(node_next[2:]))))
-                    split_len = sum([gfa_node['s' + str(node)].len for node in split_node_temp])
-                    pan_node = node_list[node_list.index(node_current) + 1:node_list.index(node_next)]
-
-                    # map to a pan node: insertion
-                    if pan_node:
-                        length = sum([gfa_node[pan[1:]].len for pan in pan_node])
-                        for indel in sigs_liner_pan:
-                            if start <= indel.start <= start + length:  # cigar SVs in the pan node
-                                if indel.type == "DEL":
-                                    length -= indel.svlen
-                                else:
-                                    length += indel.svlen
-                        if length - split_len >= min_sv_size:
-                            alt_seq = ''.join([gfa_node[node[1:]].sequence for node in pan_node])
-                            sigs.append(SignatureInsertion(g.contig, start, length - split_len, "ref_split", g.query_name, alt_seq=alt_seq, pan_node=pan_node))
-
-                    if len(split_node_temp) > 0:  # map to a missing linear nodes: deletion
-                        if sum([gfa_node['s' + str(node)].len for node in split_node_temp]) < min_sv_size:
-                            continue
-                        if node_current[0] == '>':
-                            end = gfa_node[node_next[1:]].offset
-                        else:
-                            end = gfa_node[node_current[1:]].offset
-                        if pan_node and length >= min_sv_size:  # the pan node inserted in the middle
-                            end -= length
-                        if end - start >= min_sv_size:
-                            sigs.append(SignatureDeletion(g.contig, start, end - start, "ref_split", g.query_name))
-
-                sigs = sigs+sigs_cigar
-
-            sigs = [sig for sig in sigs if sig.type == g.type]
-
-            sigs_ = []
-            # Find the closest SV record
-            bam_pos = g.pos.split(':')
-            bam_len = int(bam_pos[2]) - int(bam_pos[1])
-            bam_seq = g.bam_seq
-            if len(sigs) > 1:
-                dis = calculate_euclidean_distance_sigs([bam_pos[1], bam_len], [[sig.start, sig.svlen] for sig in sigs])
-                min_index = np.argmin(dis)
-                sigs_ = [sigs[min_index]]
-            elif len(sigs) == 1:
-                sigs_ = sigs
-
-            if not sigs_ or (sigs_ and min(sigs_[0].svlen, bam_len) / max(sigs_[0].svlen, bam_len) < 0.7):
-                if g.type == "INS":
-                    sv_signatures.append(SignatureInsertion(bam_pos[0], int(bam_pos[1]), bam_len, "inconsistent", g.query_name, alt_seq=bam_seq))
+
+class QueryGrouper:
+    """Streaming group-by over the query names of consecutive GAF alignments.
+
+    minigraph writes all alignments of a query next to each other, so a group is complete as soon as the
+    query name changes and add() returns it as (name, records). Only one group is held in memory, plus an
+    8-byte hash per query so that interleaved queries can be detected afterwards with duplicate_count.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.records = []
+        self.hashes = array('q')
+
+    def add(self, name, record):
+        finished = None
+        if name != self.name:
+            finished = self.finish()
+            self.name = name
+            self.hashes.append(query_hash(name))
+        self.records.append(record)
+        return finished
+
+    def finish(self):
+        finished = (self.name, self.records) if self.name is not None else None
+        self.name, self.records = None, []
+        return finished
+
+
+def iter_gaf_alignments(lines, gfa_node, options):
+    """Yield (tokens, Gaf) for the mapped GAF lines passing MAPQ that start on a linear node."""
+    for line in lines:
+        tokens = line.strip().split('\t')
+        if tokens[4] == '*':
+            continue
+        g = parse_gaf_line(tokens, gfa_node)
+        if g.mapping_quality < options.min_mapq:
+            continue
+        if g.node_sr[0] != 0:
+            continue
+        yield tokens, g
+
+
+def _spill_run(batch, tmp_dir):
+    """Write a name-sorted batch of (name, seq, record) to a temporary file and return a reader over it."""
+    run = tempfile.TemporaryFile(dir=tmp_dir)
+    batch.sort()
+    for i in range(0, len(batch), 10000):
+        pickle.dump(batch[i:i + 10000], run, protocol=pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+
+    def reader():
+        with run:
+            while True:
+                try:
+                    yield from pickle.load(run)
+                except EOFError:
+                    return
+    return reader()
+
+
+def decompose_split_external(gaf_path, gfa_node, options, run_size=1000000):
+    """Decompose split alignments of a GAF file that is not grouped by query name.
+
+    The split_record()s are sorted by query name in runs of `run_size` that are spilled to the working
+    directory and merged back, so memory stays bounded by the run size rather than the file size.
+    """
+    logging.info(f"{gaf_path} is not grouped by query name, grouping split alignments with an external sort.")
+    runs, batch = [], []
+    lines = iter_gaf_lines(gaf_path)
+    for seq, (tokens, g) in enumerate(iter_gaf_alignments(lines, gfa_node, options)):
+        batch.append((tokens[0], seq, split_record(g)))
+        if len(batch) >= run_size:
+            runs.append(_spill_run(batch, options.working_dir))
+            batch = []
+    batch.sort()
+    runs.append(iter(batch))
+
+    split_signatures = []
+    for name, group in groupby(heapq.merge(*runs), key=itemgetter(0)):
+        records = [record for _, _, record in group]
+        if len(records) > 1:
+            split_signatures.extend(decompose_split(records))
+    return split_signatures
+
+
+def minigraph_gaf_lines(records, options, num_threads):
+    """Align FASTA `records` ((name, sequence) pairs) with minigraph on `num_threads` threads and yield its GAF lines.
+
+    Records are written to minigraph's stdin from a background thread while the GAF lines are consumed, so producing,
+    aligning and parsing the signatures overlap and no intermediate files are written. Raises RuntimeError when
+    minigraph exits with an error; an exception raised by `records` is re-raised once minigraph has finished.
+    """
+    preset = 'asm' if options.read == 'hifi' else 'lr'
+    cmd = ['minigraph', '-t', str(num_threads), '-cx', preset, '--vc', '--secondary', 'yes', options.gfa, '-']
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1024 * 1024)
+    writer_error = []
+
+    def write_records():
+        try:
+            for name, seq in records:
+                proc.stdin.write(f'>{name}\n{seq}\n')
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            writer_error.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=write_records, daemon=True)
+    writer.start()
+    try:
+        yield from proc.stdout
+    finally:
+        proc.stdout.close()
+        writer.join()
+        returncode = proc.wait()
+    if writer_error:
+        raise writer_error[0]
+    if returncode != 0:
+        raise RuntimeError(f"minigraph exited with status {returncode}: {' '.join(cmd)}")
+
+
+def read_gaf(gfa_node, options, lines=None):
+    """Parse SVsignatures GAF record to extract SVs.
+
+    `lines` are the GAF lines to parse, by default those of signatures.gaf in the working directory. Streamed lines
+    must be grouped by query name, as minigraph writes them, since they cannot be read a second time.
+    """
+    gaf_path = None
+    if lines is None:
+        gaf_path = options.working_dir + '/signatures.gaf'
+        lines = iter_gaf_lines(gaf_path)
+    sv_signatures, split_signatures = [], []
+    grouper = QueryGrouper()
+    min_sv_size = options.min_sv_size
+
+    def on_group(group):
+        if group is not None and len(group[1]) > 1:
+            split_signatures.extend(decompose_split(group[1]))
+
+    for tokens, g in iter_gaf_alignments(lines, gfa_node, options):
+        node_list = g.path  # ['>s1','>s2','>s3']
+        node_sr, node_id, node_len, node_offset = g.node_sr, g.node_id, g.node_len, g.node_offset
+        on_group(grouper.add(tokens[0], split_record(g)))
+
+        sigs = []
+
+        if sum(node_sr) == 0:
+            for i in range(len(node_list) - 1):
+                # map to non-adjacent nodes, ['>s1', '>s3']
+                split_node_temp = list(range(min(node_id[i], node_id[i + 1]) + 1, max(node_id[i], node_id[i + 1])))
+                if len(split_node_temp) > 0:
+                    if node_list[i][0] == '>':  # ['>s1', '>s3']
+                        start = node_offset[i] + node_len[i]
+                        end = node_offset[i + 1]
+                    else:  # ['<s3', '>s1']
+                        start = node_offset[i + 1]
+                        end = node_offset[i]
+                    sigs.append(SignatureDeletion(g.contig, start, end - start, "ref_split", g.query_name, pan_node=split_node_temp))
+
+            sigs_cigar = decompose_cigars(g, gfa_node, options, min_sv_size)
+            sigs.extend(sigs_cigar)
+        else:
+            sigs_liner_pan = decompose_cigars(g, gfa_node, options, min_indel_length=10)
+            sigs_cigar = [sig for sig in sigs_liner_pan if sig.svlen >= min_sv_size]
+
+            linear_index = [i for i, x in enumerate(node_sr) if x == 0]
+            for current, following in zip(linear_index[:-1], linear_index[1:]):
+                if node_list[current][0] == '>':
+                    start = node_offset[current] + node_len[current]
+                    # Only retaining the cigar SVs of the linear nodes
+                    sigs_cigar = [sig for sig in sigs_cigar if
+                                  not (start <= sig.start <= node_offset[following])]
                 else:
-                    sv_signatures.append(SignatureDeletion(bam_pos[0], int(bam_pos[1]), bam_len, "inconsistent", g.query_name))
-                continue
+                    start = node_offset[following]
+                    sigs_cigar = [sig for sig in sigs_cigar if
+                                  not (start <= sig.start <= node_offset[current])]
+                low_id, high_id = min(node_id[current], node_id[following]), max(node_id[current], node_id[following])
+                split_len = gfa_node.span_length(low_id, high_id)
+                pan_start, pan_end = node_list.index(node_list[current]) + 1, node_list.index(node_list[following])
+                # signed node ids of the traversed pan nodes, negative for reverse steps
+                pan_node = [node_id[i] if node_list[i][0] == '>' else -node_id[i] for i in range(pan_start, pan_end)]
+
+                # map to a pan node: insertion
+                if pan_node:
+                    length = g.cum_len[pan_end] - g.cum_len[pan_start]
+                    for indel in sigs_liner_pan:
+                        if start <= indel.start <= start + length:  # cigar SVs in the pan node
+                            if indel.type == "DEL":
+                                length -= indel.svlen
+                            else:
+                                length += indel.svlen
+                    if length - split_len >= min_sv_size:
+                        alt_seq = ''.join([gfa_node.sequence(row) for row in g.node_row[pan_start:pan_end].tolist()])
+                        sigs.append(SignatureInsertion(g.contig, start, length - split_len, "ref_split", g.query_name, alt_seq=alt_seq, pan_node=pan_node))
 
-            sv_signatures.extend(sigs_)
+                if high_id - low_id > 1:  # map to a missing linear nodes: deletion
+                    if split_len < min_sv_size:
+                        continue
+                    if node_list[current][0] == '>':
+                        end = node_offset[following]
+                    else:
+                        end = node_offset[current]
+                    if pan_node and length >= min_sv_size:  # the pan node inserted in the middle
+                        end -= length
+                    if end - start >= min_sv_size:
+                        sigs.append(SignatureDeletion(g.contig, start, end - start, "ref_split", g.query_name))
+
+            sigs = sigs+sigs_cigar
+
+        sigs = [sig for sig in sigs if sig.type == g.type]
+
+        sigs_ = []
+        # Find the closest SV record
+        bam_pos = g.pos.split(':')
+        bam_len = int(bam_pos[2]) - int(bam_pos[1])
+        bam_seq = g.bam_seq
+        if len(sigs) > 1:
+            dis = calculate_euclidean_distance_sigs([bam_pos[1], bam_len], [[sig.start, sig.svlen] for sig in sigs])
+            min_index = np.argmin(dis)
+            sigs_ = [sigs[min_index]]
+        elif len(sigs) == 1:
+            sigs_ = sigs
+
+        if not sigs_ or (sigs_ and min(sigs_[0].svlen, bam_len) / max(sigs_[0].svlen, bam_len) < 0.7):
+            if g.type == "INS":
+                sv_signatures.append(SignatureInsertion(bam_pos[0], int(bam_pos[1]), bam_len, "inconsistent", g.query_name, alt_seq=bam_seq))
+            else:
+                sv_signatures.append(SignatureDeletion(bam_pos[0], int(bam_pos[1]), bam_len, "inconsistent", g.query_name))
+            continue
 
-    for key, value in read_dict.items():
-        if len(value) > 1:
-            e += 1
-            var_split = decompose_split(value, gfa_node)
-            sv_signatures.extend(var_split)
+        sv_signatures.extend(sigs_)
+
+    on_group(grouper.finish())
+    if duplicate_count(grouper.hashes):
+        if gaf_path is None:
+            raise RuntimeError("Streamed GAF alignments are not grouped by query name.")
+        split_signatures = decompose_split_external(gaf_path, gfa_node, options)
+
+    return SignatureTable.from_signatures(sv_signatures + split_signatures)
+
+
+def split_gaf(gaf_path, n_chunks):
+    """Split a GAF file into byte ranges, moving every boundary to the first line of a new query name."""
+    size = os.path.getsize(gaf_path)
+    bounds = [0]
+    with open(gaf_path, 'rb') as gaf_file:
+        for k in range(1, n_chunks):
+            gaf_file.seek(max(size * k // n_chunks, bounds[-1]))
+            gaf_file.readline()  # move to the next line start
+            query_name = None
+            while True:
+                line_start = gaf_file.tell()
+                line = gaf_file.readline()
+                if not line:
+                    break
+                name = line.split(b'\t', 1)[0]
+                if query_name is None:
+                    query_name = name
+                elif name != query_name:
+                    break
+            if not line:
+                break
+            if line_start > bounds[-1]:
+                bounds.append(line_start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_gaf_lines(gaf_path, start=0, end=None):
+    """Yield the decoded lines of a GAF file within the byte range [start, end)."""
+    with open(gaf_path, 'rb') as gaf_file:
+        gaf_file.seek(start)
+        pos = start
+        for line in gaf_file:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line.decode()
 
-    return sv_signatures
 
+def collect_gaf_pan(lines, gfa_node, options, on_group):
+    """Extract CIGAR signatures from WGS GAF lines.
 
-def read_gaf_pan(gfa_node, options):
-    """Parse WGS GAF record to extract SVs."""
+    The split_record()s of the passing alignments are grouped by query name while streaming, and each
+    finished group is handed to `on_group`. Returns the CIGAR signatures and the QueryGrouper.
+    """
     sv_signatures = []
-    read_dict = defaultdict(list)
+    grouper = QueryGrouper()
 
-    with open(options.gaf, 'r') as gaf_file:
-        for line in gaf_file:
-            tokens = line.strip().split('\t')
-            if tokens[4] == '*':
-                continue
-            g = parse_gaf_line(tokens, gfa_node)
-            if g.mapping_quality < options.min_mapq:
-                continue
+    for tokens, g in iter_gaf_alignments(lines, gfa_node, options):
+        finished = grouper.add(tokens[0], split_record(g))
+        if finished is not None:
+            on_group(finished)
 
-            if gfa_node[g.path[0][1:]].sr != 0:
-                continue
-            read_dict[tokens[0]].append(g)
+        if g.query_end - g.query_start < g.query_length * 0.7:  # filter cigar in short alignments
+            continue
 
-            if g.query_end - g.query_start < g.query_length * 0.7:  # filter cigar in short alignments
-                continue
+        sigs = decompose_cigars(g, gfa_node, options)
+        if len(sigs) > 1 and len(sigs) > g.query_length * 1e-4 * 2:
+            continue
+        sigs_merged = merge_cigar(sigs, max_merge=options.max_merge_threshold)
+        sv_signatures.extend(sigs_merged)
 
-            sigs = decompose_cigars(g, gfa_node, options)
-            if len(sigs) > 1 and len(sigs) > g.query_length * 1e-4 * 2:
-                continue
-            sigs_merged = merge_cigar(sigs, max_merge=options.max_merge_threshold)
-            sv_signatures.extend(sigs_merged)
+    return sv_signatures, grouper
 
-    for key, value in read_dict.items():
-        if len(value) > 1:
-            var_split = decompose_split(value, gfa_node)
-            sv_signatures.extend(var_split)
 
-    return sv_signatures
\ No newline at end of file
+def read_gaf_pan(gfa_node, options):
+    """Parse WGS GAF record to extract SVs."""
+    split_signatures = []
+
+    def on_group(group):
+        if len(group[1]) > 1:
+            split_signatures.extend(decompose_split(group[1]))
+
+    sv_signatures, grouper = collect_gaf_pan(iter_gaf_lines(options.gaf), gfa_node, options, on_group)
+    last_group = grouper.finish()
+    if last_group is not None:
+        on_group(last_group)
+    if duplicate_count(grouper.hashes):
+        split_signatures = decompose_split_external(options.gaf, gfa_node, options)
+
+    return SignatureTable.from_signatures(sv_signatures + split_signatures)
+
+
+def read_gaf_pan_chunk(gfa_node, options, start, end):
+    """Parse one byte range of a query-grouped WGS GAF (see split_gaf).
+
+    Split alignments are decomposed for every query inside the range. The groups of the first and last
+    query name are returned undecomposed as (name, records) because they may continue in the
+    neighbouring ranges, together with the hashes of all query names; merge_gaf_chunks joins them. The
+    CIGAR and split signatures are returned as SignatureTables.
+    """
+    edge_names = []  # first and last query name of the range
+    split_signatures = []
+    head = None
+
+    def track(lines):
+        for line in lines:
+            name = line.split('\t', 1)[0]
+            if not edge_names:
+                edge_names.append(name)
+            edge_names[1:] = [name]
+            yield line
+
+    def on_group(group):
+        nonlocal head, first
+        if first and group[0] == edge_names[0]:
+            head = group
+        elif len(group[1]) > 1:
+            split_signatures.extend(decompose_split(group[1]))
+        first = False
+
+    first = True
+    sv_signatures, grouper = collect_gaf_pan(track(iter_gaf_lines(options.gaf, start, end)), gfa_node, options, on_group)
+    tail = grouper.finish()
+    if tail is not None and tail[0] != edge_names[-1]:
+        if first and tail[0] == edge_names[0]:
+            head = tail
+        elif len(tail[1]) > 1:
+            split_signatures.extend(decompose_split(tail[1]))
+        tail = None
+
+    return (SignatureTable.from_signatures(sv_signatures), SignatureTable.from_signatures(split_signatures),
+            head, tail, np.frombuffer(grouper.hashes, dtype=np.int64))
+
+
+def merge_gaf_chunks(chunk_results):
+    """Reduce the read_gaf_pan_chunk results of consecutive byte ranges, in file order.
+
+    Edge groups of the same query in neighbouring ranges are joined before decomposition, and the
+    signatures are returned in the same order as read_gaf_pan. Returns None when a query name occurs in
+    more than one place that is not a range boundary, i.e. the GAF is not grouped by query name.
+    """
+    sv_tables, split_tables = [], []
+    pending = None
+    merges = 0
+
+    def flush(group):
+        if group is not None and len(group[1]) > 1:
+            split_tables.append(SignatureTable.from_signatures(decompose_split(group[1])))
+
+    for cigar_sigs, chunk_split_sigs, head, tail, _ in chunk_results:
+        sv_tables.append(cigar_sigs)
+        for edge in (head, tail):
+            if edge is None:
+                continue
+            if pending is not None and edge[0] == pending[0]:
+                pending[1].extend(edge[1])
+                merges += 1
+            else:
+                flush(pending)
+                pending = edge
+            if edge is head:
+                flush(pending)
+                pending = None
+                split_tables.append(chunk_split_sigs)
+        if head is None:
+            split_tables.append(chunk_split_sigs)
+    flush(pending)
+
+    if duplicate_count(np.concatenate([r[4] for r in chunk_results])) != merges:
+        return None
+    return SignatureTable.concat(sv_tables + split_tables)
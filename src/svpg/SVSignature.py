@@ -1,3 +1,8 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
 class Signature:
     """Signature class for basic signatures of structural variants. An signature is always detected from a single read.
     """
@@ -40,6 +45,9 @@ class SignatureDeletion(Signature):
         self.svlen = length
         self.pos_read = pos_read
         self.read_seq = read_seq
+        # read_seq may be a window of the read starting at read position seq_offset
+        self.seq_offset = 0
+        self.read_len = len(read_seq) if read_seq is not None else None
         self.node_ls = pan_node
         self.phase = phase
 
@@ -59,6 +67,9 @@ class SignatureInsertion(Signature):
         self.svlen = length
         self.pos_read = pos_read
         self.read_seq = read_seq
+        # read_seq may be a window of the read starting at read position seq_offset
+        self.seq_offset = 0
+        self.read_len = len(read_seq) if read_seq is not None else None
         self.alt_seq = alt_seq
         self.node_ls = pan_node
         self.phase = phase
@@ -162,4 +173,348 @@ class SignatureBreakpoint(Signature):
         return (self.contig2, self.pos2, self.pos2 + 1)
 
     def get_key(self):
-        return (self.type, self.contig1, self.pos1)
\ No newline at end of file
+        return (self.type, self.contig1, self.pos1)
+
+# read bases kept on each side of a CIGAR signature, enough for the signature FASTA and realignment
+READ_FLANK = 2000
+
+SV_TYPES = ["DEL", "INS", "INV", "DUP", "BND"]
+SV_TYPE_CODE = {svtype: code for code, svtype in enumerate(SV_TYPES)}
+
+
+class SignatureView:
+    """Read-only row of a SignatureTable with the attributes and methods of the Signature classes."""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    @property
+    def type(self):
+        return SV_TYPES[self._table.sv_type[self._row]]
+
+    @property
+    def contig(self):
+        return self._table.contigs[self._table.contig[self._row]]
+
+    @property
+    def start(self):
+        return int(self._table.start[self._row])
+
+    @property
+    def end(self):
+        return int(self._table.end[self._row])
+
+    @property
+    def svlen(self):
+        return int(self._table.svlen[self._row])
+
+    @property
+    def signature(self):
+        return self._table.labels[self._table.source[self._row]]
+
+    @property
+    def read_name(self):
+        return self._table.read_names[self._table.read[self._row]]
+
+    @property
+    def pos_read(self):
+        pos_read = self._table.pos_read[self._row]
+        return int(pos_read) if pos_read >= 0 else None
+
+    @property
+    def phase(self):
+        phase = self._table.phase[self._row]
+        return int(phase) if phase >= 0 else None
+
+    @property
+    def read_seq(self):
+        index = self._table.read_seq[self._row]
+        return self._table.read_seqs[index] if index >= 0 else None
+
+    @property
+    def seq_offset(self):
+        return int(self._table.seq_offset[self._row])
+
+    @property
+    def read_len(self):
+        read_len = self._table.read_len[self._row]
+        return int(read_len) if read_len >= 0 else None
+
+    @property
+    def alt_seq(self):
+        index = self._table.alt_seq[self._row]
+        return self._table.alt_seqs[index] if index >= 0 else None
+
+    @property
+    def node_ls(self):
+        return self._table.node_list(self._row)
+
+    @property
+    def direction(self):
+        return self._table.label(self._table.direction[self._row])
+
+    @property
+    def contig1(self):
+        return self.contig
+
+    @property
+    def pos1(self):
+        return self.start
+
+    @property
+    def source_direction(self):
+        return self.direction
+
+    @property
+    def contig2(self):
+        code = self._table.contig2[self._row]
+        return self._table.contigs[code] if code >= 0 else None
+
+    @property
+    def pos2(self):
+        return int(self._table.pos2[self._row])
+
+    @property
+    def dest_direction(self):
+        return self._table.label(self._table.direction2[self._row])
+
+    def read_window(self, start, end):
+        """Bases of the read between read positions start and end, as far as read_seq holds them."""
+        offset = self.seq_offset
+        return self.read_seq[max(start - offset, 0):max(end - offset, 0)]
+
+    def get_source(self):
+        return (self.contig, self.start, self.end)
+
+    def get_destination(self):
+        pos2 = self.pos2
+        return (self.contig2, pos2, pos2 + 1)
+
+    def get_key(self):
+        if self.type in ("INS", "BND"):
+            return (self.type, self.contig, self.start)
+        return self.get_source()
+
+    def downstream_distance_to(self, signature2):
+        """Return distance >= 0 between this signature's end (start for insertions) and the start of signature2."""
+        if self.type == signature2.type and self.contig == signature2.contig:
+            return max(0, signature2.start - (self.start if self.type == "INS" else self.end))
+        else:
+            return float("inf")
+
+
+class SignatureTable(Sequence):
+    """Struct-of-arrays store of SV signatures.
+
+    Every signature is one row of the numeric columns below. Strings are kept once in pools that the
+    columns index into: contig names, labels (signature source and INV/BND directions), read names, read
+    sequences (or the windows of them held by the signatures, see seq_offset) and inserted sequences; -1
+    marks a missing value. Pan-genome nodes of a row are
+    nodes[node_offset[row]:node_offset[row + 1]]. Breakends store pos1 in start (end = pos1 + 1) and the
+    mate position in contig2/pos2.
+
+    Indexing a row returns a SignatureView. take() returns a sub-table that shares the string pools, and
+    pickling a table only writes the pool entries it references, so moving signatures between processes
+    costs a few buffer copies instead of one pickle per signature object.
+    """
+    COLUMNS = [
+        ('sv_type', 'i1'),
+        ('contig', '<i4'),
+        ('start', '<i8'),
+        ('end', '<i8'),
+        ('svlen', '<i8'),
+        ('source', '<i4'),
+        ('read', '<i8'),
+        ('pos_read', '<i8'),
+        ('phase', '<i8'),
+        ('read_seq', '<i8'),
+        ('seq_offset', '<i8'),
+        ('read_len', '<i8'),
+        ('alt_seq', '<i8'),
+        ('contig2', '<i4'),
+        ('pos2', '<i8'),
+        ('direction', '<i4'),
+        ('direction2', '<i4'),
+    ]
+    POOLS = ['contigs', 'labels', 'read_names', 'read_seqs', 'alt_seqs']
+
+    def __init__(self, columns, node_offset, nodes, contigs, labels, read_names, read_seqs, alt_seqs):
+        for col, dtype in self.COLUMNS:
+            setattr(self, col, np.asarray(columns[col], dtype=dtype))
+        self.node_offset = np.asarray(node_offset, dtype=np.int64)
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        self.contigs = contigs
+        self.labels = labels
+        self.read_names = read_names
+        self.read_seqs = read_seqs
+        self.alt_seqs = alt_seqs
+
+    @classmethod
+    def empty(cls):
+        return cls({col: [] for col, _ in cls.COLUMNS}, [0], [], [], [], [], [], [])
+
+    @classmethod
+    def from_signatures(cls, signatures):
+        """Build a table from Signature objects (or SignatureViews)."""
+        columns = {col: [] for col, _ in cls.COLUMNS}
+        node_offset, nodes = [0], []
+        pools = {pool: [] for pool in cls.POOLS}
+        codes = {'contigs': {}, 'labels': {}, 'read_names': {}, 'read_seqs': {}}
+
+        def code(pool, value, key=None):
+            if value is None:
+                return -1
+            key = value if key is None else key
+            index = codes[pool].get(key)
+            if index is None:
+                index = codes[pool][key] = len(pools[pool])
+                pools[pool].append(value)
+            return index
+
+        for sig in signatures:
+            is_bnd = sig.type == "BND"
+            start = sig.pos1 if is_bnd else sig.start
+            columns['sv_type'].append(SV_TYPE_CODE[sig.type])
+            columns['contig'].append(code('contigs', sig.contig))
+            columns['start'].append(start)
+            columns['end'].append(start + 1 if is_bnd else sig.end)
+            columns['svlen'].append(sig.svlen)
+            columns['source'].append(code('labels', sig.signature))
+            columns['read'].append(code('read_names', sig.read_name))
+            pos_read, phase = getattr(sig, 'pos_read', None), getattr(sig, 'phase', None)
+            columns['pos_read'].append(-1 if pos_read is None else pos_read)
+            columns['phase'].append(-1 if phase is None else phase)
+            # the whole read is shared by all signatures of a read, store it once
+            read_seq = getattr(sig, 'read_seq', None)
+            read_len = getattr(sig, 'read_len', None)
+            columns['read_seq'].append(code('read_seqs', read_seq, id(read_seq)))
+            columns['seq_offset'].append(getattr(sig, 'seq_offset', 0))
+            columns['read_len'].append(-1 if read_len is None else read_len)
+            alt_seq = getattr(sig, 'alt_seq', None)
+            if alt_seq is None:
+                columns['alt_seq'].append(-1)
+            else:
+                columns['alt_seq'].append(len(pools['alt_seqs']))
+                pools['alt_seqs'].append(alt_seq)
+            columns['contig2'].append(code('contigs', sig.contig2) if is_bnd else -1)
+            columns['pos2'].append(sig.pos2 if is_bnd else -1)
+            columns['direction'].append(code('labels', sig.source_direction if is_bnd else getattr(sig, 'direction', None)))
+            columns['direction2'].append(code('labels', sig.dest_direction) if is_bnd else -1)
+            node_ls = getattr(sig, 'node_ls', None)
+            if node_ls:
+                nodes.extend(node_ls)
+            node_offset.append(len(nodes))
+
+        return cls(columns, node_offset, nodes, **pools)
+
+    @classmethod
+    def concat(cls, tables):
+        """Concatenate tables, merging their string pools."""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+        if len(tables) == 1:
+            return tables[0]
+
+        columns = {col: [] for col, _ in cls.COLUMNS}
+        node_offsets, nodes = [np.zeros(1, dtype=np.int64)], []
+        pools = {pool: [] for pool in cls.POOLS}
+        small_codes = {'contigs': {}, 'labels': {}}
+        for table in tables:
+            remap = {}
+            for pool in small_codes:
+                for value in getattr(table, pool):
+                    if value not in small_codes[pool]:
+                        small_codes[pool][value] = len(pools[pool])
+                        pools[pool].append(value)
+                remap[pool] = np.array([small_codes[pool][value] for value in getattr(table, pool)] + [-1], dtype=np.int32)
+
+            for col, _ in cls.COLUMNS:
+                values = getattr(table, col)
+                if col in ('contig', 'contig2'):
+                    values = remap['contigs'][values]
+                elif col in ('source', 'direction', 'direction2'):
+                    values = remap['labels'][values]
+                elif col in ('read', 'read_seq', 'alt_seq'):
+                    pool = {'read': 'read_names', 'read_seq': 'read_seqs', 'alt_seq': 'alt_seqs'}[col]
+                    values = np.where(values >= 0, values + len(pools[pool]), -1)
+                columns[col].append(values)
+            for pool in ('read_names', 'read_seqs', 'alt_seqs'):
+                pools[pool].extend(getattr(table, pool))
+
+            node_offsets.append(table.node_offset[1:] - table.node_offset[0] + node_offsets[-1][-1])
+            nodes.append(table.nodes[table.node_offset[0]:table.node_offset[-1]])
+
+        columns = {col: np.concatenate(values) for col, values in columns.items()}
+        return cls(columns, np.concatenate(node_offsets), np.concatenate(nodes), **pools)
+
+    def __len__(self):
+        return len(self.sv_type)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return SignatureView(self, index)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield SignatureView(self, row)
+
+    def __getstate__(self):
+        # only pickle the pool entries referenced by the rows
+        state = {col: getattr(self, col) for col, _ in self.COLUMNS}
+        for col, pool in (('read', 'read_names'), ('read_seq', 'read_seqs'), ('alt_seq', 'alt_seqs')):
+            values = state[col]
+            used = np.unique(values[values >= 0])
+            state[pool] = [getattr(self, pool)[i] for i in used]
+            state[col] = np.where(values >= 0, np.searchsorted(used, values), -1)
+        state['contigs'], state['labels'] = self.contigs, self.labels
+        state['node_offset'] = self.node_offset - self.node_offset[0]
+        state['nodes'] = self.nodes[self.node_offset[0]:self.node_offset[-1]]
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(state, state['node_offset'], state['nodes'], *(state[pool] for pool in self.POOLS))
+
+    def take(self, rows):
+        """Sub-table of the given rows (in that order), sharing the string pools."""
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = {col: getattr(self, col)[rows] for col, _ in self.COLUMNS}
+        starts = self.node_offset[rows]
+        counts = self.node_offset[rows + 1] - starts
+        node_offset = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=node_offset[1:])
+        node_index = np.repeat(starts - node_offset[:-1], counts) + np.arange(node_offset[-1])
+        return SignatureTable(columns, node_offset, self.nodes[node_index], self.contigs, self.labels,
+                              self.read_names, self.read_seqs, self.alt_seqs)
+
+    def of_type(self, svtype):
+        return self.take(np.flatnonzero(self.sv_type == SV_TYPE_CODE[svtype]))
+
+    def label(self, code):
+        return self.labels[code] if code >= 0 else None
+
+    def node_list(self, row):
+        start, end = self.node_offset[row], self.node_offset[row + 1]
+        return self.nodes[start:end].tolist() if end > start else None
+
+
+def read_span(signatures, start, end):
+    """Bases of one read between read positions start and end, stitched from the read windows of its signatures.
+
+    Parts of the span that no signature holds are skipped.
+    """
+    windows = sorted({(sig.seq_offset, sig.read_seq) for sig in signatures if sig.read_seq is not None})
+    pieces, covered = [], start
+    for offset, seq in windows:
+        lo, hi = max(offset, covered), min(offset + len(seq), end)
+        if lo < hi:
+            pieces.append(seq[lo - offset:hi - offset])
+            covered = hi
+    return ''.join(pieces)
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from hashlib import blake2b
+
+import pyabpoa
+
+MAX_CONSENSUS_READS = 30
+CACHE_SIZE = 4096
+
+# per-process aligner and result cache, created on first use in every worker
+_aligner = None
+_cache = OrderedDict()
+
+
+def get_aligner():
+    global _aligner
+    if _aligner is None:
+        _aligner = pyabpoa.msa_aligner()
+    return _aligner
+
+
+def consensus_key(seqs, max_n_cons=1):
+    digest = blake2b(str(max_n_cons).encode(), digest_size=16)
+    for seq in seqs:
+        digest.update(seq.encode())
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def downsample(seqs, max_reads=MAX_CONSENSUS_READS):
+    """Keep at most `max_reads` sequences, preferring those closest to the median length.
+
+    This bounds the POA input of deep clusters and drops length outliers first; sequences keep their input order.
+    """
+    if len(seqs) <= max_reads:
+        return list(seqs)
+    median = sorted(len(s) for s in seqs)[len(seqs) // 2]
+    keep = sorted(sorted(range(len(seqs)), key=lambda i: (abs(len(seqs[i]) - median), i))[:max_reads])
+    return [seqs[i] for i in keep]
+
+
+def msa_consensus(seqs, max_n_cons=1):
+    """Consensus sequences of a cluster of reads, with the reads fed to POA longest first.
+
+    Returns a list of up to `max_n_cons` consensus sequences, or None for an empty cluster. Results are cached per
+    process under a hash of the input sequences.
+    """
+    if not seqs:
+        return None
+    if len(seqs) == 1:
+        return list(seqs)
+
+    seqs = downsample(seqs)
+    key = consensus_key(seqs, max_n_cons)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    ordered = [s for _, s in sorted(((len(s), s) for s in seqs), reverse=True)]
+    aln_result = get_aligner().msa(ordered, out_msa=True, out_cons=True, max_n_cons=max_n_cons)
+    _cache[key] = aln_result.cons_seq
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return aln_result.cons_seq
+
+
+def consensus_task(seqs):
+    try:
+        return msa_consensus(seqs)
+    except Exception:
+        return None
+
+
+def consensus_batch(jobs, pool=None):
+    """Consensus of every sequence list in `jobs`, computed once per distinct input and spread over `pool`.
+
+    Returns one result per job as msa_consensus does; None marks a job whose alignment failed.
+    """
+    keys = [consensus_key(seqs) for seqs in jobs]
+    unique = {}
+    for key, seqs in zip(keys, jobs):
+        unique.setdefault(key, seqs)
+    if pool is None:
+        results = list(map(consensus_task, unique.values()))
+    else:
+        results = pool.map(consensus_task, list(unique.values()))
+    results = dict(zip(unique, results))
+    return [results[key] for key in keys]
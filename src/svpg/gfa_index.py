@@ -0,0 +1,347 @@
+import os
+import re
+import json
+import shutil
+import logging
+import tempfile
+from array import array
+
+import numpy as np
+
+from svpg.util import parse_contig_from_sn
+
+INDEX_MAGIC = b'SVPGIDX\0'
+INDEX_VERSION = 4
+INDEX_SUFFIX = '.svpgi'
+# a name prefix and a canonical decimal id: s01 is not s1
+NODE_NAME_PATTERN = re.compile(r'^(\D*)(0|[1-9][0-9]*)$')
+NODE_ID_PATTERN = re.compile(r'0|[1-9][0-9]*')
+# numeric ids resolve through a dense id -> row array only while it stays within this many entries per segment
+MAX_ID_DENSITY = 2
+
+# column name -> dtype of the columnar node table, in file order
+INDEX_COLUMNS = [
+    ('node_id', '<i8'),
+    ('length', '<i8'),
+    ('contig_code', '<i4'),
+    ('offset', '<i8'),
+    ('sr', '<i4'),
+    ('seq_offset', '<i8'),  # n_nodes + 1 offsets into seq
+    ('seq', 'u1'),
+    ('name_offset', '<i8'),  # only for graphs with irregular segment names: n_nodes + 1 offsets into name
+    ('name', 'u1'),
+]
+
+
+class GfaNodeView:
+    """Read-only view of one GFA segment stored in a GfaIndex."""
+    __slots__ = ('_index', '_row')
+
+    def __init__(self, index, row):
+        self._index = index
+        self._row = row
+
+    @property
+    def name(self):
+        return self._index.name(self._row)
+
+    @property
+    def sequence(self):
+        return self._index.sequence(self._row)
+
+    @property
+    def len(self):
+        return int(self._index.length[self._row])
+
+    @property
+    def contig(self):
+        return self._index.contigs[self._index.contig_code[self._row]]
+
+    @property
+    def offset(self):
+        return int(self._index.offset[self._row])
+
+    @property
+    def sr(self):
+        return int(self._index.sr[self._row])
+
+
+class GfaIndex:
+    """Columnar table of GFA segments (rGFA S-lines).
+
+    Rows are stored in GFA order. When the segment names share a common prefix followed by distinct, densely
+    numbered ids (e.g. s1, s2, ...), which is what minigraph writes, names are resolved through a dense id -> row
+    array. Other graphs keep their names (prefix None) and are resolved through a name -> row dict, with the 1-based
+    GFA row as node id so that every id is positive and keeps its sign for reverse steps.
+    When the index was loaded from a sidecar file the columns are read-only memory maps, and pickling the
+    index only transfers the sidecar path so that every worker process shares one page-cache copy.
+    """
+
+    def __init__(self, columns, contigs, prefix, path=None):
+        self.node_id = columns['node_id']
+        self.length = columns['length']
+        self.contig_code = columns['contig_code']
+        self.offset = columns['offset']
+        self.sr = columns['sr']
+        self.seq_offset = columns['seq_offset']
+        self.seq = columns['seq']
+        self.name_offset = columns['name_offset']
+        self.names = columns['name']
+        self.contigs = contigs
+        self.prefix = prefix
+        self.path = path
+
+        self._row_of_name = None
+        if prefix is None:
+            names = self.names.tobytes().decode('ascii')
+            offsets = self.name_offset.tolist()
+            self._row_of_name = {names[offsets[i]:offsets[i + 1]]: i for i in range(len(offsets) - 1)}
+
+        self._row_of_id = np.full(int(self.node_id.max()) + 1 if len(self.node_id) else 0, -1, dtype=np.int64)
+        self._row_of_id[self.node_id] = np.arange(len(self.node_id), dtype=np.int64)
+        self._id_len_prefix = None
+
+    def __len__(self):
+        return len(self.node_id)
+
+    def __contains__(self, name):
+        try:
+            self.row(name)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, name):
+        return GfaNodeView(self, self.row(name))
+
+    def __reduce__(self):
+        if self.path is not None:
+            return load_gfa_index, (self.path,)
+        columns = {col: getattr(self, 'names' if col == 'name' else col) for col, _ in INDEX_COLUMNS}
+        return GfaIndex, (columns, self.contigs, self.prefix)
+
+    def row(self, name):
+        """Return the table row of segment `name` (e.g. 's123')."""
+        if self._row_of_name is not None:
+            return self._row_of_name[name]
+        prefix_len = len(self.prefix)
+        digits = name[prefix_len:]
+        if name[:prefix_len] != self.prefix or not NODE_ID_PATTERN.fullmatch(digits):
+            raise KeyError(name)
+        try:
+            row = self._row_of_id[int(digits)]
+        except IndexError:
+            raise KeyError(name)
+        if row < 0:
+            raise KeyError(name)
+        return int(row)
+
+    def path_rows(self, path):
+        """Resolve GAF path steps (e.g. ['>s1', '<s5']) to an array of table rows."""
+        if self._row_of_name is not None:
+            try:
+                return np.fromiter((self._row_of_name[step[1:]] for step in path), dtype=np.int64, count=len(path))
+            except KeyError:
+                raise KeyError(f"Unknown segment in GAF path: {''.join(path)}")
+        skip = len(self.prefix) + 1
+        try:
+            if any(step[1:skip] != self.prefix or not NODE_ID_PATTERN.fullmatch(step, skip) for step in path):
+                raise ValueError
+            rows = self._row_of_id[np.fromiter((int(step[skip:]) for step in path), dtype=np.int64, count=len(path))]
+        except (ValueError, IndexError):
+            raise KeyError(f"Unknown segment in GAF path: {''.join(path)}")
+        if len(rows) and rows.min() < 0:
+            raise KeyError(f"Unknown segment in GAF path: {''.join(path)}")
+        return rows
+
+    def span_length(self, low_id, high_id):
+        """Total length of the segments with low_id < id < high_id."""
+        if self._id_len_prefix is None:
+            id_len = np.zeros(len(self._row_of_id), dtype=np.int64)
+            id_len[self.node_id] = self.length
+            self._id_len_prefix = np.concatenate(([0], np.cumsum(id_len)))
+        if high_id <= low_id + 1:
+            return 0
+        return int(self._id_len_prefix[high_id] - self._id_len_prefix[low_id + 1])
+
+    def name(self, row):
+        if self.prefix is None:
+            return self.names[self.name_offset[row]:self.name_offset[row + 1]].tobytes().decode('ascii')
+        return f'{self.prefix}{self.node_id[row]}'
+
+    def sequence(self, row):
+        return self.seq[self.seq_offset[row]:self.seq_offset[row + 1]].tobytes().decode('ascii')
+
+
+def default_index_path(gfa_path):
+    return gfa_path + INDEX_SUFFIX
+
+
+def _source_stat(gfa_path):
+    stat = os.stat(gfa_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class IrregularNames(Exception):
+    """Raised while parsing when the segment names are not a common prefix followed by distinct, dense numbers."""
+
+
+def _parse_segments(ref_graph, seq_out, keep_names=False):
+    """Stream the S-lines of a GFA file into column arrays, writing sequences to `seq_out`.
+
+    Numeric ids are taken from the segment names unless `keep_names` is set, in which case the names are stored and
+    the 1-based GFA row is the id. Returns the columns, contigs and the common name prefix (None with `keep_names`).
+    """
+    node_id, length, contig_code, offset, sr = array('q'), array('q'), array('i'), array('q'), array('i')
+    seq_offset, name_offset, names = array('q', [0]), array('q', [0]), bytearray()
+    contigs, contig_codes = [], {}
+    prefix = None
+    with open(ref_graph, "r") as fp:
+        for line in fp:
+            if not line.startswith('S\t'):
+                continue
+            tokens = line.rstrip('\n').split('\t')
+            if keep_names:
+                name = tokens[1].encode('ascii')
+                names += name
+                name_offset.append(name_offset[-1] + len(name))
+                # ids are signed by step orientation downstream, so none may be 0
+                node_number = len(node_id) + 1
+            else:
+                match = NODE_NAME_PATTERN.match(tokens[1])
+                if not match or (prefix is not None and match.group(1) != prefix):
+                    raise IrregularNames(f"segment {tokens[1]} is not named like s1, s2, ...")
+                prefix = match.group(1)
+                node_number = int(match.group(2))
+            try:
+                node_length = int(tokens[3][5:])  # e.g., LN:i:1234 -> 1234
+                contig = parse_contig_from_sn(tokens[4])  # e.g., SN:Z:chr1 -> chr1
+                node_offset = int(tokens[5][5:])
+                node_sr = int(tokens[6][5:])  # e.g., SR:i:1
+            except (IndexError, ValueError):
+                raise ValueError(f"Invalid S-line format in GFA: {line}")
+
+            if contig not in contig_codes:
+                contig_codes[contig] = len(contigs)
+                contigs.append(contig)
+            node_id.append(node_number)
+            length.append(node_length)
+            contig_code.append(contig_codes[contig])
+            offset.append(node_offset)
+            sr.append(node_sr)
+            sequence = tokens[2].encode('ascii')
+            seq_out.write(sequence)
+            seq_offset.append(seq_offset[-1] + len(sequence))
+
+    node_id = np.frombuffer(node_id, dtype=np.int64)
+    if not keep_names and len(node_id):
+        # a dense id -> row array must stay small, and every id must name one segment only
+        if node_id.max() > MAX_ID_DENSITY * len(node_id) + 1024:
+            raise IrregularNames(f"segment ids up to {node_id.max()} for {len(node_id)} segments")
+        if np.bincount(node_id).max() > 1:
+            raise IrregularNames(f"segment id {np.bincount(node_id).argmax()} is used more than once")
+
+    columns = {
+        'node_id': node_id,
+        'length': np.frombuffer(length, dtype=np.int64),
+        'contig_code': np.frombuffer(contig_code, dtype=np.int32),
+        'offset': np.frombuffer(offset, dtype=np.int64),
+        'sr': np.frombuffer(sr, dtype=np.int32),
+        'seq_offset': np.frombuffer(seq_offset, dtype=np.int64),
+        'name_offset': np.frombuffer(name_offset, dtype=np.int64) if keep_names else np.zeros(0, dtype=np.int64),
+        'name': np.frombuffer(bytes(names), dtype=np.uint8),
+    }
+    return columns, contigs, None if keep_names else prefix or ''
+
+
+def parse_segments(ref_graph, seq_out):
+    """_parse_segments, falling back to stored names when the graph's segment names are not prefix + number."""
+    try:
+        return _parse_segments(ref_graph, seq_out)
+    except IrregularNames as e:
+        logging.info(f"GFA {e}; resolving segments by name.")
+        seq_out.seek(0)
+        seq_out.truncate()
+        return _parse_segments(ref_graph, seq_out, keep_names=True)
+
+
+def build_gfa_index(gfa_path, index_path=None):
+    """Parse a GFA file once and write its binary node index sidecar. Returns the sidecar path."""
+    index_path = index_path or default_index_path(gfa_path)
+    source = _source_stat(gfa_path)
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(index_path))) as seq_tmp:
+        columns, contigs, prefix = parse_segments(gfa_path, seq_tmp)
+        seq_len = seq_tmp.tell()
+
+        # header: magic, header length, JSON header; every column is 64-byte aligned
+        layout, pos = {}, 0
+        for col, dtype in INDEX_COLUMNS:
+            count = seq_len if col == 'seq' else len(columns[col])
+            layout[col] = [dtype, count, pos]
+            pos += -(-count * np.dtype(dtype).itemsize // 64) * 64
+        header = {'version': INDEX_VERSION, 'source': source, 'prefix': prefix, 'contigs': contigs, 'columns': layout}
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(INDEX_MAGIC) + 8 + len(header_bytes)) // 64) * 64
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(INDEX_MAGIC)
+            out.write(len(header_bytes).to_bytes(8, 'little'))
+            out.write(header_bytes)
+            for col, dtype in INDEX_COLUMNS:
+                out.seek(data_start + layout[col][2])
+                if col == 'seq':
+                    seq_tmp.seek(0)
+                    shutil.copyfileobj(seq_tmp, out, 16 * 1024 * 1024)
+                else:
+                    out.write(columns[col].astype(dtype, copy=False).tobytes())
+            out.truncate(data_start + pos)
+        os.replace(tmp_path, index_path)
+
+    logging.info(f"Indexed {len(columns['node_id'])} GFA segments to {index_path}")
+    return index_path
+
+
+def _read_header(index_path):
+    with open(index_path, 'rb') as fp:
+        if fp.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"Not an SVPG GFA index: {index_path}")
+        header_len = int.from_bytes(fp.read(8), 'little')
+        header = json.loads(fp.read(header_len).decode('utf-8'))
+    header['data_start'] = -(-(len(INDEX_MAGIC) + 8 + header_len) // 64) * 64
+    return header
+
+
+def load_gfa_index(index_path):
+    """Memory-map a GFA index sidecar written by build_gfa_index."""
+    header = _read_header(index_path)
+    if header['version'] != INDEX_VERSION:
+        raise ValueError(f"Unsupported GFA index version {header['version']} in {index_path}, please re-run `svpg index`.")
+    columns = {}
+    for col, (dtype, count, pos) in header['columns'].items():
+        if count == 0:
+            columns[col] = np.zeros(0, dtype=dtype)
+        else:
+            columns[col] = np.memmap(index_path, dtype=dtype, mode='r', offset=header['data_start'] + pos, shape=(count,))
+    return GfaIndex(columns, header['contigs'], header['prefix'], path=index_path)
+
+
+def read_gfa(ref_graph):
+    """Load GFA segments, memory-mapping the `svpg index` sidecar when it is present and up to date."""
+    index_path = default_index_path(ref_graph)
+    if os.path.exists(index_path):
+        try:
+            header = _read_header(index_path)
+            if header['version'] == INDEX_VERSION and header['source'] == _source_stat(ref_graph):
+                return load_gfa_index(index_path)
+            logging.warning(f"GFA index {index_path} is outdated, re-run `svpg index` to refresh it.")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable GFA index {index_path}: {e}")
+    else:
+        logging.info(f"No GFA index found, parsing {ref_graph}. Run `svpg index` once to speed up later runs.")
+
+    with tempfile.TemporaryFile() as seq_tmp:
+        columns, contigs, prefix = parse_segments(ref_graph, seq_tmp)
+        seq_tmp.seek(0)
+        columns['seq'] = np.frombuffer(seq_tmp.read(), dtype=np.uint8)
+    return GfaIndex(columns, contigs, prefix)
@@ -1,76 +1,494 @@
 import os
+import re
+import json
+import heapq
+import shutil
 import subprocess
+from math import log
+from multiprocessing import Pool
 
-import pysam.bcftools
+import pysam
 
-def process_fasta(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        total_written = 0
-        currently_written = 0
-        previous_label = ""
-        nr_blocks = 0
-        prev_n = False
-        prev_break = True
+from svpg.reference import ReferenceCache
+from svpg.resources import ResourceGovernor, minigraph_mem
+from svpg.stage_cache import file_fingerprint
 
-        for line in infile:
-            if line == "":
+# collapse thresholds, matching the truvari collapse defaults the merge used to run with
+MAX_REF_DIST = 500
+MIN_SIZE_RATIO = 0.7
+MIN_SEQ_SIMILARITY = 0.7
+KMER_SIZE = 9
+
+# incremental augmentation
+STATE_FILE = 'augment_state.json'
+STATE_VERSION = 1
+FRAGMENT_FLANK = 10000
+
+LINE_WIDTH = 70
+READ_SIZE = 1 << 22
+HEADER_LINE = re.compile(rb'^>[^\n]*', re.M)
+NON_N_RUN = re.compile(rb'[^nN]+')
+
+
+class NSplitWriter:
+    """Writes the non-N blocks of FASTA records as separate records named <label>_<block index>, wrapped at LINE_WIDTH."""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.label = b''
+        self.nr_blocks = 0
+        self.in_block = False
+        self.column = 0
+        self.total_written = 0
+
+    def start_record(self, label):
+        self.label = label
+        self.nr_blocks = 0
+        self.in_block = False
+
+    def write_sequence(self, seq):
+        """Write one stretch of the current record, which may end inside a block continued by the next call."""
+        end = 0
+        for run in NON_N_RUN.finditer(seq):
+            if run.start() > 0 or not self.in_block:
+                if self.total_written:
+                    self.outfile.write(b'\n')
+                self.outfile.write(b'%s_%d\n' % (self.label, self.nr_blocks))
+                self.nr_blocks += 1
+                self.column = 0
+            self.write_wrapped(run.group())
+            end = run.end()
+        if seq:
+            self.in_block = end == len(seq)
+
+    def write_wrapped(self, bases):
+        if self.column == LINE_WIDTH:
+            self.outfile.write(b'\n')
+            self.column = 0
+        first = LINE_WIDTH - self.column
+        lines = [bases[:first]] + [bases[i:i + LINE_WIDTH] for i in range(first, len(bases), LINE_WIDTH)]
+        self.outfile.write(b'\n'.join(lines))
+        self.column = len(lines[-1]) if len(lines) > 1 else self.column + len(lines[0])
+        self.total_written += len(bases)
+
+    def close(self):
+        if self.total_written:
+            self.outfile.write(b'\n')
+
+
+def process_fasta(input_file, output_file, label_prefix=''):
+    """Split the records of a FASTA file or binary stream at N runs and write the blocks to `output_file`.
+
+    The input is read in large chunks cut at line ends; headers are located with a regex and the sequence between them
+    is processed as whole byte blocks. `label_prefix` is inserted after the '>' of every output label.
+    """
+    infile = open(input_file, 'rb') if isinstance(input_file, str) else input_file
+    prefix = label_prefix.encode()
+    try:
+        with open(output_file, 'wb', buffering=READ_SIZE) as outfile:
+            writer = NSplitWriter(outfile)
+            while True:
+                chunk = infile.read(READ_SIZE)
+                if not chunk:
+                    break
+                if not chunk.endswith(b'\n'):
+                    chunk += infile.readline()
+                pos = 0
+                for header in HEADER_LINE.finditer(chunk):
+                    writer.write_sequence(chunk[pos:header.start()].replace(b'\n', b''))
+                    fields = header.group()[1:].split()
+                    writer.start_record(b'>' + prefix + (fields[0] if fields else b''))
+                    pos = header.end()
+                writer.write_sequence(chunk[pos:].replace(b'\n', b''))
+            writer.close()
+    finally:
+        if infile is not input_file:
+            infile.close()
+    print("Wrote " + str(writer.total_written) + " non-N bases to output file.")
+
+
+def read_vcf_header(path):
+    """Meta lines and sample names of a bgzipped VCF."""
+    with pysam.TabixFile(path) as vcf:
+        header = list(vcf.header)
+    return header[:-1], header[-1].split('\t')[9:]
+
+
+def merge_headers(paths):
+    """Merged header lines of the per-sample VCFs and the contig order of the cohort.
+
+    Meta lines are unioned in order of first appearance. Sample names that were already taken are prefixed with the
+    1-based file index, as bcftools merge --force-samples does (or a higher number if that name is taken as well).
+    """
+    meta, seen, samples, contigs = [], set(), [], []
+    for file_index, path in enumerate(paths):
+        file_meta, file_samples = read_vcf_header(path)
+        for line in file_meta:
+            key = line.split('=', 1)[0] if line.startswith(('##fileformat', '##fileDate')) else line
+            if key in seen:
                 continue
-            if line.startswith(">"):
-                previous_label = line.strip().split()[0]
-                nr_blocks = 0
-                prev_n = True
+            seen.add(key)
+            meta.append(line)
+            if line.startswith('##contig=<ID='):
+                contigs.append(line[len('##contig=<ID='):].split(',')[0].rstrip('>'))
+        for name in file_samples:
+            unique_name, prefix = name, file_index + 1
+            while unique_name in samples:
+                unique_name = f"{prefix}:{name}"
+                prefix += 1
+            samples.append(unique_name)
+        with pysam.TabixFile(path) as vcf:
+            contigs.extend(contig for contig in vcf.contigs if contig not in contigs)
+    header = meta + ['\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] + samples)]
+    return header, contigs, len(samples)
+
+
+def split_alleles(values, n_alts, allele):
+    """Comma-separated INFO or FORMAT `values` reduced to ALT `allele` (1-based) of a line with `n_alts` ALTs.
+
+    Values with one entry per ALT allele (Number=A) or per allele (Number=R) keep those of `allele`, all others are
+    kept as they are. Without the header the number of entries decides, as it does for the fields SVs carry.
+    """
+    split = []
+    for value in values:
+        entries = value.split(',')
+        if len(entries) == n_alts:
+            value = entries[allele - 1]
+        elif len(entries) == n_alts + 1:
+            value = f'{entries[0]},{entries[allele]}'
+        split.append(value)
+    return split
+
+
+def split_genotype(gt, allele):
+    """GT of a sample for the biallelic record of ALT `allele`; calls of the other ALT alleles become reference."""
+    return re.sub(r'\d+', lambda m: '1' if int(m.group()) == allele else '0', gt)
+
+
+def biallelic_lines(line):
+    """Split a VCF line with several ALT alleles into one line per ALT allele, as bcftools norm -m- does.
+
+    Genotypes are recoded to the split allele (other ALT alleles become reference) and per-allele INFO and FORMAT
+    values keep the entry of the split allele.
+    """
+    fields = line.rstrip('\n').split('\t')
+    alts = fields[4].split(',')
+    if len(alts) == 1:
+        return [fields]
+    split = []
+    info = [item.split('=', 1) for item in fields[7].split(';')]
+    format_keys = fields[8].split(':') if len(fields) > 8 else []
+    for allele, alt in enumerate(alts, 1):
+        info_values = split_alleles([item[-1] for item in info], len(alts), allele)
+        info_items = ';'.join(item[0] if len(item) == 1 else f'{item[0]}={value}'
+                              for item, value in zip(info, info_values))
+        samples = []
+        for column in fields[9:]:
+            values = split_alleles(column.split(':'), len(alts), allele)
+            samples.append(':'.join(split_genotype(value, allele) if key == 'GT' else value
+                                    for key, value in zip(format_keys, values)))
+        split.append(fields[:4] + [alt] + fields[5:7] + [info_items] + fields[8:9] + samples)
+    return split
+
+
+def merge_records(lines, sample_offset):
+    """MergeRecords of the VCF `lines` of one per-sample file, one per ALT allele."""
+    for line in lines:
+        for fields in biallelic_lines(line):
+            yield MergeRecord(fields, sample_offset)
+
+
+class MergeRecord:
+    """One biallelic VCF record of a per-sample file, with the fields collapsing needs parsed out.
+
+    `fields` are the tab-separated columns of the record; lines with several ALT alleles are split by biallelic_lines
+    first, and a multi-allelic record raises ValueError.
+    """
+    __slots__ = ('fields', 'sample_offset', 'pos', 'end', 'svtype', 'size', 'seq', '_kmers')
+
+    def __init__(self, fields, sample_offset):
+        if ',' in fields[4]:
+            raise ValueError(f"Multi-allelic record at {fields[0]}:{fields[1]} (ALT {fields[4]}), "
+                             f"split it with biallelic_lines first")
+        self.fields = fields
+        self.sample_offset = sample_offset
+        self.pos = int(self.fields[1])
+        ref, alt = self.fields[3], self.fields[4]
+        info = dict(item.split('=', 1) if '=' in item else (item, True) for item in self.fields[7].split(';'))
+        self.svtype = info.get('SVTYPE')
+        self.end = int(info['END']) if 'END' in info else self.pos + len(ref) - 1
+        if 'SVLEN' in info:
+            self.size = abs(int(info['SVLEN']))
+        else:
+            self.size = abs(len(alt) - len(ref))
+        # the allele sequence is what was deleted or inserted after the padding base; symbolic alleles have none
+        if alt.startswith('<') or not alt.isalpha():
+            self.seq = None
+        elif self.svtype == 'DEL':
+            self.seq = ref[1:].upper()
+        elif self.svtype == 'INS':
+            self.seq = alt[1:].upper()
+        else:
+            self.seq = None
+        self._kmers = None
+
+    def kmers(self):
+        if self._kmers is None:
+            self._kmers = {self.seq[i:i + KMER_SIZE] for i in range(len(self.seq) - KMER_SIZE + 1)}
+        return self._kmers
+
+
+def sequence_similarity(rec1, rec2):
+    """Identity of two allele sequences estimated from their shared k-mers (the Mash distance)."""
+    if len(rec1.seq) < KMER_SIZE or len(rec2.seq) < KMER_SIZE:
+        return 1.0 if rec1.seq == rec2.seq else 0.0
+    kmers1, kmers2 = rec1.kmers(), rec2.kmers()
+    shared = len(kmers1 & kmers2)
+    if shared == 0:
+        return 0.0
+    jaccard = shared / (len(kmers1) + len(kmers2) - shared)
+    return max(0.0, 1.0 + log(2 * jaccard / (1 + jaccard)) / KMER_SIZE)
+
+
+def is_same_sv(rep, rec):
+    if rep.svtype != rec.svtype:
+        return False
+    if rep.svtype not in ('DEL', 'INS'):
+        return rep.pos == rec.pos and rep.fields[3:5] == rec.fields[3:5]
+    if abs(rep.pos - rec.pos) > MAX_REF_DIST or abs(rep.end - rec.end) > MAX_REF_DIST:
+        return False
+    if min(rep.size, rec.size) < MIN_SIZE_RATIO * max(rep.size, rec.size):
+        return False
+    if rep.seq is None or rec.seq is None:
+        return True
+    return sequence_similarity(rep, rec) >= MIN_SEQ_SIMILARITY
+
+
+def sample_columns(cluster, n_samples):
+    """Sample columns of a collapsed cluster in the FORMAT of its representative.
+
+    Each sample takes its first non-reference call in the cluster; samples without a call are set to reference, as
+    bcftools merge --missing-to-ref does.
+    """
+    format_keys = cluster[0].fields[8].split(':')
+    missing = ':'.join(['0/0'] + ['.'] * (len(format_keys) - 1)) if format_keys[0] == 'GT' else \
+        ':'.join(['.'] * len(format_keys))
+    columns = [None] * n_samples
+    for rec in cluster:
+        rec_keys = rec.fields[8].split(':')
+        for i, column in enumerate(rec.fields[9:]):
+            index = rec.sample_offset + i
+            if columns[index] is not None:
                 continue
-            for c in line:
-                if c == '\n':
-                    continue
-                if c in ['n', 'N']:
-                    prev_n = True
-                    continue
-                elif prev_n:
-                    if not prev_break:
-                        outfile.write("\n")
-                    outfile.write(previous_label + "_" + str(nr_blocks) + "\n" + c)
-                    total_written += 1
-                    prev_break = False
-                    currently_written = 1
-                    nr_blocks += 1
-                    prev_n = False
-
-                else:
-                    if currently_written % 70 == 0:
-                        outfile.write("\n")
-                        prev_break = True
-                    outfile.write(c)
-                    prev_break = False
-                    currently_written += 1
-                    total_written += 1
-        if not prev_break:
-            outfile.write("\n")
-    print("Wrote " + str(total_written) + " non-N bases to output file.")
-
-
-def augment_pipe(base_dir, ref_file, pan_file, output_file):
-    os.chdir(base_dir)
-    os.makedirs('tmp', exist_ok=True)
+            values = dict(zip(rec_keys, column.split(':')))
+            if values.get('GT', '0/0').replace('|', '/') in ('0/0', '0', './.', '.'):
+                continue
+            columns[index] = ':'.join(values.get(key, '.') for key in format_keys)
+    return [column if column is not None else missing for column in columns]
 
-    print(">>> Merge VCF files using bcftools...")
-    pysam.bcftools.merge("-l", "filelist.tsv", "--missing-to-ref", "--force-samples", "-Oz", "-o", "tmp/merged.vcf.gz", force=True, catch_stdout=False)
-    pysam.tabix_index("tmp/merged.vcf.gz", preset="vcf", force=True)
 
-    print(">>> Normalize the merged VCF file to ensure biallelic representation...")
-    subprocess.run("bcftools norm -m- tmp/merged.vcf.gz  -Oz -o tmp/merged_biallelic.vcf.gz", shell=True, check=True)
-    pysam.tabix_index("tmp/merged_biallelic.vcf.gz", preset="vcf", force=True)
+def collapse_contig(args):
+    """Collapsed cohort VCF lines of one contig, and the (contig, pos, ref, alt) of clusters that are novel.
 
-    print(">>> Collapse the normalized VCF file using Truvari...")
-    collapse_cmd = f"truvari collapse -i tmp/merged_biallelic.vcf.gz -o tmp/collapsed.tmp -c tmp/output.collapsed -f {ref_file}"
-    subprocess.run(collapse_cmd, shell=True, check=True)
-    subprocess.run("bcftools sort tmp/collapsed.tmp -W -Oz -o variants.vcf.gz", shell=True, check=True)
+    The per-sample records are merged by position with a k-way heap merge and swept once: every record is compared
+    with the representatives (first calls) of the clusters still within MAX_REF_DIST and joins the first one that
+    matches in type, position, size ratio and allele sequence similarity, or starts a new cluster otherwise. A cluster
+    is novel when none of its calls comes from the first `known_samples` sample columns.
+    """
+    contig, paths, sample_offsets, n_samples, known_samples = args
+    files = [pysam.TabixFile(path) for path in paths]
+    try:
+        streams = []
+        for vcf, offset in zip(files, sample_offsets):
+            if contig in vcf.contigs:
+                streams.append(merge_records(vcf.fetch(contig), offset))
+        clusters, active = [], []
+        for rec in heapq.merge(*streams, key=lambda r: r.pos):
+            active = [cluster for cluster in active if cluster[0].pos >= rec.pos - MAX_REF_DIST]
+            for cluster in active:
+                if is_same_sv(cluster[0], rec):
+                    cluster.append(rec)
+                    break
+            else:
+                cluster = [rec]
+                clusters.append(cluster)
+                active.append(cluster)
+    finally:
+        for vcf in files:
+            vcf.close()
+    # representatives are created in position order, so the output needs no further sorting
+    lines = ['\t'.join(cluster[0].fields[:9] + sample_columns(cluster, n_samples)) for cluster in clusters]
+    novel = [(contig, cluster[0].pos, cluster[0].fields[3], cluster[0].fields[4]) for cluster in clusters
+             if known_samples and min(rec.sample_offset for rec in cluster) >= known_samples]
+    return lines, novel
 
-    print(">>> Generate the consensus sequence from the VCF file...")
-    subprocess.run(f"bcftools consensus -f {ref_file} variants.vcf.gz | sed 's/^>/&augment_/' > tmp/cons.tmp", shell=True, check=True)
 
-    process_fasta('tmp/cons.tmp', 'cons_noN.fa')
-    subprocess.run("rm -rf tmp", shell=True, check=True)
+def merge_cohort_vcfs(vcf_paths, output_file, num_threads=1, known_samples=0):
+    """Merge and collapse the bgzipped per-sample VCFs into one sorted, bgzipped and indexed cohort VCF.
+
+    Replaces bcftools merge / norm / sort and truvari collapse. Contigs are collapsed in parallel and written in header
+    order. Returns the number of records written and, when the first `known_samples` sample columns hold variants that
+    are already represented, the (contig, pos, ref, alt) of every collapsed SV none of them supports.
+    """
+    header, contigs, n_samples = merge_headers(vcf_paths)
+    sample_offsets = []
+    offset = 0
+    for path in vcf_paths:
+        sample_offsets.append(offset)
+        offset += len(read_vcf_header(path)[1])
+    tasks = [(contig, vcf_paths, sample_offsets, n_samples, known_samples) for contig in contigs]
+
+    n_records, novel = 0, []
+    with pysam.BGZFile(output_file, 'wb') as out:
+        out.write(('\n'.join(header) + '\n').encode())
+        with Pool(max(1, min(num_threads, len(tasks)))) as pool:
+            for lines, contig_novel in pool.imap(collapse_contig, tasks):
+                if lines:
+                    out.write(('\n'.join(lines) + '\n').encode())
+                n_records += len(lines)
+                novel.extend(contig_novel)
+    pysam.tabix_index(output_file, preset='vcf', force=True)
+    return n_records, novel
+
+
+def novel_windows(novel, flank=FRAGMENT_FLANK):
+    """Reference windows around novel SVs, merged where they overlap, with the SVs each window holds."""
+    windows = []
+    for contig, pos, ref, alt in novel:
+        start, end = max(0, pos - 1 - flank), pos - 1 + len(ref) + flank
+        if windows and windows[-1][0] == contig and start <= windows[-1][2]:
+            windows[-1][2] = max(windows[-1][2], end)
+            windows[-1][3].append((pos, ref, alt))
+        else:
+            windows.append([contig, start, end, [(pos, ref, alt)]])
+    return windows
+
+
+def window_consensus(ref_seq, start, variants):
+    """Apply the sequence-resolved variants to the reference window starting at `start`.
+
+    As with bcftools consensus, a variant overlapping one applied before it is skipped; so are symbolic alleles and
+    variants whose REF does not match the reference.
+    """
+    pieces, last = [], 0
+    for pos, ref, alt in variants:
+        offset = pos - 1 - start
+        if offset < last or alt.startswith('<') or not alt.isalpha() or \
+                ref_seq[offset:offset + len(ref)].upper() != ref.upper():
+            continue
+        pieces.append(ref_seq[last:offset])
+        pieces.append(alt)
+        last = offset + len(ref)
+    pieces.append(ref_seq[last:])
+    return ''.join(pieces)
+
+
+def write_novel_fragments(novel, ref_file, output_file):
+    """Write consensus fragments around the novel SVs, split at N runs like the whole-genome consensus."""
+    reference = ReferenceCache(ref_file)
+    with open(output_file, 'wb') as outfile:
+        writer = NSplitWriter(outfile)
+        for contig, start, end, variants in novel_windows(novel):
+            ref_seq = reference.fetch(contig, start, end)
+            writer.start_record(f">augment_{contig}:{start + 1}-{start + len(ref_seq)}".encode())
+            writer.write_sequence(window_consensus(ref_seq, start, variants).encode())
+        writer.close()
+    return writer.total_written
+
+
+def load_augment_state(ref_file, pan_file):
+    """The state of the previous augmentation, or None if it is missing or no longer matches the files on disk."""
+    if not os.path.exists(STATE_FILE):
+        print(f"No {STATE_FILE} found, augmenting from scratch.")
+        return None
+    try:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+        valid = state['version'] == STATE_VERSION and \
+            state['ref'] == file_fingerprint(ref_file) and state['gfa'] == file_fingerprint(pan_file) and \
+            state['graph'] == file_fingerprint(state['graph']['path']) and \
+            state['variants'] == file_fingerprint(state['variants']['path'])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable {STATE_FILE}: {e}")
+        return None
+    if not valid:
+        print(f"{STATE_FILE} does not match the current reference, graph or variants, augmenting from scratch.")
+        return None
+    return state
+
+
+def save_augment_state(ref_file, pan_file, output_file, vcf_paths):
+    state = {'version': STATE_VERSION, 'ref': file_fingerprint(ref_file), 'gfa': file_fingerprint(pan_file),
+             'graph': file_fingerprint(output_file), 'variants': file_fingerprint('variants.vcf.gz'),
+             'samples': [file_fingerprint(path) for path in vcf_paths]}
+    with open(STATE_FILE + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+
+def augment_incremental(state, vcf_paths, ref_file, output_file, governor):
+    """Add the samples that are not yet part of the augmented graph of `state`.
+
+    Their SVs are collapsed together with the cohort variants already represented in the graph; only the clusters
+    without a represented call are novel. Consensus fragments around those are aligned to the previous augmented graph,
+    so the cost grows with the number of new SVs rather than with the cohort size.
+    """
+    known = {sample['path']: sample for sample in state['samples']}
+    new_paths = [path for path in vcf_paths if known.get(os.path.abspath(path)) != file_fingerprint(path)]
+    previous_graph = state['graph']['path']
+    print(f">>> {len(new_paths)} of {len(vcf_paths)} samples are new to the augmented graph {previous_graph}")
+
+    n_records, novel = 0, []
+    if new_paths:
+        known_samples = len(read_vcf_header(state['variants']['path'])[1])
+        n_records, novel = merge_cohort_vcfs([state['variants']['path']] + new_paths, "variants.tmp.vcf.gz",
+                                             governor.pool_size(), known_samples=known_samples)
+        print(f"Collapsed {n_records} SVs, {len(novel)} of them new")
+
+    if novel:
+        print(">>> Generate consensus fragments around the new SVs...")
+        n_bases = write_novel_fragments(novel, ref_file, 'novel_fragments.fa')
+        print(f"Wrote {n_bases} non-N bases to novel_fragments.fa")
+        print(f">>> Extend the augmented graph {previous_graph} using Minigraph to {output_file}")
+        with governor.reserve(governor.num_threads, minigraph_mem(previous_graph)) as threads:
+            subprocess.run(f"minigraph -cxggs -t{threads} {previous_graph} novel_fragments.fa > {output_file}.tmp",
+                           shell=True, check=True)
+        os.replace(f"{output_file}.tmp", output_file)
+    elif os.path.abspath(output_file) != previous_graph:
+        shutil.copyfile(previous_graph, output_file)
+
+    if new_paths:
+        os.replace("variants.tmp.vcf.gz", "variants.vcf.gz")
+        os.replace("variants.tmp.vcf.gz.tbi", "variants.vcf.gz.tbi")
+        print(f"Wrote {n_records} collapsed SVs of {len(vcf_paths)} samples to variants.vcf.gz")
+
+
+def augment_pipe(base_dir, ref_file, pan_file, output_file, governor=None, incremental=False):
+    governor = governor or ResourceGovernor(1)
+    ref_file, pan_file = os.path.abspath(ref_file), os.path.abspath(pan_file)
+    os.chdir(base_dir)
+    with open("filelist.tsv") as filelist:
+        vcf_paths = [line.strip() for line in filelist if line.strip()]
+
+    state = load_augment_state(ref_file, pan_file) if incremental else None
+    if state is not None:
+        augment_incremental(state, vcf_paths, ref_file, output_file, governor)
+        save_augment_state(ref_file, pan_file, output_file, vcf_paths)
+        return
+
+    print(">>> Merge and collapse the sample VCF files...")
+    n_records, _ = merge_cohort_vcfs(vcf_paths, "variants.vcf.gz", governor.pool_size())
+    print(f"Wrote {n_records} collapsed SVs of {len(vcf_paths)} samples to variants.vcf.gz")
+
+    print(">>> Generate the consensus sequence from the VCF file...")
+    consensus = subprocess.Popen(["bcftools", "consensus", "-f", ref_file, "variants.vcf.gz"], stdout=subprocess.PIPE)
+    process_fasta(consensus.stdout, 'cons_noN.fa', label_prefix='augment_')
+    consensus.stdout.close()
+    if consensus.wait() != 0:
+        raise subprocess.CalledProcessError(consensus.returncode, consensus.args)
 
     print(f">>> Construct a augment graph using Minigraph to {output_file}")
-    subprocess.run(f"minigraph -cxggs -t128 {pan_file} cons_noN.fa > {output_file}", shell=True, check=True)
\ No newline at end of file
+    with governor.reserve(governor.num_threads, minigraph_mem(pan_file)) as threads:
+        subprocess.run(f"minigraph -cxggs -t{threads} {pan_file} cons_noN.fa > {output_file}", shell=True, check=True)
+
+    save_augment_state(ref_file, pan_file, output_file, vcf_paths)
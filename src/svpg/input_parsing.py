@@ -1,7 +1,18 @@
+import re
 import sys
 import os
 import argparse
 
+MEMORY_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def memory_size(text):
+    """Bytes of a memory size such as 64G, 512M or a plain number of bytes."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)B?', text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid memory size: '{text}' (use e.g. 64G or 512M)")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
 
 def parse_arguments(arguments=sys.argv[1:]):
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -38,6 +49,10 @@ def parse_arguments(arguments=sys.argv[1:]):
                             type=int,
                             default=16,
                             help='Number of threads to use')
+    parser_bam.add_argument('--max_mem',
+                            type=memory_size,
+                            default=None,
+                            help='Memory cap for the run (e.g. 64G). Worker processes and external tools are scheduled to stay within it.')
     parser_bam.add_argument('--read',
                             type=str,
                             choices=['hifi', 'ont'],
@@ -86,6 +101,9 @@ def parse_arguments(arguments=sys.argv[1:]):
                             type=str,
                             nargs='*',
                             help='Specify the chromosomes list to call SVs (e.g., --contigs chr1 chr2 chrX)')
+    parser_bam.add_argument('--resume',
+                            action='store_true',
+                            help='Reuse the stage checkpoints stored in the working directory by a previous run with the same inputs and parameters.')
     parser_bam.add_argument('--skip_genotype',
                             action='store_true',
                             help='Skip genotyping step to speed up the processing.')
@@ -113,6 +131,10 @@ def parse_arguments(arguments=sys.argv[1:]):
                             type=int,
                             default=16,
                             help='Number of threads to use for parallel processing.')
+    parser_gaf.add_argument('--max_mem',
+                            type=memory_size,
+                            default=None,
+                            help='Memory cap for the run (e.g. 64G). Worker processes and external tools are scheduled to stay within it.')
     parser_gaf.add_argument('--read',
                             type=str,
                             default='hifi',
@@ -157,6 +179,9 @@ def parse_arguments(arguments=sys.argv[1:]):
                             type=str,
                             nargs='*',
                             help='Specify the chromosomes list to call SVs (e.g., --contigs chr1 chr2 chrX)')
+    parser_gaf.add_argument('--resume',
+                            action='store_true',
+                            help='Reuse the stage checkpoints stored in the working directory by a previous run with the same inputs and parameters.')
 
     ##########################################################
     parser_augment = subparsers.add_parser('augment',
@@ -182,6 +207,10 @@ def parse_arguments(arguments=sys.argv[1:]):
                                 type=int,
                                 default=16,
                                 help='Number of threads to use for parallel processing.')
+    parser_augment.add_argument('--max_mem',
+                                type=memory_size,
+                                default=None,
+                                help='Memory cap for the run (e.g. 64G). Worker processes and external tools are scheduled to stay within it.')
     parser_augment.add_argument('--read',
                                 type=str,
                                 default='hifi',
@@ -206,5 +235,19 @@ def parse_arguments(arguments=sys.argv[1:]):
     parser_augment.add_argument('--skip_call',
                                 action='store_true',
                                 help='Skip SV calling step and directly proceed to graph augmentation using existing VCF files in the working directory. ')
+    parser_augment.add_argument('--incremental',
+                                action='store_true',
+                                help='Extend the augmented graph of a previous run in the working directory with the SVs of new samples only.')
+
+    ##########################################################
+    parser_index = subparsers.add_parser('index',
+                                         help='Build a binary GFA node index to speed up later runs')
+    parser_index.add_argument('--gfa',
+                              type=str,
+                              help='Pangenome reference file to index (.gfa)')
+    parser_index.add_argument('-o', '--out',
+                              type=str,
+                              default=None,
+                              help='Index output file name (default: <gfa>.svpgi, which is picked up automatically)')
 
     return parser.parse_args(arguments)
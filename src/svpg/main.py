@@ -1,30 +1,124 @@
-import pickle
 import re
 import sys
 import os
 import logging
 import time
-from multiprocessing import Pool
+import multiprocessing
 import pysam
 import numpy as np
 from time import strftime, localtime
 import subprocess
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from svpg.input_parsing import parse_arguments
-from svpg.SVCollect import read_bam
+from svpg.SVCollect import read_bam, plan_bam_tiles
 from svpg.SVCluster import form_bins, cluster_data
-from svpg.SVPan import read_gaf, read_gaf_pan
-from svpg.util import read_gfa, find_sequence_file
+from svpg.SVSignature import SignatureTable, READ_FLANK
+from svpg.SVPan import read_gaf, read_gaf_pan, minigraph_gaf_lines, split_gaf, read_gaf_pan_chunk, merge_gaf_chunks
+from svpg.util import find_sequence_file
+from svpg.gfa_index import read_gfa, build_gfa_index
+from svpg.reference import ReferenceCache
+from svpg.stage_cache import StageCache
+from svpg.resources import ResourceGovernor, minigraph_mem, WORKER_MEM
 from svpg.output_vcf import consolidate_clusters_unilocal, write_final_vcf
-from svpg.SVGenotype import genotype
+from svpg.SVGenotype import genotype, plan_genotype_tiles
 from svpg.graph_augment import augment_pipe
 from svpg.realign import run_align
 
 options = parse_arguments()
-ref_genome = pysam.FastaFile(options.ref)
+ref_genome = ReferenceCache(options.ref) if options.sub != 'index' else None
+governor = ResourceGovernor(options.num_threads, options.max_mem) if options.sub != 'index' else None
+
+
+worker_pool = None
+worker_pool_budget = None
+worker_options = None
+worker_gfa_node = None
+worker_ref = None
+
+
+def init_worker(shared_options, gfa_node):
+    """Pool initializer: keep the run-wide read-only state in every worker process."""
+    global worker_options, worker_gfa_node, worker_ref
+    worker_options = shared_options
+    worker_gfa_node = gfa_node
+    worker_ref = ReferenceCache(shared_options.ref)
+
+
+def reserve_worker_pool():
+    """Reserve the threads and memory of the worker pool; closing the returned stack releases them."""
+    size = governor.pool_size()
+    budget = ExitStack()
+    budget.enter_context(governor.reserve(size, size * WORKER_MEM))
+    return budget
+
+
+def start_worker_pool(gfa_node):
+    """Start the process pool used by all parallel steps of the run; it holds its share of the budget until stopped."""
+    global worker_pool, worker_pool_budget
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'forkserver' if 'forkserver' in methods else 'spawn')
+    # the budget is taken before the workers fork, and given back if they cannot be started
+    with reserve_worker_pool() as budget:
+        worker_pool = context.Pool(processes=governor.pool_size(), initializer=init_worker, initargs=(options, gfa_node))
+        worker_pool_budget = budget.pop_all()
+    return worker_pool
+
+
+def stop_worker_pool():
+    global worker_pool, worker_pool_budget
+    if worker_pool is not None:
+        worker_pool.close()
+        worker_pool.join()
+        worker_pool_budget.close()
+        worker_pool = worker_pool_budget = None
+
+
+@contextmanager
+def worker_pool_idle():
+    """Lend the budget of the idle worker pool to a tool run from the main process, such as minigraph.
+
+    The pool must not be given tasks inside the block; its reservation is taken back when the block ends.
+    """
+    global worker_pool_budget
+    if worker_pool_budget is None:
+        yield
+        return
+    worker_pool_budget.close()
+    try:
+        yield
+    finally:
+        worker_pool_budget = reserve_worker_pool()
+
+
+def read_bam_task(task):
+    index, contig, start, end = task
+    return index, read_bam(contig, start, end, worker_options)
+
+
+def cluster_task(bins, bin_depth):
+    return cluster_data(bins, bin_depth)
+
+
+def realign_task(intervals, contig):
+    return run_align(intervals, worker_ref.chrom(contig), worker_options)
+
+
+def genotype_task(candidates):
+    return genotype(candidates, worker_options)
+
+
+def read_gaf_chunk(start, end):
+    return read_gaf_pan_chunk(worker_gfa_node, worker_options, start, end)
 
 
 def multi_process(total_len, step, args=None):
+    """Split `total_len` items of a step into chunks and run them on the worker pool.
+
+    Tasks only carry their own data (signature bins, realignment intervals); options, the GFA index and
+    the reference are held by the workers.
+    """
     num_threads = min(options.num_threads, max(1, total_len // 100))
 
     chunk_size = total_len // num_threads
@@ -33,41 +127,163 @@ def multi_process(total_len, step, args=None):
     for i in range(num_threads):
         start = i * chunk_size
         end = start + chunk_size if i < num_threads - 1 else total_len
-        if step == 'read_bam':
-            chunks.append((args, start, end, options))
-        elif step == 'cluster':
-            chunks.append((args[0][start:end], args[1]))
-        else:
-            chunks.append((args[0][start:end], args[1], options))
-
-    with Pool(processes=num_threads) as pool:
-        if step == 'read_bam':
-            results = pool.starmap(read_bam, chunks)
-        elif step == 'read_gaf':
-            results = pool.starmap(read_gaf, chunks)
-        elif step == 'read_gaf_pan':
-            results = pool.starmap(read_gaf_pan, chunks)
-        elif step == 'realign':
-            results = pool.starmap(run_align, chunks)
-        elif step == 'cluster':
-            results = pool.starmap(cluster_data, chunks)
-        else:
-            results = pool.starmap(genotype, chunks)
+        chunks.append((args[0][start:end], args[1]))
+
+    if step == 'realign':
+        results = worker_pool.starmap(realign_task, chunks)
+    else:
+        results = worker_pool.starmap(cluster_task, chunks)
 
     return [item for sublist in results for item in sublist]
 
 
-def read_in_chunks(file_object, chunk_size=102400):
-    while True:
-        lines = []
-        for _ in range(chunk_size):
-            line = file_object.readline().decode('utf-8').strip()
-            if not line:
-                break
-            lines.append(line)
-        if not lines:
-            break
-        yield lines
+def read_bam_tiles(tiles):
+    """Collect signatures from BAM tiles in one queue on the worker pool, largest tiles first.
+
+    The per-tile tables are concatenated in genomic order, independent of completion order.
+    """
+    order = sorted(range(len(tiles)), key=lambda i: -tiles[i][3])
+    results = [None] * len(tiles)
+    for index, table in worker_pool.imap_unordered(read_bam_task, [(i, *tiles[i][:3]) for i in order]):
+        results[index] = table
+    return SignatureTable.concat(results)
+
+
+def genotype_parallel(candidates):
+    """Genotype candidates of all SV types on the worker pool, one BAM sweep per tile of neighbouring candidates."""
+    tiles = plan_genotype_tiles(candidates, options.num_threads * 4)
+    results = worker_pool.map(genotype_task, [[candidates[i] for i in tile] for tile in tiles])
+    genotyped = list(candidates)
+    for tile, result in zip(tiles, results):
+        for i, candidate in zip(tile, result):
+            genotyped[i] = candidate
+    return genotyped
+
+
+def refinement_fasta_records(refine_sigs):
+    """Yield (name, sequence) of the read context around each refinement signature for realignment to the graph.
+
+    Read context missing at the read ends is padded with reference sequence.
+    """
+    for sig in refine_sigs:
+        # adjac_distance = max(min(5000, sig.svlen*3), 2000)
+        adjac_distance = READ_FLANK
+        read_len = sig.read_len
+        if sig.signature == 'suppl':
+            read_seq = sig.read_seq
+        else:
+            read_seq = sig.read_window(max(sig.pos_read - adjac_distance, 0), sig.pos_read + sig.svlen + adjac_distance)
+
+        ref_suppl1, ref_suppl2 = '', ''
+        svtype = sig.type
+        if sig.pos_read < adjac_distance:
+            try:
+                ref_suppl1 = ref_genome.fetch(sig.contig, sig.start - adjac_distance, sig.start - sig.pos_read)
+            except ValueError:
+                ref_suppl1 = ''
+        if svtype == 'DEL' and sig.pos_read + adjac_distance > read_len:
+            try:
+                ref_suppl2 = ref_genome.fetch(sig.contig, sig.end + (read_len - sig.pos_read),
+                                              sig.end + adjac_distance)
+            except ValueError:
+                ref_suppl2 = ref_genome.fetch(sig.contig, sig.end + (read_len - sig.pos_read),
+                                              ref_genome.length(sig.contig))
+        elif svtype == 'INS' and sig.pos_read + sig.svlen + adjac_distance > read_len:
+            try:
+                ref_suppl2 = ref_genome.fetch(sig.contig,
+                                              sig.start + read_len - sig.pos_read - sig.svlen,
+                                              sig.start + adjac_distance)
+            except ValueError:
+                ref_suppl2 = ref_genome.fetch(sig.contig,
+                                              sig.start + read_len - sig.pos_read - sig.svlen,
+                                              ref_genome.length(sig.contig))
+
+        read_seq = ref_suppl1 + read_seq + ref_suppl2
+        pos_ref = str(sig.contig) + ':' + str(sig.start) + ':' + str(sig.end)
+        read_info = f"{sig.read_name}@{svtype}@{pos_ref}@{sig.alt_seq}" if svtype == 'INS' else f"{sig.read_name}@{svtype}@{pos_ref}"
+        yield read_info, read_seq
+
+
+def collect_bam_signatures():
+    """Collect SV signatures from the BAM file in read-balanced tiles, or None if the BAM cannot be read."""
+    try:
+        bam = pysam.AlignmentFile(options.bam, threads=options.bam_threads)
+        bam.check_index()
+    except ValueError:
+        logging.warning(
+            "Input BAM file is missing a valid index. Please generate with 'samtools faidx'.")
+    except AttributeError:
+        logging.warning(
+            "pysam's check_index raised an Attribute error. Something is wrong with the input BAM file.")
+        return None
+
+    tiles = plan_bam_tiles(bam, options.bam, options.contigs, options.num_threads * 16)
+    logging.info("Processing {0} BAM tiles on {1} contigs...".format(len(tiles), len({tile[0] for tile in tiles})))
+    return read_bam_tiles(tiles)
+
+
+def map_signatures_to_graph(bam_signatures, gfa_node):
+    """Cluster the BAM signatures and refine the isolated clusters by realigning their reads to the graph.
+
+    Returns the graph signatures, the clusters passed on to the final clustering unchanged (the unresolved ones with
+    --realign, otherwise those adjacent to another cluster) and the SVs recalled by realignment.
+    """
+    deletion_signatures = bam_signatures.of_type("DEL")
+    insertion_signatures = bam_signatures.of_type("INS")
+    # logging.info("Found {0} signatures for deleted regions.".format(len(deletion_signatures)))
+    # logging.info("Found {0} signatures for inserted regions.".format(len(insertion_signatures)))
+
+    signature_clusters = []
+    for element_signature in [insertion_signatures, deletion_signatures]:
+        if not element_signature:
+            continue
+        signature_bin, bin_depth = form_bins(element_signature, 1000)
+        if bin_depth == 0:
+            logging.warning("No signatures found in the current bin. Skipping clustering for this bin.")
+            continue
+        signature_clusters.extend(multi_process(len(signature_bin), 'cluster', (signature_bin, bin_depth)))
+
+    signature_clusters = sorted(signature_clusters, key=lambda x: (x[0].contig, np.median([m.start for m in x])))
+    positions = [np.median([m.start for m in c]) for c in signature_clusters]
+
+    n = len(positions)
+    adjacent = [False] * n
+
+    for i in range(n):
+        if i > 0 and abs(positions[i] - positions[i - 1]) < 1000:
+            adjacent[i] = adjacent[i - 1] = True
+        if i < n - 1 and abs(positions[i + 1] - positions[i]) < 1000:
+            adjacent[i] = adjacent[i + 1] = True
+    close_clusters = [signature_clusters[i] for i in range(n) if adjacent[i]]
+
+    recalled_sv, carried_clusters = [], close_clusters
+    if options.realign:
+        logging.info("Realignment enabled: Merging adjacent clusters for realignment.")
+        recalled_sv, carried_clusters = recall_task(positions, adjacent, signature_clusters)
+
+    refine_bins = [signature_clusters[i] for i in range(n) if not adjacent[i]]
+    refine_sigs = [sig for group in refine_bins for sig in group]
+
+    logging.info("*************** Collect signatures from pangenome-reference ***************")
+
+    # the pool is idle while minigraph aligns and its output is parsed here, so minigraph takes over its budget
+    with worker_pool_idle(), governor.reserve(governor.num_threads, minigraph_mem(options.gfa)) as threads:
+        gaf_lines = minigraph_gaf_lines(refinement_fasta_records(refine_sigs), options, threads)
+        pan_signatures = read_gaf(gfa_node, options, gaf_lines)
+    return pan_signatures, carried_clusters, recalled_sv
+
+
+def read_gaf_parallel(gfa_node):
+    """Parse the WGS GAF in byte ranges aligned to query names across the process pool."""
+    ranges = split_gaf(options.gaf, options.num_threads * 4)
+    logging.info(f"Processing {len(ranges)} GAF chunks with {options.num_threads} processes")
+    results = worker_pool.starmap(read_gaf_chunk, ranges)
+    signatures = merge_gaf_chunks(results)
+    if signatures is None:
+        logging.warning("Alignments in the GAF file are not grouped by query name, falling back to serial parsing.")
+        return read_gaf_pan(gfa_node, options)
+    return signatures
+
 
 def recall_task(positions, adjacent, signature_clusters):
     merged_intervals = []  # [(chrom, start, end, svtype, [cluster_idx,...])]
@@ -124,8 +340,7 @@ def recall_task(positions, adjacent, signature_clusters):
         chrom_merged.setdefault(contig, []).append((contig, start, end, svtype, sigs, idx_list))
 
     for chrom, intervals in chrom_merged.items():
-        ref_seq = ref_genome.fetch(chrom)
-        recall_candidates = multi_process(len(intervals), 'realign', (intervals, ref_seq))
+        recall_candidates = multi_process(len(intervals), 'realign', (intervals, chrom))
         seen = set()
 
         j = 0
@@ -159,12 +374,116 @@ def recall_task(positions, adjacent, signature_clusters):
     logging.info(f"Recalled {len(recalled_sv)} SVs and {len(uncalled_clusters)} uncalled clusters.")
     return recalled_sv, uncalled_clusters
 
+def augment_sample_call(fasta_file_path, num_threads, max_mem=None):
+    """Align one sample assembly to the graph and call its SVs with graph-call, inside the sample directory.
+
+    The sample holds `num_threads` threads and `max_mem` bytes of the run's budget while it is aligned and called.
+    Returns the path of the bgzipped VCF, or None if the sample failed. A sample whose VCF and index are newer than
+    its FASTA and the graph is not called again, and its GAF is only reused while it is newer than both as well.
+    """
+    # Get the directory of the fasta file and its prefix
+    sample_dir = os.path.dirname(os.path.abspath(fasta_file_path))
+    prefix = os.path.basename(os.path.dirname(fasta_file_path)) if os.path.dirname(fasta_file_path) else \
+        os.path.splitext(os.path.basename(fasta_file_path))[0]
+    # graph-call writes the bgzipped, indexed VCF itself
+    var_file = options.vcf_out if options.vcf_out.endswith(".gz") else f"{options.vcf_out}.gz"
+    vcf_path = os.path.join(sample_dir, var_file)
+    try:
+        inputs_mtime = max(os.path.getmtime(fasta_file_path), os.path.getmtime(options.gfa))
+        if os.path.exists(vcf_path) and os.path.exists(f"{vcf_path}.tbi") and \
+                min(os.path.getmtime(vcf_path), os.path.getmtime(f"{vcf_path}.tbi")) >= inputs_mtime:
+            logging.info(f"SVs of {prefix} are up to date, skipping.")
+            return vcf_path
+
+        logging.info(f"Start call SVs from {prefix} with {num_threads} threads")
+        file_size = os.path.getsize(fasta_file_path)
+        coverage = file_size // (1024 * 1024 * 1024) // 3.1
+        hifi_support_map = [
+            (0, 5, 1), (5, 15, 2), (15, 25, 3), (25, 50, 4), (50, float("inf"), 5)
+        ]
+        ont_support_map = [
+            (0, 5, 2), (5, 15, 3), (15, 25, 4), (25, 50, 5), (50, float("inf"), 10)
+        ]
+        support_map = hifi_support_map if options.read == 'hifi' else ont_support_map
+        support = next(val for low, high, val in support_map if low <= coverage <= high)
+
+        gaf_file = f"{prefix}.gaf"
+        gaf_path = os.path.join(sample_dir, gaf_file)
+        # an alignment older than the FASTA or the graph is redone
+        if not os.path.exists(gaf_path) or os.path.getmtime(gaf_path) < inputs_mtime:
+            preset = 'asm' if options.read == 'hifi' else 'lr'
+            cmd_align = ["minigraph", f"-t{num_threads}", f"-cx{preset}", "--vc", "--secondary", "yes",
+                         os.path.abspath(options.gfa), os.path.abspath(fasta_file_path)]
+            # write to a temporary file so that an interrupted alignment is not mistaken for a finished one
+            with open(f"{gaf_path}.tmp", "w") as gaf_out, governor.reserve(num_threads, max_mem or 0):
+                subprocess.run(cmd_align, check=True, stdout=gaf_out, stderr=subprocess.DEVNULL)
+            os.replace(f"{gaf_path}.tmp", gaf_path)
+
+        cmd_call = [
+            sys.executable, __file__, "graph-call",
+            "--read", options.read,
+            "-s", str(support),
+            "-t", str(num_threads),
+            "--working_dir", sample_dir,
+            "--ref", os.path.abspath(options.ref),
+            "--gfa", os.path.abspath(options.gfa),
+            "--gaf", gaf_file,
+            "-o", var_file,
+            "--min_sv_size", str(options.min_sv_size),
+            "--max_sv_size", str(options.max_sv_size),
+            "--types", 'DEL,INS'
+        ]
+        if max_mem is not None:
+            cmd_call += ["--max_mem", str(max_mem)]
+        try:
+            with governor.reserve(num_threads, max_mem or 0):
+                subprocess.run(cmd_call, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               text=True, cwd=sample_dir)
+        except subprocess.CalledProcessError as e:
+            logging.error(
+                f"'{prefix}' encountered an error while running the SVs call.\
+                Please check the logs in the sample directory: {sample_dir}"
+            )
+            raise RuntimeError(f"Error occurred for sample: {prefix}") from e
+    except Exception as e:
+        logging.error(f"Failed to process sample from path {fasta_file_path}: {e}")
+        return None
+
+    return vcf_path if os.path.exists(vcf_path) else None
+
+
+def run_augment_calls(sample_paths, min_sample_threads=8):
+    """Call SVs of several samples at once within the --num_threads budget.
+
+    Samples run concurrently with an equal share of at least `min_sample_threads` threads each, which is used both by
+    minigraph and by the graph-call run of the sample. With --max_mem, only as many samples run at once as fit its
+    estimated minigraph memory, and each gets an equal share of the cap. Returns the VCF path (or None) of every sample,
+    in input order.
+    """
+    concurrent = max(1, min(len(sample_paths), options.num_threads // min_sample_threads))
+    if governor.max_mem is not None:
+        concurrent = max(1, min(concurrent, governor.max_mem // minigraph_mem(options.gfa)))
+    sample_threads = governor.share(concurrent)
+    sample_mem = governor.mem_share(concurrent)
+    logging.info(f"Calling {len(sample_paths)} samples, {concurrent} at a time with {sample_threads} threads each.")
+    with ThreadPoolExecutor(max_workers=concurrent) as executor:
+        return list(executor.map(lambda path: augment_sample_call(path, sample_threads, sample_mem), sample_paths))
+
+
 def main():
     # Set up logging
     logFormatter = logging.Formatter("%(asctime)s [%(levelname)-7.7s]  %(message)s")
     rootLogger = logging.getLogger()
     rootLogger.setLevel(logging.INFO)
 
+    if options.sub == 'index':
+        consoleHandler = logging.StreamHandler()
+        consoleHandler.setFormatter(logFormatter)
+        rootLogger.addHandler(consoleHandler)
+        logging.info("MODE: index")
+        build_gfa_index(options.gfa, options.out)
+        return
+
     # Ensure the base directory exists
     os.makedirs(options.working_dir, exist_ok=True)
 
@@ -184,161 +503,64 @@ def main():
 
     gfa_node = read_gfa(options.gfa)
 
-    if options.contigs is None:
+    # augment only drives graph-call runs and has no contig or merge options of its own
+    if options.sub != 'augment' and options.contigs is None:
         options.contigs = [ctg for ctg in ref_genome.references if re.match(r'^(chr)?[0-9XYM]+$', ctg)]
 
-    if options.max_merge_threshold is None:
+    if options.sub != 'augment' and options.max_merge_threshold is None:
         if options.read == 'hifi':
             options.max_merge_threshold = 50
         else:
             options.max_merge_threshold = 500
 
+    # BAM decompression threads of each pool worker, so that the workers together stay within --num_threads
+    options.bam_threads = governor.share(governor.pool_size())
+
     for arg in vars(options):
         logging.info("PARAMETER: {0}, VALUE: {1}".format(arg, getattr(options, arg)))
 
-    pan_signatures = []
+    if options.sub != 'augment':
+        start_worker_pool(gfa_node)
+
+    pan_signatures = SignatureTable.empty()
+    stage_cache = StageCache(options)
     if options.sub == 'call':
         logging.info("MODE: call")
         logging.info("INPUT: {0}".format(os.path.abspath(options.bam)))
         logging.info("***************** Collect SV signatures *****************")
 
-        try:
-            bam = pysam.AlignmentFile(options.bam, threads=options.num_threads)
-            bam.check_index()
-        except ValueError:
-            logging.warning(
-                "Input BAM file is missing a valid index. Please generate with 'samtools faidx'.")
-        except AttributeError:
-            logging.warning(
-                "pysam's check_index raised an Attribute error. Something is wrong with the input BAM file.")
-            return
-
-        bam_signatures = []
-        ref_list = bam.get_index_statistics()
-        for ref in ref_list:
-            if ref.mapped == 0:
-                continue
-            if ref[0] in options.contigs:
-                ref_len = bam.get_reference_length(ref[0])
-                logging.info("Processing ref {0}...".format(ref[0]))
-                bam_signatures.extend(multi_process(ref_len, 'read_bam', ref[0]))
-                logging.info("Processed ref {0}...".format(ref[0]))
-
-        logging.info("****************************** Graph Mapping ******************************")
-
-        # with open(options.working_dir + '/sv_signatures.pkl', 'wb') as temp:
-        #     pickle.dump(bam_signatures, temp)
-        # with open(options.working_dir + '/sv_signatures.pkl', 'rb') as f:
-        #     bam_signatures = pickle.load(f)
-
-        deletion_signatures = [ev for ev in bam_signatures if ev.type == "DEL"]
-        insertion_signatures = [ev for ev in bam_signatures if ev.type == "INS"]
-        # logging.info("Found {0} signatures for deleted regions.".format(len(deletion_signatures)))
-        # logging.info("Found {0} signatures for inserted regions.".format(len(insertion_signatures)))
-
-        signature_clusters = []
-        for element_signature in [insertion_signatures, deletion_signatures]:
-            if not element_signature:
-                continue
-            signature_bin, bin_depth = form_bins(element_signature, 1000)
-            if bin_depth == 0:
-                logging.warning("No signatures found in the current bin. Skipping clustering for this bin.")
-                continue
-            signature_clusters.extend(multi_process(len(signature_bin), 'cluster', (signature_bin, bin_depth)))
-
-        signature_clusters = sorted(signature_clusters, key=lambda x: (x[0].contig, np.median([m.start for m in x])))
-        positions = [np.median([m.start for m in c]) for c in signature_clusters]
-
-        n = len(positions)
-        adjacent = [False] * n
-
-        for i in range(n):
-            if i > 0 and abs(positions[i] - positions[i - 1]) < 1000:
-                adjacent[i] = adjacent[i - 1] = True
-            if i < n - 1 and abs(positions[i + 1] - positions[i]) < 1000:
-                adjacent[i] = adjacent[i + 1] = True
-        close_clusters = [signature_clusters[i] for i in range(n) if adjacent[i]]
-
-        if options.realign:
-            logging.info("Realignment enabled: Merging adjacent clusters for realignment.")
-            recalled_sv, uncalled_clusters = recall_task(positions, adjacent, signature_clusters)
-
-        refine_bins = [signature_clusters[i] for i in range(n) if not adjacent[i]]
-        refine_sigs = [sig for group in refine_bins for sig in group]
-        sig_read = 'signatures'
-
-        fasta_file = open(options.working_dir + f'/{sig_read}.fa', 'w')
-        for sig_index, sig in enumerate(refine_sigs):
-            # adjac_distance = max(min(5000, sig.svlen*3), 2000)
-            adjac_distance = 2000
-            if sig.signature == 'suppl':
-                read_seq = sig.read_seq
-            else:
-                if sig.pos_read < adjac_distance:
-                    read_seq = sig.read_seq[0:sig.pos_read + sig.svlen + adjac_distance]
-                else:
-                    read_seq = sig.read_seq[
-                               sig.pos_read - adjac_distance:sig.pos_read + sig.svlen + adjac_distance] if sig.pos_read else sig.read_seq
-
-            ref_suppl1, ref_suppl2 = '', ''
-            svtype = sig.type
-            if sig.pos_read < adjac_distance:
-                try:
-                    ref_suppl1 = ref_genome.fetch(sig.contig, sig.start - adjac_distance, sig.start - sig.pos_read)
-                except ValueError:
-                    ref_suppl1 = ''
-            if svtype == 'DEL' and sig.pos_read + adjac_distance > len(sig.read_seq):
-                try:
-                    ref_suppl2 = ref_genome.fetch(sig.contig, sig.end + (len(sig.read_seq) - sig.pos_read),
-                                                  sig.end + adjac_distance)
-                except ValueError:
-                    ref_suppl2 = ref_genome.fetch(sig.contig, sig.end + (len(sig.read_seq) - sig.pos_read),
-                                                  len(ref_genome.fetch(sig.contig)))
-            elif svtype == 'INS' and sig.pos_read + sig.svlen + adjac_distance > len(sig.read_seq):
-                try:
-                    ref_suppl2 = ref_genome.fetch(sig.contig,
-                                                  sig.start + len(sig.read_seq) - sig.pos_read - sig.svlen,
-                                                  sig.start + adjac_distance)
-                except ValueError:
-                    ref_suppl2 = ref_genome.fetch(sig.contig,
-                                                  sig.start + len(sig.read_seq) - sig.pos_read - sig.svlen,
-                                                  len(ref_genome.fetch(sig.contig)))
-
-            read_seq = ref_suppl1 + read_seq + ref_suppl2
-            pos_ref = str(sig.contig) + ':' + str(sig.start) + ':' + str(sig.end)
-            read_info = f"{sig.read_name}@{svtype}@{pos_ref}@{sig.alt_seq}" if svtype == 'INS' else f"{sig.read_name}@{svtype}@{pos_ref}"
-            fasta_file.write(f'>{read_info}\n{read_seq}\n')
-
-        fasta_file.close()
-
-        if options.read == 'hifi':
-            os.system(
-                f'minigraph -t {options.num_threads} -cx asm --vc --secondary yes {options.gfa} {options.working_dir}/{sig_read}.fa > {options.working_dir}/{sig_read}.gaf')
+        graph_stage = stage_cache.load('graph')
+        if graph_stage is not None:
+            pan_signatures, clusters, recalled_sv = graph_stage
+            carried_clusters = clusters['carried']
         else:
-            os.system(
-                f'minigraph -t {options.num_threads} -cx lr --vc --secondary yes {options.gfa} {options.working_dir}/{sig_read}.fa > {options.working_dir}/{sig_read}.gaf')
-
-        logging.info("*************** Collect signatures from pangenome-reference ***************")
+            collect_stage = stage_cache.load('collect')
+            if collect_stage is not None:
+                bam_signatures = collect_stage[0]
+            else:
+                bam_signatures = collect_bam_signatures()
+                if bam_signatures is None:
+                    return
+                stage_cache.save('collect', bam_signatures)
 
-        pan_signatures = read_gaf(gfa_node, options)
-        # with open(options.working_dir + f'/{sig_read}.gaf', 'rb') as f:
-        #     for chunk_index, lines in enumerate(read_in_chunks(f, chunk_size=200000000)):
-        #         logging.info(f"Processing chunks {chunk_index + 1}")
-        #         pan_signatures.extend(multi_process(len(lines), 'read_gaf', (lines, gfa_node)))
-        #         logging.info(f"Processed chunks {chunk_index + 1}")
+            logging.info("****************************** Graph Mapping ******************************")
+            pan_signatures, carried_clusters, recalled_sv = map_signatures_to_graph(bam_signatures, gfa_node)
+            stage_cache.save('graph', pan_signatures, {'carried': carried_clusters}, recalled_sv)
 
     elif options.sub == 'graph-call':
         logging.info("MODE: graph-call")
         logging.info("INPUT: {0}".format(os.path.abspath(options.gaf)))
         logging.info("*************** Collect SV signatures from pangenome ***************")
 
-        pan_signatures = read_gaf_pan(gfa_node, options)
-        # with open(options.gaf, 'rb') as f:
-        #     for chunk_index, lines in enumerate(read_in_chunks(f, chunk_size=200000000)):
-        #         logging.info(f"Processing chunk {chunk_index + 1}")
-        #         pan_signatures.extend(multi_process(len(lines), 'read_gaf_pan', (lines, gfa_node)))
-        #         logging.info(f"Processed chunks {chunk_index + 1}")
-        sig_read = 'signatures_test'
+        collect_stage = stage_cache.load('collect')
+        if collect_stage is not None:
+            pan_signatures = collect_stage[0]
+        else:
+            if options.num_threads > 1:
+                pan_signatures = read_gaf_parallel(gfa_node)
+            else:
+                pan_signatures = read_gaf_pan(gfa_node, options)
+            stage_cache.save('collect', pan_signatures)
     elif options.sub == 'augment':
         logging.info("MODE: augment")
         logging.info("*************** Collect SVs from pangenome ***************")
@@ -375,98 +597,28 @@ def main():
                 raise RuntimeError("No sample paths to process.")
             else:
                 logging.info(f"Found {len(sample_paths_to_process)} samples to process.")
+            vcf_paths = run_augment_calls(sample_paths_to_process)
             with open(filelist_path, "a") as filelist:
-                for fasta_file_path in sample_paths_to_process:
-                    try:
-                        # Get the directory of the fasta file and its prefix
-                        sample_dir = os.path.dirname(fasta_file_path)
-                        prefix = os.path.basename(sample_dir) if sample_dir else \
-                            os.path.splitext(os.path.basename(fasta_file_path))[0]
-
-                        original_cwd = os.getcwd()
-                        os.chdir(sample_dir)
-
-                        fasta_file_name = os.path.basename(fasta_file_path)
-
-                        logging.info(f"Start call SVs from {prefix}")
-                        file_size = os.path.getsize(fasta_file_name)
-                        coverage = file_size // (1024 * 1024 * 1024) // 3.1
-                        hifi_support_map = [
-                            (0, 5, 1), (5, 15, 2), (15, 25, 3), (25, 50, 4), (50, float("inf"), 5)
-                        ]
-                        ont_support_map = [
-                            (0, 5, 2), (5, 15, 3), (15, 25, 4), (25, 50, 5), (50, float("inf"), 10)
-                        ]
-                        support_map = hifi_support_map if options.read == 'hifi' else ont_support_map
-                        support = next(val for low, high, val in support_map if low <= coverage <= high)
-
-                        gaf_file = f"{prefix}.gaf"
-                        if not os.path.exists(gaf_file):
-                            if options.read == 'hifi':
-                                cmd_align = f"minigraph -t{options.num_threads} -cxasm --vc --secondary yes {options.gfa} {fasta_file_name} > {gaf_file}"
-                            else:
-                                cmd_align = f"minigraph -t{options.num_threads} -cxlr --vc --secondary yes {options.gfa} {fasta_file_name} > {gaf_file}"
-                            os.system(cmd_align)
-
-                        var_file = options.vcf_out
-                        cmd_call = [
-                            "python", __file__, "graph-call",
-                            "--read", options.read,
-                            "-s", str(support),
-                            "-t",str(options.num_threads),
-                            "--working_dir", './',  # This should refer to the current sample directory
-                            "--ref", options.ref,
-                            "--gfa", options.gfa,
-                            "--gaf", gaf_file,
-                            "-o", var_file,
-                            "--min_sv_size", str(options.min_sv_size),
-                            "--max_sv_size", str(options.max_sv_size),
-                            "--types", 'DEL,INS'
-                        ]
-                        try:
-                            subprocess.run(cmd_call, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
-                                           text=True)
-                            pysam.tabix_compress(var_file, f"{var_file}.gz", force=True)
-                            pysam.tabix_index(f"{var_file}.gz", preset="vcf", force=True)
-                        except subprocess.CalledProcessError:
-                            logging.error(
-                                f"'{prefix}' encountered an error while running the SVs call.\
-                                Please check the logs in the sample directory: {sample_dir}"
-                            )
-                            raise RuntimeError(f"Error occurred for sample: {prefix}") from e
-
-                        # write the VCF path to filelist.tsv
-                        vcf_path = os.path.join(sample_dir, f"{var_file}.gz")
-                        if os.path.exists(vcf_path):
-                            filelist.write(f"{vcf_path}\n")
-
-                    except Exception as e:
-                        logging.error(f"Failed to process sample from path {fasta_file_path}: {e}")
-                    finally:
-                        # Always change back to the original working directory
-                        os.chdir(original_cwd)
+                for vcf_path in vcf_paths:
+                    if vcf_path is not None:
+                        filelist.write(f"{vcf_path}\n")
 
         call_time = time.time()
         logging.info(f"SVs call time: {call_time - start_time:.2f} seconds")
 
         logging.info("*************** Augment pangenome graph ***************")
-        augment_pipe(base_dir, options.ref, options.gfa, options.out)
+        augment_pipe(base_dir, options.ref, options.gfa, options.out, governor, options.incremental)
         end_time = time.time()
         logging.info(f"Graph augment time: {end_time - call_time:.2f} seconds")
         logging.info(f"Total time: {end_time - start_time:.2f} seconds")
 
         return
 
-    # with open(options.working_dir + f'/{sig_read}_test.pkl', 'wb') as temp:
-    #     pickle.dump(pan_signatures, temp)
-    # with open(options.working_dir + f'/{sig_read}_test.pkl', 'rb') as f:
-    #     pan_signatures = pickle.load(f)
-
-    deletion_signatures = [ev for ev in pan_signatures if ev.type == "DEL"]
-    insertion_signatures = [ev for ev in pan_signatures if ev.type == "INS"]
-    duplication_signatures = [ev for ev in pan_signatures if ev.type == "DUP"]
-    inversion_signatures = [ev for ev in pan_signatures if ev.type == "INV"]
-    breakend_signatures = [ev for ev in pan_signatures if ev.type == "BND"]
+    deletion_signatures = pan_signatures.of_type("DEL")
+    insertion_signatures = pan_signatures.of_type("INS")
+    duplication_signatures = pan_signatures.of_type("DUP")
+    inversion_signatures = pan_signatures.of_type("INV")
+    breakend_signatures = pan_signatures.of_type("BND")
 
     logging.info("Found {0} signatures for deleted regions.".format(len(deletion_signatures)))
     logging.info("Found {0} signatures for inserted regions.".format(len(insertion_signatures)))
@@ -486,10 +638,7 @@ def main():
         pan_clusters.extend(multi_process(len(signature_bin), 'cluster', (signature_bin, bin_depth)))
 
     if options.sub == 'call':
-        if options.realign:
-            pan_clusters = pan_clusters + uncalled_clusters
-        else:
-            pan_clusters = pan_clusters + close_clusters
+        pan_clusters = pan_clusters + carried_clusters
     pan_clusters = [cluster for cluster in pan_clusters if len(cluster) >= options.min_support]
     chrom_results = {}
     for sig in pan_clusters:
@@ -500,9 +649,8 @@ def main():
     sv_candidate = []
     for contig in chrom_results:
         if contig in options.contigs:
-            ref_chrom_seq = ref_genome.fetch(contig)
             sv_candidate.extend(sorted(
-                consolidate_clusters_unilocal(chrom_results[contig], ref_chrom_seq, options, cons=options.alt_consensus),
+                consolidate_clusters_unilocal(chrom_results[contig], ref_genome.chrom(contig), options, cons=options.alt_consensus, pool=worker_pool),
                 key=lambda cluster: (cluster.contig, cluster.start)))
 
     deletion_candidates = [i for i in sv_candidate if i.type == 'DEL']
@@ -517,14 +665,12 @@ def main():
 
     if options.sub == 'call' and not options.skip_genotype:
         logging.info("********************************* GENOTYPE ********************************")
-        logging.info("Genotyping deletions..")
-        deletion_candidates = multi_process(len(deletion_candidates), 'genotype', (deletion_candidates, "DEL"))
-        logging.info("Genotyping insertions..")
-        insertion_candidates = multi_process(len(insertion_candidates), 'genotype', (insertion_candidates, "INS"))
-        logging.info("Genotyping duplications..")
-        duplication_candidates = multi_process(len(duplication_candidates), 'genotype', (duplication_candidates, "DUP"))
-        logging.info("Genotyping breakends..")
-        breakend_candidates = multi_process(len(breakend_candidates), 'genotype', (breakend_candidates, "BND"))
+        logging.info("Genotyping deletions, insertions, duplications and breakends..")
+        genotyped = genotype_parallel(deletion_candidates + insertion_candidates + duplication_candidates + breakend_candidates)
+        deletion_candidates = [i for i in genotyped if i.type == 'DEL']
+        insertion_candidates = [i for i in genotyped if i.type == 'INS']
+        duplication_candidates = [i for i in genotyped if i.type == 'DUP']
+        breakend_candidates = [i for i in genotyped if i.type == 'BND']
 
     if options.sub == 'call' and options.realign:
         deletion_candidates_recall = [i for i in recalled_sv if i.type == 'DEL']
@@ -539,6 +685,7 @@ def main():
                     ref_genome.references,
                     ref_genome.lengths,
                     options)
+    stop_worker_pool()
 
 if __name__ == "__main__":
     try:
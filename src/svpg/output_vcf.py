@@ -1,12 +1,15 @@
 import numpy as np
 import time
 import re
+import heapq
 import os.path
+from operator import itemgetter
 from collections import defaultdict, Counter
 
-import pyabpoa
+import pysam
 
-from svpg.util import sorted_nicely
+from svpg.util import contig_ranks
+from svpg.consensus import consensus_batch
 
 class Candidate:
     def __init__(self, contig, start, end,  type, members, ref_seq='N', alt_seq='.', genotype='1/1', ref_reads=None, alt_reads=None, pan_known=None, detail_type=None, phase_list=None):
@@ -199,34 +202,19 @@ class CandidateBreakend(Candidate):
                     format="GT:DP:AD",
                     samples="{gt}:{dp}:{ref},{alt}".format(gt=self.genotype, dp=".", ref=".", alt="."))
 
-def _msa_consensus_for_cluster(cluster_seqs, aligner=None):
-    if not cluster_seqs:
-        return None
-    if len(cluster_seqs) == 1:
-        return cluster_seqs[0]
+def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False, pool=None):
+    """Consolidate clusters to a list of (type, contig, mean start, mean end, cluster size, members) tuples.
 
-    if aligner is None:
-        aligner = pyabpoa.msa_aligner()
-
-    parts = sorted([(len(s), s, f'seq{i}') for i, s in enumerate(cluster_seqs)], reverse=True)
-    _, seqs, names = zip(*parts)
-    if not cluster_seqs:
-        return []
-    if aligner is None:
-        aligner = pyabpoa.msa_aligner()
-
-    aln_result = aligner.msa(list(seqs), out_msa=True, out_cons=True, max_n_cons=1)
-    return aln_result.cons_seq
-
-def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False):
-    """Consolidate clusters to a list of (type, contig, mean start, mean end, cluster size, members) tuples."""
+    With `cons`, insertion sequences are the POA consensus of the members' sequences, computed for all clusters of
+    the chromosome in one batch on `pool`.
+    """
     min_sv_length, noseqs = options.min_sv_size, options.noseq
     max_sv_length = float('inf') if options.max_sv_size == -1 else options.max_sv_size
     ultra_sv_length = float('inf') if options.ultra_split_size == -1 else options.ultra_split_size
-    aligner = pyabpoa.msa_aligner()
     repeat_pattern = re.compile(r'(A{20,}|T{20,}|(TC){20,}|(AG){20,})')
 
     consolidated_clusters = []
+    consensus_jobs = []  # (candidate, member sequences) whose ALT is filled in by the consensus batch
     for index, cluster in enumerate(clusters):
         svtype = cluster[0].type
         contig = cluster[0].get_source()[0]
@@ -240,6 +228,7 @@ def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False):
             if svlen > ultra_sv_length and len(members) < 10:
                 continue
             if min_sv_length <= svlen <= max_sv_length:
+                consensus_seqs = None
                 if not noseqs:
                     alt_seq = None
                     if svtype == "INS":
@@ -261,10 +250,7 @@ def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False):
                                     alt_seq = "<INS>"
                                     break
                             if alt_seq != "<INS>" and svlen < 10000:
-                                try:
-                                    alt_seq = _msa_consensus_for_cluster(seqs, aligner=aligner)[0]
-                                except Exception as e:
-                                    alt_seq = seqs[0]
+                                consensus_seqs = seqs
                             elif alt_seq != "<INS>":
                                 alt_seq = seqs[0]
                     elif svtype == "DEL":
@@ -303,6 +289,8 @@ def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False):
                         if hasattr(member, 'phase') and getattr(member, 'phase') is not None
                     ]
                     consolidated_clusters.append(Candidate(contig, start, end, svtype, members, ref_seq, alt_seq, pan_known=pan_known, phase_list=phase_list))
+                    if consensus_seqs is not None:
+                        consensus_jobs.append((consolidated_clusters[-1], consensus_seqs))
         else:
             dest_start = round(np.median([member.get_destination()[1] for member in cluster]))
             source_direction = max([member.source_direction for member in cluster],
@@ -318,8 +306,60 @@ def consolidate_clusters_unilocal(clusters, ref_chrom, options, cons = False):
             consolidated_clusters.append(
                     CandidateBreakend(contig, start, source_direction, cluster[0].get_destination()[0], dest_start, dest_direction, members, detail_type='TRA'))
 
+    consensus = consensus_batch([seqs for _, seqs in consensus_jobs], pool)
+    for (candidate, seqs), cons_seq in zip(consensus_jobs, consensus):
+        candidate.alt_seq = cons_seq[0] if cons_seq else seqs[0]
+
     return consolidated_clusters
 
+def position_columns(positions, n):
+    """(contig rank, start, end) arrays of `n` entries from an iterable of such triples, and their stable order."""
+    columns = np.fromiter(positions, dtype=np.dtype((np.int64, 3)), count=n).reshape(n, 3)
+    ranks, starts, ends = columns.T
+    return ranks, starts, ends, np.lexsort((ends, starts, ranks))
+
+
+def vcf_stream(order, ranks, starts, ends, type_order, svtype, entry):
+    """Yield (sort key, svtype, candidate, reverse, index) of the entries in `order`, building each key when reached.
+
+    `entry(i)` returns the (candidate, reverse) of entry i.
+    """
+    for i in order.tolist():
+        candidate, reverse = entry(i)
+        yield (int(ranks[i]), int(starts[i]), int(ends[i]), type_order, i), svtype, candidate, reverse, i
+
+
+def sorted_vcf_streams(deletion_candidates, novel_insertion_candidates, duplication_candidates, bnd_candidates,
+                       types_to_output, ranks):
+    """Per-type streams of (sort key, svtype, candidate, reverse, index), each in reference order, and the BND numbers.
+
+    The key (contig rank, start, end, type order, index) gives the order of a stable sort of all entries by position, DEL
+    before INS, DUP and BND. Both breakends of BND pair i are entries 2i (source) and 2i + 1 (destination, reverse),
+    and bnd_numbers[j] is the 1-based output number of breakend j among the BNDs. Each type is ordered by an index
+    array over its position columns and its stream builds the keys as it is consumed, so merging the streams holds
+    one key per type instead of a sorted key tuple per entry.
+    """
+    streams = []
+    for type_order, (svtype, candidates) in enumerate((("DEL", deletion_candidates),
+                                                       ("INS", novel_insertion_candidates),
+                                                       ("DUP", duplication_candidates))):
+        if svtype in types_to_output:
+            type_ranks, starts, ends, order = position_columns(((ranks[c.contig], c.start, c.end) for c in candidates),
+                                                               len(candidates))
+            streams.append(vcf_stream(order, type_ranks, starts, ends, type_order, svtype,
+                                      lambda i, candidates=candidates: (candidates[i], False)))
+    bnd_numbers = np.zeros(0, dtype=np.int64)
+    if "BND" in types_to_output or "INV" in types_to_output:
+        breakends = ((ranks[contig], pos, pos + 1) for candidate in bnd_candidates
+                     for contig, pos in (candidate.get_source(), candidate.get_destination()))
+        bnd_ranks, starts, ends, order = position_columns(breakends, 2 * len(bnd_candidates))
+        bnd_numbers = np.empty(len(order), dtype=np.int64)
+        bnd_numbers[order] = np.arange(1, len(order) + 1)
+        streams.append(vcf_stream(order, bnd_ranks, starts, ends, 3, "BND",
+                                  lambda i: (bnd_candidates[i >> 1], bool(i & 1))))
+    return streams, bnd_numbers
+
+
 def write_final_vcf(deletion_candidates,
                     novel_insertion_candidates,
                     duplication_candidates,
@@ -327,123 +367,71 @@ def write_final_vcf(deletion_candidates,
                     contig_names,
                     contig_lengths,
                     options):
+    """Write the candidates in reference order, merging per-type streams that are ordered by index arrays.
+
+    The candidate lists are not in position order (recalled SVs are appended and BND mates lie elsewhere), so each
+    type is sorted once; the writer itself only adds the order arrays and builds lines as they are written.
+    Variant IDs are numbered per type in output order; BND IDs are fixed up front so that each breakend gets its
+    mate's ID without buffering lines. An output name ending in .gz is written bgzip-compressed and tabix-indexed
+    (CSI for contigs beyond the 512 Mbp limit of .tbi).
+    """
     types_to_output = [entry.strip() for entry in options.types.split(",")]
-    vcf_output = open(os.path.join(options.working_dir, options.out), 'w')
+    out_path = os.path.join(options.working_dir, options.out)
+    compressed = out_path.endswith(".gz")
+    vcf_output = pysam.BGZFile(out_path, 'wb') if compressed else open(out_path, 'wb')
 
     # Write header lines
-    print("##fileformat=VCFv4.2", file=vcf_output)
-    print("##fileDate={0}".format(time.strftime("%Y-%m-%d|%I:%M:%S%p|%Z|%z")), file=vcf_output)
+    header = ["##fileformat=VCFv4.2", "##fileDate={0}".format(time.strftime("%Y-%m-%d|%I:%M:%S%p|%Z|%z"))]
     for contig_name, contig_length in zip(contig_names, contig_lengths):
-        print("##contig=<ID={0},length={1}>".format(contig_name, contig_length), file=vcf_output)
+        header.append("##contig=<ID={0},length={1}>".format(contig_name, contig_length))
     if "DEL" in types_to_output:
-        print("##ALT=<ID=DEL,Description=\"Deletion\">", file=vcf_output)
+        header.append("##ALT=<ID=DEL,Description=\"Deletion\">")
     if "INS" in types_to_output:
-        print("##ALT=<ID=INS,Description=\"Insertion\">", file=vcf_output)
-
-    print("##INFO=<ID=SVTYPE,Number=1,Type=String,Description=\"Type of structural variant\">", file=vcf_output)
-    print("##INFO=<ID=END,Number=1,Type=Integer,Description=\"End position of the variant described in this record\">",
-          file=vcf_output)
-    print("##INFO=<ID=SVLEN,Number=1,Type=Integer,Description=\"Difference in length between REF and ALT alleles\">",
-          file=vcf_output)
-    print("##INFO=<ID=SUPPORT,Number=1,Type=Integer,Description=\"Number of reads supporting this variant\">",
-          file=vcf_output)
-    print("##INFO=<ID=DETAILED_TYPE,Number=1,Type=String,Description=\"Detailed type of the SV\">", file=vcf_output)
-    if options.sub == 'call':
-        print("##INFO=<ID=PAN_KNOWN,Number=0,Type=Flag,Description=\"Known structural variations in the pangenome\">",
-              file=vcf_output)
-    print("##INFO=<ID=MATEID,Number=.,Type=String,Description=\"ID of mate breakends\">", file=vcf_output)
-    print("##FILTER=<ID=hom_ref,Description=\"Genotype is homozygous reference\">", file=vcf_output)
-    print("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">", file=vcf_output)
-    print("##FORMAT=<ID=DP,Number=1,Type=Integer,Description=\"Read depth\">", file=vcf_output)
-    print("##FORMAT=<ID=AD,Number=R,Type=Integer,Description=\"Read depth for each allele\">", file=vcf_output)
-    print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample", file=vcf_output)
-
-    vcf_entries = []
-    if "DEL" in types_to_output:
-        for candidate in deletion_candidates:
-            vcf_entries.append((candidate.get_source(), candidate.get_vcf_entry(), "DEL"))
-    if "INS" in types_to_output:
-        for candidate in novel_insertion_candidates:
-            vcf_entries.append((candidate.get_source(), candidate.get_vcf_entry(), "INS"))
-    if "DUP" in types_to_output:
-        for candidate in duplication_candidates:
-            vcf_entries.append((candidate.get_source(), candidate.get_vcf_entry(), "DUP"))
-    if "BND" in types_to_output or "INV" in types_to_output:
-        pair_index = 0
-        for candidate in bnd_candidates:
-            entry1 = candidate.get_vcf_entry()
-            entry2 = candidate.get_vcf_entry_reverse()
-
-            # pair_id for linking two breakends
-            pair_id = f"pair_{pair_index}"
-            pair_index += 1
-
-            vcf_entries.append(
-                ((candidate.get_source()[0], candidate.get_source()[1], candidate.get_source()[1] + 1),
-                 (entry1, pair_id), "BND"))
-            vcf_entries.append(((candidate.get_destination()[0], candidate.get_destination()[1],
-                                 candidate.get_destination()[1] + 1), (entry2, pair_id), "BND"))
-
-    normalized = []
-    for item in vcf_entries:
-        loc = item[0]
-        middle = item[1]
-        svtype = item[2]
+        header.append("##ALT=<ID=INS,Description=\"Insertion\">")
 
-        if isinstance(middle, tuple) and len(middle) == 2:  # BND entry with pair_id
-            entry_str, pair_id = middle
-        else:   # non-BND
-            entry_str, pair_id = middle, None
-
-        normalized.append((loc, (entry_str, pair_id), svtype))
-
-    entries_sorted = sorted_nicely(normalized)
+    header.append("##INFO=<ID=SVTYPE,Number=1,Type=String,Description=\"Type of structural variant\">")
+    header.append("##INFO=<ID=END,Number=1,Type=Integer,Description=\"End position of the variant described in this record\">")
+    header.append("##INFO=<ID=SVLEN,Number=1,Type=Integer,Description=\"Difference in length between REF and ALT alleles\">")
+    header.append("##INFO=<ID=SUPPORT,Number=1,Type=Integer,Description=\"Number of reads supporting this variant\">")
+    header.append("##INFO=<ID=DETAILED_TYPE,Number=1,Type=String,Description=\"Detailed type of the SV\">")
+    if options.sub == 'call':
+        header.append("##INFO=<ID=PAN_KNOWN,Number=0,Type=Flag,Description=\"Known structural variations in the pangenome\">")
+    header.append("##INFO=<ID=MATEID,Number=.,Type=String,Description=\"ID of mate breakends\">")
+    header.append("##FILTER=<ID=hom_ref,Description=\"Genotype is homozygous reference\">")
+    header.append("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">")
+    header.append("##FORMAT=<ID=DP,Number=1,Type=Integer,Description=\"Read depth\">")
+    header.append("##FORMAT=<ID=AD,Number=R,Type=Integer,Description=\"Read depth for each allele\">")
+    header.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample")
+    vcf_output.write(("\n".join(header) + "\n").encode())
+
+    contigs = set(contig_names)
+    for candidates in (deletion_candidates, novel_insertion_candidates, duplication_candidates):
+        contigs.update(candidate.contig for candidate in candidates)
+    for candidate in bnd_candidates:
+        contigs.update((candidate.get_source()[0], candidate.get_destination()[0]))
+    ranks = contig_ranks(contigs)
+    # BND IDs follow the order of the BND stream; breakend j's mate is breakend j ^ 1
+    streams, bnd_numbers = sorted_vcf_streams(deletion_candidates, novel_insertion_candidates, duplication_candidates,
+                                              bnd_candidates, types_to_output, ranks)
 
-    # assign variant IDs and handle MATEID for BNDs
     svtype_counter = defaultdict(int)
-    pairid_to_svids = defaultdict(list)  # pair_id -> list of assigned svids
-    output_buffer = []  # buffer for entries to write after MATEID assignment
-
-    for loc, (entry_template, pair_id), svtype in entries_sorted:
+    for _, svtype, candidate, reverse, index in heapq.merge(*streams, key=itemgetter(0)):
         svtype_counter[svtype] += 1
         variant_id = f"SVPG.{svtype}.{svtype_counter[svtype]}"
-
-        entry_assigned = entry_template.replace("PLACEHOLDERFORID", variant_id, 1)
-
-        # record the svid for BND entries with pair_id
-        if svtype == "BND" and pair_id is not None:
-            pairid_to_svids[pair_id].append((variant_id, entry_assigned))
-            # current svid and entry go to buffer for later MATEID filling
-            output_buffer.append((pair_id, variant_id, entry_assigned, svtype))
-        else:
-            # non-BND entries go directly to output buffer
-            output_buffer.append((None, variant_id, entry_assigned, svtype))
-
-    #  if pair_id has two svids, fill in MATEID for both, then not fill MATEID
-    for rec in output_buffer:
-        pair_id, variant_id, entry_line, svtype = rec
-
-        if svtype == "BND" and pair_id is not None:
-            svid_list = pairid_to_svids.get(pair_id, [])
-            if len(svid_list) == 2:
-                svid_a, entry_a = svid_list[0]
-                svid_b, entry_b = svid_list[1]
-
-                mate_id = svid_b if variant_id == svid_a else svid_a
-
-                # fill in MATEID
-                if "MATE_PLACEHOLDER" in entry_line:
-                    line_out = entry_line.replace("MATE_PLACEHOLDER", mate_id)
-                else:
-                    parts = entry_line.split("\t")
-                    parts[7] = parts[7].rstrip() + f";MATEID={mate_id}"
-                    line_out = "\t".join(parts)
-
-                print(line_out, file=vcf_output)
+        if svtype == "BND":
+            entry = candidate.get_vcf_entry_reverse() if reverse else candidate.get_vcf_entry()
+            entry = entry.replace("PLACEHOLDERFORID", variant_id, 1)
+            mate_id = f"SVPG.BND.{bnd_numbers[index ^ 1]}"
+            if "MATE_PLACEHOLDER" in entry:
+                entry = entry.replace("MATE_PLACEHOLDER", mate_id)
             else:
-                # only one breakend found for this pair_id, output without MATEID
-                print(entry_line, file=vcf_output)
+                parts = entry.split("\t")
+                parts[7] = parts[7].rstrip() + f";MATEID={mate_id}"
+                entry = "\t".join(parts)
         else:
-            print(entry_line, file=vcf_output)
+            entry = candidate.get_vcf_entry().replace("PLACEHOLDERFORID", variant_id, 1)
+        vcf_output.write((entry + "\n").encode())
 
-    vcf_output.close()
\ No newline at end of file
+    vcf_output.close()
+    if compressed:
+        pysam.tabix_index(out_path, preset="vcf", force=True, csi=max(contig_lengths, default=0) >= 1 << 29)
@@ -1,68 +1,34 @@
-import pyabpoa
 from collections import defaultdict
 import mappy as mp
-from sklearn.cluster import KMeans
-from sklearn.exceptions import ConvergenceWarning
-import warnings
 import numpy as np
 
 
 from svpg.output_vcf import Candidate
+from svpg.SVSignature import READ_FLANK, read_span
+from svpg.consensus import msa_consensus
 
-def _extract_fragment_from_signature(sig, span_start, span_end, svtype):
-    seq = sig.read_seq
-    offset_start = span_start - sig.start
-    offset_end = span_end - sig.start if svtype == 'INS' else span_end - sig.end
-    left = max(0, sig.pos_read + offset_start)
-    right = min(len(seq), sig.pos_read + sig.svlen + offset_end) if svtype == 'INS' else min(len(seq), sig.pos_read + offset_end)
-    # left = max(0, sig.pos_read + offset_start-500)
-    # right = min(len(seq), sig.pos_read + sig.svlen + offset_end+500) if svtype == 'INS' else min(len(seq), sig.pos_read + offset_end)
-    middle_seq = seq[left:right]
+def align_with_mappy(ref_seq, query_seq, read_type, windows):
+    """Align each haplotype pair to its own reference window (start, end) of `ref_seq`.
 
-    fragment = middle_seq
-    return fragment
-
-def _msa_consensus_for_cluster(cluster_seqs, max_cons=1, aligner=None):
-    if not cluster_seqs:
-        return None
-    if len(cluster_seqs) == 1:
-        return cluster_seqs
-
-    if aligner is None:
-        aligner = pyabpoa.msa_aligner()
-
-    parts = sorted([(len(s), s, f'seq{i}') for i, s in enumerate(cluster_seqs)], reverse=True)
-    _, seqs, names = zip(*parts)
-
-    aln_result = aligner.msa(list(seqs), out_msa=True, out_cons=True, max_n_cons=max_cons)
-    return aln_result.cons_seq
-
-def align_with_mappy(ref_seq, query_seq, read_type):
+    Only the window is minimizer-indexed, so no task indexes the whole chromosome. Alignments are returned as
+    (sequence, hit, window start) to translate hit coordinates back to the chromosome.
+    """
     preset = "map-hifi" if read_type == "hifi" else "map-ont"
-    aligner = mp.Aligner(seq=ref_seq,  preset=preset, fn_idx_in=None)
-    if not aligner:
-        raise Exception(f"Failed to load index {ref_seq}")
     aln1, aln2 = [], []
-    for seq1, seq2 in query_seq:
-        if not seq1:
-            aln1.append(None)
-        else:
-            aln_primary = None
-            for hit in aligner.map(seq1):
-                if hit.is_primary:
-                    aln_primary = (seq1, hit)
-                    break
-            aln1.append(aln_primary)
-
-        if not seq2:
-            aln2.append(None)
-        else:
+    for (seq1, seq2), (win_start, win_end) in zip(query_seq, windows):
+        aligner = mp.Aligner(seq=ref_seq[win_start:win_end], preset=preset, fn_idx_in=None)
+        if not aligner:
+            raise Exception(f"Failed to index reference window {win_start}-{win_end}")
+        for seq, aln in ((seq1, aln1), (seq2, aln2)):
+            if not seq:
+                aln.append(None)
+                continue
             aln_primary = None
-            for hit in aligner.map(seq2):
+            for hit in aligner.map(seq):
                 if hit.is_primary:
-                    aln_primary = (seq2, hit)
+                    aln_primary = (seq, hit, win_start)
                     break
-            aln2.append(aln_primary)
+            aln.append(aln_primary)
 
     return aln1, aln2
 
@@ -85,9 +51,83 @@ def candidate_sv(sv, contig, ref_seq, noseqs, genotype="1/1"):
 
     return Candidate(contig, start, end, svtype, [], ref_seq=ref_seq, alt_seq=alt_seq, genotype=genotype)
 
+def bipartition_reads(feature_matrix, n_init=10, max_iter=100, seed=42):
+    """Weighted 2-means over the distinct rows of a binary read x cluster matrix.
+
+    Centres are seeded k-means++ style from a fixed random seed, so the partition is deterministic. Each run does
+    Lloyd iterations followed by Hartigan single-row moves, and the run with the lowest within-cluster sum of squares
+    is kept. Returns a 0/1 label per row.
+    """
+    patterns, inverse, weights = np.unique(feature_matrix, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    n_patterns = len(patterns)
+    if n_patterns < 2:
+        return np.zeros(len(feature_matrix), dtype=int)
+    patterns = patterns.astype(np.float64)
+    weights = weights.astype(np.float64)
+    weighted = patterns * weights[:, None]
+    total_sum, total_weight = weighted.sum(axis=0), weights.sum()
+    norms = (patterns ** 2).sum(axis=1)
+    rows = np.arange(n_patterns)
+
+    def sq_distances(centers):
+        return np.maximum(norms[:, None] - 2 * patterns @ centers.T + (centers ** 2).sum(axis=1), 0.0)
+
+    def partition(labels):
+        sum1 = weighted[labels == 1].sum(axis=0)
+        weight1 = weights[labels == 1].sum()
+        return np.array([total_sum - sum1, sum1]), np.array([total_weight - weight1, weight1])
+
+    rng = np.random.default_rng(seed)
+    best_inertia, best_labels = None, None
+    seeded = set()
+    for _ in range(n_init):
+        first = rng.choice(n_patterns, p=weights / total_weight)
+        d = weights * sq_distances(patterns[[first]])[:, 0]
+        second = rng.choice(n_patterns, p=d / d.sum())
+        if (first, second) in seeded:
+            continue
+        seeded.add((first, second))
+
+        centers, labels = patterns[[first, second]], None
+        for _ in range(max_iter):
+            new_labels = np.argmin(sq_distances(centers), axis=1)
+            if labels is not None and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            sums, member_weight = partition(labels)
+            if member_weight.min() == 0:
+                break
+            centers = sums / member_weight[:, None]
+
+        # Hartigan refinement: move the row pattern whose switch lowers the sum of squares the most
+        while member_weight.min() > 0:
+            d = sq_distances(centers)
+            own_weight, other_weight = member_weight[labels], member_weight[1 - labels]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gain = (weights * own_weight / (own_weight - weights) * d[rows, labels]
+                        - weights * other_weight / (other_weight + weights) * d[rows, 1 - labels])
+            gain[own_weight == weights] = -np.inf
+            move = int(np.argmax(gain))
+            if gain[move] <= 1e-9:
+                break
+            labels = labels.copy()
+            source = labels[move]
+            labels[move] = 1 - source
+            sums[source] -= weighted[move]
+            sums[1 - source] += weighted[move]
+            member_weight[source] -= weights[move]
+            member_weight[1 - source] += weights[move]
+            centers = sums / member_weight[:, None]
+
+        inertia = float((weights * sq_distances(centers)[rows, labels]).sum())
+        if best_inertia is None or inertia < best_inertia - 1e-9:
+            best_inertia, best_labels = inertia, labels
+    return best_labels[inverse]
+
 def phase_reads_by_cluster_similarity(current_signature_clusters):
     """
-    phase reads into 2 haps based on their signature cluster similarity using k-means clustering.
+    phase reads into 2 haps based on their signature cluster similarity using 2-means clustering.
     """
     # Step 1: construct read_name -> sigs mapping
     read_to_sigs = defaultdict(list)
@@ -101,22 +141,14 @@ def phase_reads_by_cluster_similarity(current_signature_clusters):
 
     # Step 2: construct feature matrix （n_reads x n_clusters）
     # sv of read i in cluster j -> feature_matrix[i][j] = 1 else 0
-    feature_matrix = np.zeros((n_reads, n_clusters), dtype=int)
-
-    cluster_read_names = [set(sig.read_name for sig in cluster)
-                          for cluster in current_signature_clusters]
-
-    for i, read_name in enumerate(read_names):
-        for j, cluster_reads in enumerate(cluster_read_names):
-            if read_name in cluster_reads:
-                feature_matrix[i, j] = 1
+    read_index = {read_name: i for i, read_name in enumerate(read_names)}
+    feature_matrix = np.zeros((n_reads, n_clusters), dtype=np.uint8)
+    for j, cluster in enumerate(current_signature_clusters):
+        feature_matrix[[read_index[sig.read_name] for sig in cluster], j] = 1
 
-    # Step 3: k-means
+    # Step 3: 2-means
     if n_reads >= 2:
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=ConvergenceWarning)
-            kmeans = KMeans(n_clusters=2, random_state=42, n_init=20)
-            labels = kmeans.fit_predict(feature_matrix)
+        labels = bipartition_reads(feature_matrix)
     else:
         labels = np.zeros(n_reads, dtype=int)
 
@@ -127,23 +159,24 @@ def phase_reads_by_cluster_similarity(current_signature_clusters):
     hap_to_seqs = defaultdict(list)
     for read_name, hap_id in read_to_hap.items():
         sigs = read_to_sigs[read_name]
-        span_start = max(min(s.pos_read for s in sigs)-2000, 0)
-        span_end = min(max(s.pos_read for s in sigs)+2000, len(sigs[-1].read_seq))
+        read_len = sigs[-1].read_len
+        span_start = max(min(s.pos_read for s in sigs)-READ_FLANK, 0)
+        span_end = min(max(s.pos_read for s in sigs)+READ_FLANK, read_len)
         if sigs[-1].type == 'INS':
-            frag_seq = sigs[-1].read_seq[span_start: span_end+sigs[-1].svlen]
+            frag_seq = read_span(sigs, span_start, min(span_end+sigs[-1].svlen, read_len))
         else:
-            frag_seq = sigs[-1].read_seq[span_start: span_end]
+            frag_seq = read_span(sigs, span_start, span_end)
         hap_to_seqs[hap_id].append(frag_seq)
 
     return list(hap_to_seqs.values())
 
 
 def _extract_sv_from_alignment(aln):
-    a1_seq, a1_res = aln[0], aln[1]
+    a1_seq, a1_res, ref_offset = aln
     if a1_res.mapq < 20:
         return []
     res = []
-    ref_pos = a1_res.r_st  # 0-based
+    ref_pos = ref_offset + a1_res.r_st  # 0-based
     read_pos = 0
     # CIGAR tuples: (operation, length)
     cigartuples = [(length, op) for length, op in a1_res.cigar]
@@ -179,7 +212,7 @@ def _extract_sv_from_alignment(aln):
     return res
 
 def run_align(merged_intervals, ref_seq, options):
-    haps, beds, beds_sv = [], [], []
+    haps, beds, beds_sv, windows = [], [], [], []
     # complex regions realignment
     for contig, start, end, svtype, current_signature_clusters, _ in merged_intervals:
         if len(current_signature_clusters) < 3:
@@ -188,17 +221,20 @@ def run_align(merged_intervals, ref_seq, options):
 
         if not hap_to_seqs:
             continue
-        cons_hp1 = _msa_consensus_for_cluster(hap_to_seqs[0])[0]
+        cons_hp1 = msa_consensus(hap_to_seqs[0])[0]
         if len(hap_to_seqs) == 1:
             continue
-        cons_hp2 = _msa_consensus_for_cluster(hap_to_seqs[1])[0]
+        cons_hp2 = msa_consensus(hap_to_seqs[1])[0]
         haps.append((cons_hp1, cons_hp2))
         beds.append((start, end))
+        # a haplotype cannot align further than its own length beyond the merged interval
+        pad = max(len(cons_hp1), len(cons_hp2)) + READ_FLANK
+        windows.append((max(0, start - pad), min(len(ref_seq), end + pad)))
         beds_sv.append(current_signature_clusters)
 
     sv_candidates = []
     min_sv_length, noseqs = options.min_sv_size, options.noseq
-    aln1, aln2 = align_with_mappy(ref_seq, haps, options.read)
+    aln1, aln2 = align_with_mappy(ref_seq, haps, options.read, windows)
     for a1, a2, bed, align_sv in zip(aln1, aln2, beds, beds_sv):
         tmp_sv = []
         start, end = bed
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+import pysam
+
+
+class ReferenceCache:
+    """Random access to an indexed FASTA reference through an LRU cache of fixed-size blocks.
+
+    Contig lengths come from the .fai index, and fetches are assembled from cached blocks, so repeated flank lookups
+    around nearby loci are served from memory and no caller needs to hold a whole chromosome. fetch() follows
+    pysam.FastaFile.fetch: a negative start or start > end raise ValueError, an unknown contig raises KeyError and the
+    end is clipped to the contig length.
+    """
+
+    def __init__(self, path, block_size=65536, max_blocks=512):
+        self.path = path
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.fasta = pysam.FastaFile(path)
+        self.references = self.fasta.references
+        self.lengths = self.fasta.lengths
+        self._lengths = dict(zip(self.references, self.lengths))
+        self._blocks = OrderedDict()
+
+    def __reduce__(self):
+        return ReferenceCache, (self.path, self.block_size, self.max_blocks)
+
+    def length(self, contig):
+        try:
+            return self._lengths[contig]
+        except KeyError:
+            raise KeyError(f"sequence '{contig}' not present")
+
+    def _block(self, contig, index):
+        key = (contig, index)
+        block = self._blocks.get(key)
+        if block is None:
+            block = self.fasta.fetch(contig, index * self.block_size, (index + 1) * self.block_size)
+            self._blocks[key] = block
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(key)
+        return block
+
+    def fetch(self, contig, start=None, end=None):
+        start = 0 if start is None else start
+        if start < 0:
+            raise ValueError(f"start out of range ({start})")
+        if end is not None and start > end:
+            raise ValueError(f"invalid coordinates: start ({start}) > stop ({end})")
+        length = self.length(contig)
+        end = length if end is None else min(end, length)
+        if start >= end:
+            return ''
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        if last - first >= self.max_blocks // 4:
+            # large spans are read directly instead of cycling the cache
+            return self.fasta.fetch(contig, start, end)
+        seq = ''.join(self._block(contig, index) for index in range(first, last + 1))
+        offset = first * self.block_size
+        return seq[start - offset:end - offset]
+
+    def chrom(self, contig):
+        return ChromView(self, contig)
+
+
+class ChromView:
+    """String-like read-only view of one contig of a ReferenceCache, supporting len(), indexing and slicing."""
+    __slots__ = ('_ref', 'contig', '_len')
+
+    def __init__(self, ref, contig):
+        self._ref = ref
+        self.contig = contig
+        self._len = ref.length(contig)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._len)
+            if step != 1:
+                return self._ref.fetch(self.contig)[item]
+            return self._ref.fetch(self.contig, start, max(start, stop))
+        index = item + self._len if item < 0 else item
+        if not 0 <= index < self._len:
+            raise IndexError("string index out of range")
+        return self._ref.fetch(self.contig, index, index + 1)
@@ -0,0 +1,63 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# rough upper estimates used to fit work into --max_mem
+WORKER_MEM = 1 << 30
+MINIGRAPH_BASE_MEM = 1 << 30
+MINIGRAPH_GRAPH_FACTOR = 3
+
+
+def minigraph_mem(gfa_path):
+    """Estimated peak memory of a minigraph run against `gfa_path`, which is dominated by the graph index."""
+    return MINIGRAPH_BASE_MEM + MINIGRAPH_GRAPH_FACTOR * os.path.getsize(gfa_path)
+
+
+class ResourceGovernor:
+    """CPU thread and memory budget of one run, shared by the worker pool, pysam decompression and external tools.
+
+    Consumers reserve threads, and an estimate of their memory, for as long as they run. A reservation waits until that
+    much of the budget is free, so tools running at the same time never exceed --num_threads or --max_mem together.
+    Requests larger than the whole budget are reduced to it, so a single consumer always gets to run.
+    """
+
+    def __init__(self, num_threads, max_mem=None):
+        self.num_threads = max(1, num_threads)
+        self.max_mem = max_mem
+        self._free_threads = self.num_threads
+        self._free_mem = max_mem
+        self._cond = threading.Condition()
+
+    def share(self, consumers):
+        """Threads of each of `consumers` running at once."""
+        return max(1, self.num_threads // max(1, consumers))
+
+    def pool_size(self, mem_per_worker=WORKER_MEM):
+        """Number of worker processes that fit both the thread and the memory budget."""
+        if self.max_mem is None:
+            return self.num_threads
+        return max(1, min(self.num_threads, self.max_mem // mem_per_worker))
+
+    def mem_share(self, consumers):
+        """Memory of each of `consumers` running at once, or None without a memory cap."""
+        return None if self.max_mem is None else self.max_mem // max(1, consumers)
+
+    @contextmanager
+    def reserve(self, threads=1, mem=0):
+        """Hold `threads` threads and `mem` bytes of the budget; yields the number of threads granted."""
+        threads = min(max(1, threads), self.num_threads)
+        mem = 0 if self.max_mem is None else min(mem, self.max_mem)
+        with self._cond:
+            self._cond.wait_for(lambda: self._free_threads >= threads and
+                                (self.max_mem is None or self._free_mem >= mem))
+            self._free_threads -= threads
+            if self.max_mem is not None:
+                self._free_mem -= mem
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self._free_threads += threads
+                if self.max_mem is not None:
+                    self._free_mem += mem
+                self._cond.notify_all()
@@ -0,0 +1,131 @@
+import os
+import json
+import logging
+from hashlib import blake2b
+
+import numpy as np
+
+from svpg.SVSignature import SignatureTable
+from svpg.output_vcf import Candidate
+
+CACHE_VERSION = 1
+CACHE_DIR = 'svpg_cache'
+
+# input files and options each stage result depends on; later stages include the earlier ones
+STAGE_INPUTS = {
+    'collect': {'call': ['bam'], 'graph-call': ['gaf', 'gfa']},
+    'graph': {'call': ['bam', 'gfa', 'ref']},
+}
+STAGE_PARAMS = {
+    'collect': ['sub', 'contigs', 'read', 'min_mapq', 'min_sv_size', 'max_merge_threshold'],
+    'graph': ['sub', 'contigs', 'read', 'min_mapq', 'min_sv_size', 'max_merge_threshold', 'realign', 'noseq'],
+}
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _encode_strings(strings):
+    data = [s.encode() for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(d) for d in data], out=offsets[1:])
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+def _decode_strings(data, offsets):
+    data = data.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)]
+
+
+def table_arrays(table, prefix):
+    """Flatten a SignatureTable into named arrays, keeping only the pool entries its rows reference."""
+    state = table.__getstate__()
+    arrays = {f'{prefix}/{col}': state[col] for col, _ in SignatureTable.COLUMNS}
+    arrays[f'{prefix}/node_offset'] = state['node_offset']
+    arrays[f'{prefix}/nodes'] = state['nodes']
+    for pool in SignatureTable.POOLS:
+        arrays[f'{prefix}/{pool}'], arrays[f'{prefix}/{pool}.offsets'] = _encode_strings(state[pool])
+    return arrays
+
+
+def load_table(arrays, prefix):
+    state = {col: arrays[f'{prefix}/{col}'] for col, _ in SignatureTable.COLUMNS}
+    state['node_offset'] = arrays[f'{prefix}/node_offset']
+    state['nodes'] = arrays[f'{prefix}/nodes']
+    for pool in SignatureTable.POOLS:
+        state[pool] = _decode_strings(arrays[f'{prefix}/{pool}'], arrays[f'{prefix}/{pool}.offsets'])
+    table = SignatureTable.__new__(SignatureTable)
+    table.__setstate__(state)
+    return table
+
+
+class StageCache:
+    """Versioned checkpoints of pipeline stage results in the working directory.
+
+    Every stage is one .npz file holding its signature table, signature clusters (a table plus cluster offsets) and
+    candidates, together with a key hashed from the input file fingerprints and the options the stage depends on.
+    Results are always written; with --resume a stored result is reused when its version and key still match.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.resume = getattr(options, 'resume', False)
+        self.cache_dir = os.path.join(options.working_dir, CACHE_DIR)
+
+    def key(self, stage):
+        inputs = {name: file_fingerprint(getattr(self.options, name)) for name in STAGE_INPUTS[stage][self.options.sub]}
+        params = {name: getattr(self.options, name, None) for name in STAGE_PARAMS[stage]}
+        blob = json.dumps({'version': CACHE_VERSION, 'stage': stage, 'inputs': inputs, 'params': params}, sort_keys=True)
+        return blake2b(blob.encode(), digest_size=16).hexdigest()
+
+    def path(self, stage):
+        return os.path.join(self.cache_dir, f'{stage}.npz')
+
+    def load(self, stage):
+        """Stored (signatures, clusters, candidates) of `stage`, or None when resuming is off or no valid result exists."""
+        path = self.path(stage)
+        if not self.resume or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                arrays = dict(npz)
+            meta = json.loads(arrays['meta'].tobytes().decode())
+            if meta['version'] != CACHE_VERSION or meta['key'] != self.key(stage):
+                logging.info(f"Checkpoint {path} does not match the current inputs or parameters, recomputing.")
+                return None
+            signatures = load_table(arrays, 'signatures')
+            clusters = {}
+            for name in meta['clusters']:
+                table = load_table(arrays, f'clusters/{name}')
+                offsets = arrays[f'clusters/{name}/cluster_offsets']
+                clusters[name] = [[table[row] for row in range(offsets[i], offsets[i + 1])] for i in range(len(offsets) - 1)]
+            candidates = []
+            for fields in meta['candidates']:
+                candidate = Candidate.__new__(Candidate)
+                candidate.__dict__.update(fields)
+                candidates.append(candidate)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+        logging.info(f"Resuming from checkpoint {path}")
+        return signatures, clusters, candidates
+
+    def save(self, stage, signatures, clusters=None, candidates=None):
+        clusters = clusters or {}
+        arrays = table_arrays(signatures, 'signatures')
+        for name, cluster_list in clusters.items():
+            arrays.update(table_arrays(SignatureTable.from_signatures([sig for cluster in cluster_list for sig in cluster]),
+                                       f'clusters/{name}'))
+            offsets = np.zeros(len(cluster_list) + 1, dtype=np.int64)
+            np.cumsum([len(cluster) for cluster in cluster_list], out=offsets[1:])
+            arrays[f'clusters/{name}/cluster_offsets'] = offsets
+        meta = {'version': CACHE_VERSION, 'key': self.key(stage), 'clusters': list(clusters),
+                'candidates': [vars(candidate) for candidate in candidates or []]}
+        arrays['meta'] = np.frombuffer(json.dumps(meta, default=lambda o: o.item()).encode(), dtype=np.uint8)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.path(stage) + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path(stage))
@@ -1,15 +1,6 @@
 import os
 import re
 
-class gfaNode:
-    def __init__(self, name="", sequence="", length=0, contig="", offset=0, sr=0):
-        self.name = name
-        self.sequence = sequence
-        self.len = length
-        self.contig = contig
-        self.offset = offset
-        self.sr = sr
-
 def parse_contig_from_sn(tag: str) -> str:
     """
     Parse contig name from GFA SN:Z: tag.
@@ -34,30 +25,6 @@ def parse_contig_from_sn(tag: str) -> str:
     return value
 
 
-def read_gfa(ref_graph):
-    """Parse a GFA file to extract node and edge information."""
-    gfa_node, gfa_edge = {}, {}
-    with open(ref_graph, "r") as fp:
-        for line in fp:
-            tokens = line.strip().split('\t')
-            if tokens[0] == "S":  # Sequence line
-                name = tokens[1]
-                sequence = tokens[2]
-                try:
-                    length = int(tokens[3][5:])  # e.g., LN:i:1234 -> 1234
-                    contig = parse_contig_from_sn(tokens[4])  # e.g., SN:Z:chr1 -> chr1
-                    offset = int(tokens[5][5:])
-                    sr = int(tokens[6][5:])  # e.g., SR:i:1
-                except (IndexError, ValueError):
-                    raise ValueError(f"Invalid S-line format in GFA: {line}")
-
-                gfa_node[name] = gfaNode(name, sequence, length, contig, offset, sr)
-
-            # elif tokens[0] == "L":  # Link/edge line
-            #     gfa_edge.setdefault(tokens[1], []).append(line)
-
-    return gfa_node
-
 def analyze_cigar_indel(tuples, min_length, is_gaf=False):
     """
     Parses CIGAR tuples and returns indels with length >= min_length.
@@ -131,14 +98,12 @@ def chr_to_sort_key(chr_name):
     else:
         return None
 
-def sorted_nicely(vcf_entries):
-    """ Sort the given vcf entries (in the form ((contig, start, end), vcf_string, sv_type)) in the way that humans expect.
-        e.g. chr10 comes after chr2
+def contig_ranks(contigs):
+    """ Rank the given contig names in the way that humans expect, e.g. chr10 comes after chr2.
         Algorithm adapted from https://blog.codinghorror.com/sorting-for-humans-natural-sort-order/"""
     convert = lambda text: int(text) if text.isdigit() else text
     alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
-    tuple_key = lambda entry: (alphanum_key(str(entry[0][0])), entry[0][1], entry[0][2])
-    return sorted(vcf_entries, key=tuple_key)
+    return {contig: rank for rank, contig in enumerate(sorted(set(contigs), key=lambda c: alphanum_key(str(c))))}
 
 
 def find_sequence_file(entry):
@@ -0,0 +1,93 @@
+import random
+import time
+
+import numpy as np
+import pytest
+
+from svpg.SVCluster import MAX_LINKAGE_SIZE, cluster_bin, depth_param, form_bins, linkage_clusters
+from svpg.SVSignature import SignatureDeletion, SignatureInsertion, SignatureTable, SignatureTranslocation
+
+
+def reference_bins(signatures, max_distance):
+    """Bins of the original list-based form_bins, as lists of read names."""
+    sorted_signatures = sorted(signatures, key=lambda sig: sig.get_key())
+    bins = []
+    for sig in sorted_signatures:
+        if bins and bins[-1][-1].downstream_distance_to(sig) < max_distance:
+            bins[-1].append(sig)
+        else:
+            bins.append([sig])
+    return [[sig.read_name for sig in group] for group in bins]
+
+
+def random_signatures(svtype, n, rng):
+    signatures = []
+    for i in range(n):
+        contig = rng.choice(['chr1', 'chr2', 'chr10'])
+        start = rng.randrange(0, 20000, 50)
+        if svtype == 'DEL':
+            signatures.append(SignatureDeletion(contig, start, rng.randrange(50, 2000), 'cigar', f'r{i}'))
+        elif svtype == 'INS':
+            signatures.append(SignatureInsertion(contig, start, rng.randrange(50, 2000), 'cigar', f'r{i}'))
+        else:
+            signatures.append(SignatureTranslocation(contig, start, 'fwd', 'chr3', rng.randrange(100000), 'rev',
+                                                     'suppl', f'r{i}'))
+    return signatures
+
+
+@pytest.mark.parametrize('svtype', ['DEL', 'INS', 'BND'])
+@pytest.mark.parametrize('seed', range(5))
+def test_form_bins_matches_reference(svtype, seed):
+    rng = random.Random(seed)
+    signatures = random_signatures(svtype, 200, rng)
+    for max_distance in (50, 500, 1000):
+        bins, mean_depth = form_bins(SignatureTable.from_signatures(signatures), max_distance)
+        expected = reference_bins(signatures, max_distance)
+        assert [[sig.read_name for sig in group] for group in bins] == expected
+        assert mean_depth == pytest.approx(len(signatures) / len(expected))
+
+
+def test_breakends_gap_is_measured_from_pos_plus_one():
+    signatures = [SignatureTranslocation('chr1', 1000, 'fwd', 'chr2', 5, 'fwd', 'suppl', 'a'),
+                  SignatureTranslocation('chr1', 2000, 'fwd', 'chr2', 5, 'fwd', 'suppl', 'b')]
+    bins, _ = form_bins(SignatureTable.from_signatures(signatures), 1000)
+    assert len(bins) == 1
+
+
+def cluster_names(clusters):
+    return [[sig.read_name for sig in cluster] for cluster in clusters]
+
+
+def sparse_insertions(n, spacing=600):
+    return SignatureTable.from_signatures([SignatureInsertion('chr1', i * spacing, 50, 'cigar', f'r{i}')
+                                           for i in range(n)])
+
+
+@pytest.mark.parametrize('svtype', ['DEL', 'INS', 'BND'])
+def test_cluster_bin_assigns_every_row_once(svtype):
+    rng = random.Random(11)
+    signatures = random_signatures(svtype, 1200, rng)
+    bins, mean_depth = form_bins(SignatureTable.from_signatures(signatures), 5000)
+    for bin in bins:
+        clusters = cluster_bin(bin, mean_depth)
+        names = [name for cluster in cluster_names(clusters) for name in cluster]
+        assert sorted(names) == sorted(sig.read_name for sig in bin)
+        assert all(len(cluster) for cluster in clusters)
+        assert cluster_names(cluster_bin(bin, mean_depth)) == cluster_names(clusters)
+
+
+def test_cluster_bin_small_bins_use_plain_linkage():
+    bin = sparse_insertions(MAX_LINKAGE_SIZE)
+    labels = linkage_clusters(bin, 'INS', depth_param(len(bin), 3), 0.3)
+    expected = [[f'r{i}' for i in np.flatnonzero(labels == k)] for k in range(labels.max() + 1)]
+    assert cluster_names(cluster_bin(bin, 3)) == expected
+
+
+def test_cluster_bin_large_sparse_bin_is_linear():
+    bin = sparse_insertions(100000)
+    bins, mean_depth = form_bins(bin, 1000)
+    assert len(bins) == 1
+    start = time.perf_counter()
+    clusters = cluster_bin(bins[0], mean_depth)
+    assert time.perf_counter() - start < 60
+    assert sum(len(cluster) for cluster in clusters) == len(bin)
@@ -0,0 +1,53 @@
+import random
+
+import pysam
+import pytest
+
+from svpg.SVCollect import parse_sa_cigar
+
+
+def random_cigar(rng):
+    ops = []
+    if rng.random() < 0.5:
+        ops.append((rng.randint(1, 500), 'H'))
+    if rng.random() < 0.5:
+        ops.append((rng.randint(1, 500), 'S'))
+    ops.append((rng.randint(1, 200), rng.choice('M=X')))
+    for _ in range(rng.randint(0, 6)):
+        ops.append((rng.randint(1, 200), rng.choice('MIDN=X')))
+    if rng.random() < 0.5:
+        ops.append((rng.randint(1, 500), 'S'))
+    if rng.random() < 0.5:
+        ops.append((rng.randint(1, 500), 'H'))
+    return ''.join(f'{length}{op}' for length, op in ops)
+
+
+def pysam_extent(cigar, query_length):
+    """Extent as retrieve_other_alignments computed it with a pysam.AlignedSegment."""
+    a = pysam.AlignedSegment()
+    if query_length:
+        a.query_sequence = 'A' * query_length
+    a.reference_start = 100
+    a.cigarstring = cigar
+    return a.query_alignment_start, a.query_alignment_end, a.infer_read_length(), a.reference_end - 100
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('with_sequence', [True, False])
+def test_parse_sa_cigar_matches_pysam(seed, with_sequence):
+    rng = random.Random(seed)
+    for _ in range(200):
+        cigar = random_cigar(rng)
+        a = pysam.AlignedSegment()
+        a.cigarstring = cigar
+        query_length = a.infer_query_length() if with_sequence else 0
+        assert parse_sa_cigar(cigar, query_length) == pysam_extent(cigar, query_length), cigar
+
+
+def test_parse_sa_cigar_uses_main_sequence_length():
+    # the SA alignment shares query_sequence with the primary, whose hard clips may differ
+    rng = random.Random(7)
+    for _ in range(200):
+        cigar = random_cigar(rng)
+        query_length = rng.randint(1, 3000)
+        assert parse_sa_cigar(cigar, query_length) == pysam_extent(cigar, query_length), (cigar, query_length)
@@ -0,0 +1,73 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from svpg import consensus
+from svpg.SVSignature import SignatureInsertion
+from svpg.consensus import consensus_batch, downsample, msa_consensus
+from svpg.output_vcf import consolidate_clusters_unilocal
+
+OPTIONS = SimpleNamespace(min_sv_size=40, max_sv_size=-1, ultra_split_size=-1, noseq=False, read='hifi')
+
+
+def random_seq(rng, n):
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+
+def mutate(rng, seq, rate=0.02):
+    return ''.join(rng.choice('ACGT') if rng.random() < rate else base for base in seq)
+
+
+def test_single_read_insertion_keeps_full_alt_sequence():
+    ins_seq = random_seq(random.Random(0), 120)
+    cluster = [SignatureInsertion('chr1', 500, len(ins_seq), 'cigar', 'r1', alt_seq=ins_seq)]
+    candidates = consolidate_clusters_unilocal([cluster], 'A' * 1000, OPTIONS, cons=True)
+    assert len(candidates) == 1
+    assert candidates[0].alt_seq == ins_seq
+
+
+def test_consensus_insertion_recovers_true_sequence():
+    rng = random.Random(1)
+    ins_seq = random_seq(rng, 200)
+    cluster = [SignatureInsertion('chr1', 500, len(ins_seq), 'cigar', f'r{i}', alt_seq=mutate(rng, ins_seq))
+               for i in range(8)]
+    candidates = consolidate_clusters_unilocal([cluster], 'A' * 1000, OPTIONS, cons=True)
+    assert candidates[0].alt_seq == ins_seq
+
+
+def test_msa_consensus_small_inputs():
+    assert msa_consensus([]) is None
+    assert msa_consensus(['ACGTACGT']) == ['ACGTACGT']
+
+
+def test_msa_consensus_is_cached_and_order_independent():
+    rng = random.Random(2)
+    seq = random_seq(rng, 150)
+    reads = [mutate(rng, seq) for _ in range(6)]
+    consensus._cache.clear()
+    first = msa_consensus(reads)
+    assert first == [seq]
+    assert len(consensus._cache) == 1
+    assert msa_consensus(reads) is first
+    assert msa_consensus(reads[::-1]) == [seq]
+
+
+def test_downsample_keeps_reads_closest_to_median_in_order():
+    seqs = ['A' * n for n in (100, 5, 101, 99, 1000, 100)]
+    assert downsample(seqs, max_reads=3) == ['A' * 100, 'A' * 101, 'A' * 100]
+    assert downsample(seqs, max_reads=10) == seqs
+
+
+def test_consensus_batch_matches_msa_consensus():
+    rng = random.Random(3)
+    jobs = []
+    for _ in range(4):
+        seq = random_seq(rng, 100)
+        jobs.append([mutate(rng, seq) for _ in range(5)])
+    jobs.append(jobs[0])
+    jobs.append(['ACGT'])
+    consensus._cache.clear()
+    results = consensus_batch(jobs)
+    assert results == [msa_consensus(seqs) for seqs in jobs]
+    assert results[0] is results[4]
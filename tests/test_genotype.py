@@ -0,0 +1,45 @@
+from math import log10
+
+import numpy as np
+import pytest
+
+from svpg.SVGenotype import Genotype, cal_GL, genotype_likelihoods, prior
+
+
+def reference_cal_GL(c0, c1, platform):
+    """The original probability-space cal_GL, valid while the counts do not need rescaling (c0 + c1 <= 100)."""
+    err = 0.01 if platform == "hifi" else 0.1
+    ori_GL00 = np.float64(pow((1 - err), c0) * pow(err, c1) * (1 - prior) / 2)
+    ori_GL11 = np.float64(pow(err, c0) * pow((1 - err), c1) * (1 - prior) / 2)
+    ori_GL01 = np.float64(pow(0.5, c0 + c1) * prior)
+    log10_probs = np.array([log10(ori_GL00), log10(ori_GL01), log10(ori_GL11)])
+    m = max(log10_probs)
+    lse = m + log10(sum(pow(10.0, x - m) for x in log10_probs))
+    prob = list(np.minimum(log10_probs - lse, 0.0))
+    GL_P = [pow(10, i) for i in prob]
+    PL = [int(np.around(-10 * log10(i))) for i in GL_P]
+    GQ = [int(-10 * log10(GL_P[1] + GL_P[2])), int(-10 * log10(GL_P[0] + GL_P[2])), int(-10 * log10(GL_P[0] + GL_P[1]))]
+    QUAL = abs(np.around(-10 * log10(GL_P[0]), 1))
+    return Genotype[prob.index(max(prob))], "%d,%d,%d" % (PL[0], PL[1], PL[2]), max(GQ), QUAL
+
+
+@pytest.mark.parametrize('platform', ['hifi', 'ont'])
+def test_cal_GL_matches_reference(platform):
+    for c0 in range(0, 101):
+        for c1 in range(0, 101 - c0):
+            assert cal_GL(c0, c1, 'DEL', platform) == reference_cal_GL(c0, c1, platform), (c0, c1)
+
+
+@pytest.mark.parametrize('platform', ['hifi', 'ont'])
+def test_genotype_likelihoods_is_cal_GL_per_pair(platform):
+    rng = np.random.default_rng(0)
+    c0, c1 = rng.integers(0, 60, 300), rng.integers(0, 60, 300)
+    GT, PL, GQ, QUAL = genotype_likelihoods(c0, c1, platform)
+    for i in range(len(c0)):
+        assert cal_GL(c0[i], c1[i], 'INS', platform) == (Genotype[GT[i]], "%d,%d,%d" % tuple(PL[i]), GQ[i], QUAL[i])
+
+
+def test_deep_loci_do_not_underflow():
+    GT, PL, GQ, QUAL = genotype_likelihoods([0, 1500, 2000], [3000, 1500, 0], 'ont')
+    assert [Genotype[i] for i in GT] == ["1/1", "0/1", "0/0"]
+    assert np.isfinite(QUAL).all() and (PL.min(axis=1) == 0).all()
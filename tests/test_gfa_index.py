@@ -0,0 +1,92 @@
+import pickle
+
+import pytest
+
+from svpg.gfa_index import build_gfa_index, read_gfa
+
+SEGMENTS = [('ACGT', 'chr1', 0, 0), ('GG', 'chr1', 4, 0), ('TTTAA', 'chr1', 6, 1), ('C', 'chr2', 0, 0)]
+
+
+def write_gfa(path, names):
+    with open(path, 'w') as out:
+        out.write('H\tVN:Z:1.0\n')
+        for name, (seq, contig, offset, sr) in zip(names, SEGMENTS):
+            out.write(f'S\t{name}\t{seq}\tLN:i:{len(seq)}\tSN:Z:{contig}\tSO:i:{offset}\tSR:i:{sr}\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_numeric_names(tmp_path, indexed):
+    gfa = write_gfa(tmp_path / 'g.gfa', ['s1', 's2', 's5', 's3'])
+    if indexed:
+        build_gfa_index(gfa)
+    nodes = read_gfa(gfa)
+    assert nodes.prefix == 's'
+    assert nodes['s5'].sequence == 'TTTAA' and nodes['s5'].sr == 1 and nodes['s3'].contig == 'chr2'
+    assert nodes.path_rows(['>s5', '<s1']).tolist() == [2, 0]
+    assert 's4' not in nodes and 'x1' not in nodes
+    assert pickle.loads(pickle.dumps(nodes))['s2'].offset == 4
+
+
+@pytest.mark.parametrize('step', ['>x5', '>s4', '<s', '>s-1'])
+def test_path_rows_rejects_unknown_steps(tmp_path, step):
+    nodes = read_gfa(write_gfa(tmp_path / 'g.gfa', ['s1', 's2', 's5', 's3']))
+    with pytest.raises(KeyError):
+        nodes.path_rows(['>s1', step])
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_irregular_names_fall_back_to_name_lookup(tmp_path, indexed):
+    names = ['utg1', 'utg2', 'node_7', 'alt']
+    gfa = write_gfa(tmp_path / 'g.gfa', names)
+    if indexed:
+        build_gfa_index(gfa)
+    nodes = read_gfa(gfa)
+    assert nodes.prefix is None
+    assert [nodes.name(row) for row in range(len(nodes))] == names
+    assert nodes['node_7'].sequence == 'TTTAA' and nodes['alt'].contig == 'chr2'
+    assert nodes.path_rows(['>alt', '<utg2']).tolist() == [3, 1]
+    # ids are signed by step orientation, so the first segment must not get id 0
+    assert nodes.node_id.tolist() == [1, 2, 3, 4]
+    assert nodes.span_length(1, 4) == len('GG') + len('TTTAA')
+    with pytest.raises(KeyError):
+        nodes.path_rows(['>utg3'])
+    assert pickle.loads(pickle.dumps(nodes))['utg2'].offset == 4
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_leading_zero_names_stay_distinct(tmp_path, indexed):
+    names = ['s1', 's01', 's2', 's3']
+    gfa = write_gfa(tmp_path / 'g.gfa', names)
+    if indexed:
+        build_gfa_index(gfa)
+    nodes = read_gfa(gfa)
+    assert nodes.prefix is None
+    assert nodes['s1'].sequence == 'ACGT' and nodes['s01'].sequence == 'GG'
+    assert nodes.path_rows(['>s1', '>s01']).tolist() == [0, 1]
+    assert [nodes.name(row) for row in range(len(nodes))] == names
+
+
+def test_repeated_ids_fall_back_to_name_lookup(tmp_path):
+    nodes = read_gfa(write_gfa(tmp_path / 'g.gfa', ['s1', 's2', 's2', 's3']))
+    assert nodes.prefix is None
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_sparse_ids_fall_back_to_name_lookup(tmp_path, indexed):
+    names = ['s1', 's900000000', 's5', 's3']
+    gfa = write_gfa(tmp_path / 'g.gfa', names)
+    if indexed:
+        build_gfa_index(gfa)
+    nodes = read_gfa(gfa)
+    assert nodes.prefix is None and nodes._row_of_id.nbytes < 1024
+    assert nodes['s900000000'].sequence == 'GG'
+    assert nodes.path_rows(['<s900000000', '>s3']).tolist() == [1, 3]
+
+
+def test_numeric_lookup_rejects_non_canonical_ids(tmp_path):
+    nodes = read_gfa(write_gfa(tmp_path / 'g.gfa', ['s1', 's2', 's5', 's3']))
+    for name in ['s01', 's+1', 's 1', 's1_0']:
+        assert name not in nodes
+        with pytest.raises(KeyError):
+            nodes.path_rows(['>' + name])
@@ -0,0 +1,180 @@
+import gzip
+import os
+import random
+import stat
+
+import pysam
+import pytest
+
+from svpg.graph_augment import (STATE_FILE, MergeRecord, augment_pipe, biallelic_lines, load_augment_state,
+                                merge_cohort_vcfs, novel_windows, save_augment_state, window_consensus)
+
+HEADER = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=100000>
+##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of SV">
+##INFO=<ID=SVLEN,Number=A,Type=Integer,Description="Length of SV">
+##INFO=<ID=END,Number=1,Type=Integer,Description="End of SV">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allele depths">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sample}
+"""
+
+
+def write_vcf(path, sample, records):
+    plain = str(path)[:-3]
+    with open(plain, 'w') as f:
+        f.write(HEADER.format(sample=sample))
+        f.writelines('\t'.join(map(str, record)) + '\n' for record in records)
+    pysam.tabix_index(plain, preset='vcf', force=True)
+    return str(path)
+
+
+def test_biallelic_lines_splits_alleles_and_genotypes():
+    line = 'chr1\t100\tsv1\tA\tAT,ATT\t30\tPASS\tSVTYPE=INS;SVLEN=1,2;PRECISE\tGT:AD\t1/2:3,4,5\n'
+    assert biallelic_lines(line) == [
+        ['chr1', '100', 'sv1', 'A', 'AT', '30', 'PASS', 'SVTYPE=INS;SVLEN=1;PRECISE', 'GT:AD', '1/0:3,4'],
+        ['chr1', '100', 'sv1', 'A', 'ATT', '30', 'PASS', 'SVTYPE=INS;SVLEN=2;PRECISE', 'GT:AD', '0/1:3,5']]
+    assert biallelic_lines('chr1\t5\t.\tA\tAT\t.\tPASS\tSVTYPE=INS\tGT\t0|1') == [
+        ['chr1', '5', '.', 'A', 'AT', '.', 'PASS', 'SVTYPE=INS', 'GT', '0|1']]
+
+
+def test_merge_record_rejects_multiallelic_fields():
+    with pytest.raises(ValueError, match='Multi-allelic record at chr1:100'):
+        MergeRecord('chr1\t100\t.\tA\tAT,ATT\t.\tPASS\tSVTYPE=INS\tGT\t1/2'.split('\t'), 0)
+
+
+def test_merge_collapses_split_alleles(tmp_path):
+    ins1, ins2 = 'ACGTTGCAAC' * 8, 'GGCATTACGA' * 12
+    vcf1 = write_vcf(tmp_path / 's1.vcf.gz', 's1', [
+        ('chr1', 1000, 'a', 'A', f'A{ins1},A{ins2}', '.', 'PASS', f'SVTYPE=INS;SVLEN={len(ins1)},{len(ins2)}',
+         'GT:AD', '1/2:0,5,6')])
+    vcf2 = write_vcf(tmp_path / 's2.vcf.gz', 's2', [
+        ('chr1', 1003, 'b', 'A', f'A{ins2}', '.', 'PASS', f'SVTYPE=INS;SVLEN={len(ins2)}', 'GT:AD', '0/1:4,4')])
+    out = str(tmp_path / 'merged.vcf.gz')
+
+    n_records, novel = merge_cohort_vcfs([vcf1, vcf2], out, known_samples=1)
+    with gzip.open(out, 'rt') as f:
+        records = [line.rstrip('\n').split('\t') for line in f if not line.startswith('#')]
+    assert n_records == 2
+    assert [(r[1], r[4], r[9], r[10]) for r in records] == [
+        ('1000', f'A{ins1}', '1/0:0,5', '0/0:.'),
+        ('1000', f'A{ins2}', '0/1:0,6', '0/1:4,4')]
+    assert novel == []
+
+
+def test_novel_windows_merge_overlapping_flanks():
+    novel = [('chr1', 1000, 'A', 'AT'), ('chr1', 1500, 'AC', 'A'), ('chr1', 5000, 'G', 'GA'), ('chr2', 10, 'C', 'CT')]
+    assert novel_windows(novel, flank=300) == [
+        ['chr1', 699, 1801, [(1000, 'A', 'AT'), (1500, 'AC', 'A')]],
+        ['chr1', 4699, 5300, [(5000, 'G', 'GA')]],
+        ['chr2', 0, 310, [(10, 'C', 'CT')]]]
+
+
+def test_window_consensus_checks_ref_and_skips_overlaps():
+    ref_seq = 'ACGTACGTAC'
+    # window starts at 0-based 100, so POS 101 is ref_seq[0]
+    assert window_consensus(ref_seq, 100, [(102, 'C', 'CTT'), (105, 'ACG', 'A')]) == 'ACTTGTATAC'
+    assert window_consensus(ref_seq, 100, [(102, 'CGT', 'C'), (103, 'G', 'GA')]) == 'ACACGTAC'
+    assert window_consensus(ref_seq, 100, [(102, 'G', 'GA'), (103, 'G', '<INS>')]) == ref_seq
+
+
+FAKE_MINIGRAPH = """#!/bin/sh
+# minigraph -cxggs -t<n> <graph> <fragments>: the previous graph followed by the fragment names
+echo "$@" >> "{args}"
+cat "$3"
+sed -n 's/^>/S\\t/p' "$4"
+"""
+
+
+@pytest.fixture
+def cohort(tmp_path, monkeypatch):
+    """A reference, a graph, four sample VCFs and the augment directory of a finished run over sample s1."""
+    rng = random.Random(0)
+    ref_seq = ''.join(rng.choice('ACGT') for _ in range(30000))
+    ref = tmp_path / 'ref.fa'
+    ref.write_text('>chr1\n' + '\n'.join(ref_seq[i:i + 60] for i in range(0, len(ref_seq), 60)) + '\n')
+    pysam.faidx(str(ref))
+    gfa = tmp_path / 'graph.gfa'
+    gfa.write_text('S\ts1\tACGT\n')
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'minigraph'
+    script.write_text(FAKE_MINIGRAPH.format(args=tmp_path / 'minigraph_args'))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    ins = 'ACGTTGCAAC' * 8
+    insertion = ('chr1', 1000, '.', ref_seq[999], ref_seq[999] + ins, '.', 'PASS', f'SVTYPE=INS;SVLEN={len(ins)}',
+                 'GT:AD', '0/1:3,3')
+    deletion = ('chr1', 20000, '.', ref_seq[19999:20100], ref_seq[19999], '.', 'PASS', 'SVTYPE=DEL;SVLEN=-100',
+                'GT:AD', '1/1:0,5')
+    samples = {'s1': write_vcf(tmp_path / 's1.vcf.gz', 's1', [insertion]),
+               's2': write_vcf(tmp_path / 's2.vcf.gz', 's2', [insertion[:1] + (1003,) + insertion[2:]]),
+               's3': write_vcf(tmp_path / 's3.vcf.gz', 's3', [insertion, deletion])}
+
+    base = tmp_path / 'aug'
+    base.mkdir()
+    monkeypatch.chdir(base)
+    (base / 'filelist.tsv').write_text(samples['s1'] + '\n')
+    merge_cohort_vcfs([samples['s1']], 'variants.vcf.gz')
+    (base / 'aug.gfa').write_text(gfa.read_text())
+    save_augment_state(str(ref), str(gfa), 'aug.gfa', [samples['s1']])
+    return {'ref': str(ref), 'ref_seq': ref_seq, 'gfa': str(gfa), 'base': base, 'samples': samples,
+            'args': tmp_path / 'minigraph_args'}
+
+
+def vcf_records(path):
+    with gzip.open(path, 'rt') as f:
+        return [line.rstrip('\n').split('\t') for line in f if not line.startswith('#')]
+
+
+def test_unchanged_state_has_no_new_samples(cohort):
+    base = cohort['base']
+    graph, variants = (base / 'aug.gfa').read_bytes(), (base / 'variants.vcf.gz').read_bytes()
+    augment_pipe(str(base), cohort['ref'], cohort['gfa'], 'aug.gfa', incremental=True)
+    assert not cohort['args'].exists()
+    assert (base / 'aug.gfa').read_bytes() == graph and (base / 'variants.vcf.gz').read_bytes() == variants
+    assert load_augment_state(cohort['ref'], cohort['gfa']) is not None
+
+
+def test_new_samples_extend_the_graph_in_place(cohort):
+    base, samples, ref_seq = cohort['base'], cohort['samples'], cohort['ref_seq']
+    (base / 'filelist.tsv').write_text('\n'.join(samples[name] for name in ('s1', 's2', 's3')) + '\n')
+    augment_pipe(str(base), cohort['ref'], cohort['gfa'], 'aug.gfa', incremental=True)
+
+    # the insertion of s2 and s3 collapses into the known one of s1, only the deletion of s3 is novel
+    records = vcf_records(base / 'variants.vcf.gz')
+    assert [(r[1], r[9].split(':')[0], r[10].split(':')[0], r[11].split(':')[0]) for r in records] == [
+        ('1000', '0/1', '0/1', '0/1'), ('20000', '0/0', '0/0', '1/1')]
+    assert not (base / 'variants.tmp.vcf.gz').exists()
+
+    with open(base / 'novel_fragments.fa') as f:
+        header, sequence = f.readline().strip(), ''.join(line.strip() for line in f)
+    assert header == '>augment_chr1:10000-30000_0'
+    assert sequence == ref_seq[9999:20000] + ref_seq[20100:30000]
+
+    graph = str(base / 'aug.gfa')
+    assert cohort['args'].read_text().split() == ['-cxggs', '-t1', graph, 'novel_fragments.fa']
+    assert (base / 'aug.gfa').read_text() == 'S\ts1\tACGT\nS\taugment_chr1:10000-30000_0\n'
+
+    state = load_augment_state(cohort['ref'], cohort['gfa'])
+    assert [sample['path'] for sample in state['samples']] == [samples[name] for name in ('s1', 's2', 's3')]
+    cohort['args'].unlink()
+    augment_pipe(str(base), cohort['ref'], cohort['gfa'], 'aug.gfa', incremental=True)
+    assert not cohort['args'].exists()
+
+
+@pytest.mark.parametrize('changed', ['ref', 'gfa', 'graph', 'version'])
+def test_changed_inputs_invalidate_the_state(cohort, changed):
+    assert load_augment_state(cohort['ref'], cohort['gfa']) is not None
+    if changed == 'version':
+        with open(STATE_FILE) as f:
+            text = f.read()
+        with open(STATE_FILE, 'w') as f:
+            f.write(text.replace('"version": 1', '"version": 0'))
+    else:
+        path = {'ref': cohort['ref'], 'gfa': cohort['gfa'], 'graph': 'aug.gfa'}[changed]
+        with open(path, 'a') as f:
+            f.write('\n')
+    assert load_augment_state(cohort['ref'], cohort['gfa']) is None
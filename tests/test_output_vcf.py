@@ -0,0 +1,68 @@
+import gzip
+import random
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from svpg.output_vcf import Candidate, CandidateBreakend, write_final_vcf
+from svpg.util import contig_ranks
+
+CONTIGS = ['chr1', 'chr2', 'chr10', 'chrX']
+
+
+def random_candidates(rng, n):
+    by_type = {'DEL': [], 'INS': [], 'DUP': []}
+    for svtype, candidates in by_type.items():
+        for _ in range(n):
+            start = rng.randrange(0, 5000, 10)
+            candidates.append(Candidate(rng.choice(CONTIGS), start, start + rng.choice([0, 10, 100]), svtype, ['r1']))
+    breakends = [CandidateBreakend(rng.choice(CONTIGS), rng.randrange(0, 5000, 10), 'fwd', rng.choice(CONTIGS),
+                                   rng.randrange(0, 5000, 10), 'rev', ['r1', 'r2']) for _ in range(n)]
+    return by_type['DEL'], by_type['INS'], by_type['DUP'], breakends
+
+
+def reference_lines(deletions, insertions, duplications, breakends):
+    """VCF lines, without IDs, in the order of the original sort of all entries by (contig, start, end, type, index)."""
+    ranks = contig_ranks(CONTIGS)
+    entries = []
+    for type_order, candidates in enumerate((deletions, insertions, duplications)):
+        entries.extend(((ranks[c.contig], c.start, c.end, type_order, i), c.get_vcf_entry())
+                       for i, c in enumerate(candidates))
+    for i, c in enumerate(breakends):
+        entries.append(((ranks[c.contig], c.start, c.start + 1, 3, 2 * i), c.get_vcf_entry()))
+        entries.append(((ranks[c.dest_contig], c.dest_start, c.dest_start + 1, 3, 2 * i + 1),
+                        c.get_vcf_entry_reverse()))
+    return [strip_ids(line) for _, line in sorted(entries, key=lambda entry: entry[0])]
+
+
+def strip_ids(line):
+    fields = line.split('\t')
+    fields[2] = '.'
+    fields[7] = re.sub(r';MATEID=[^;]*', '', fields[7])
+    fields[4] = fields[4].replace('MATE_PLACEHOLDER', '.')
+    return '\t'.join(fields)
+
+
+@pytest.mark.parametrize('out', ['variants.vcf', 'variants.vcf.gz'])
+@pytest.mark.parametrize('seed', range(3))
+def test_write_final_vcf_order_and_mates(tmp_path, out, seed):
+    candidates = random_candidates(random.Random(seed), 60)
+    options = SimpleNamespace(types='DEL,INS,DUP,BND', working_dir=str(tmp_path), out=out, sub='graph-call')
+    write_final_vcf(*candidates, CONTIGS, [10000] * len(CONTIGS), options)
+
+    with (gzip.open if out.endswith('.gz') else open)(tmp_path / out, 'rt') as f:
+        lines = [line.rstrip('\n') for line in f if not line.startswith('#')]
+    assert [strip_ids(line) for line in lines] == reference_lines(*candidates)
+
+    ids = [line.split('\t')[2] for line in lines]
+    for svtype in ('DEL', 'INS', 'DUP', 'BND'):
+        numbers = [int(i.rsplit('.', 1)[1]) for i in ids if i.startswith(f'SVPG.{svtype}.')]
+        assert numbers == list(range(1, len(numbers) + 1))
+    mates = {}
+    for line in lines:
+        fields = line.split('\t')
+        if fields[2].startswith('SVPG.BND.'):
+            mate = re.search(r'MATEID=([^;\t]+)', fields[7])
+            mates[fields[2]] = mate.group(1) if mate else re.search(r'SVPG\.BND\.\d+', fields[4]).group()
+    assert len(mates) == 120 and all(mates[mates[i]] == i and mates[i] != i for i in mates)
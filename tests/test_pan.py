@@ -0,0 +1,50 @@
+import os
+import stat
+from types import SimpleNamespace
+
+import pytest
+
+from svpg.SVPan import minigraph_gaf_lines
+
+FAKE_MINIGRAPH = """#!/bin/sh
+# echo the streamed FASTA headers back as GAF query names, then fail if asked to
+echo "$@" > "{args}"
+grep '^>' | cut -c2- | while read name; do printf '%s\\t100\\t0\\t100\\t+\\t>s1\\n' "$name"; done
+exit {rc}
+"""
+
+
+def fake_minigraph(tmp_path, monkeypatch, rc=0):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'minigraph'
+    script.write_text(FAKE_MINIGRAPH.format(args=tmp_path / 'args', rc=rc))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return SimpleNamespace(read='hifi', gfa=str(tmp_path / 'graph.gfa'))
+
+
+def test_minigraph_gaf_lines_streams_records(tmp_path, monkeypatch):
+    options = fake_minigraph(tmp_path, monkeypatch)
+    records = ((f'read{i}', 'ACGT' * 50) for i in range(2000))
+    lines = list(minigraph_gaf_lines(records, options, 3))
+    assert [line.split('\t')[0] for line in lines] == [f'read{i}' for i in range(2000)]
+    args = (tmp_path / 'args').read_text().split()
+    assert args[:4] == ['-t', '3', '-cx', 'asm'] and args[-2:] == [options.gfa, '-']
+
+
+def test_minigraph_gaf_lines_raises_on_failure(tmp_path, monkeypatch):
+    options = fake_minigraph(tmp_path, monkeypatch, rc=2)
+    with pytest.raises(RuntimeError, match='status 2'):
+        list(minigraph_gaf_lines([('read0', 'ACGT')], options, 1))
+
+
+def test_minigraph_gaf_lines_reraises_record_errors(tmp_path, monkeypatch):
+    options = fake_minigraph(tmp_path, monkeypatch)
+
+    def records():
+        yield 'read0', 'ACGT'
+        raise ValueError('bad record')
+
+    with pytest.raises(ValueError, match='bad record'):
+        list(minigraph_gaf_lines(records(), options, 1))
@@ -0,0 +1,63 @@
+import pickle
+import random
+
+import pysam
+import pytest
+
+from svpg.reference import ReferenceCache
+
+
+@pytest.fixture
+def reference(tmp_path):
+    rng = random.Random(0)
+    contigs = {'chr1': 5000, 'chr2': 1234, 'chrM': 17}
+    path = tmp_path / 'ref.fa'
+    with open(path, 'w') as f:
+        for name, length in contigs.items():
+            seq = ''.join(rng.choice('ACGTN') for _ in range(length))
+            f.write(f'>{name}\n')
+            f.writelines(seq[i:i + 60] + '\n' for i in range(0, length, 60))
+    pysam.faidx(str(path))
+    return str(path), {name: pysam.FastaFile(str(path)).fetch(name) for name in contigs}
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except (ValueError, KeyError, IndexError) as e:
+        return type(e)
+
+
+def test_fetch_matches_pysam(reference):
+    path, _ = reference
+    fasta = pysam.FastaFile(path)
+    cache = ReferenceCache(path, block_size=100, max_blocks=16)
+    rng = random.Random(1)
+    for _ in range(5000):
+        contig = rng.choice(['chr1', 'chr2', 'chrM', 'chrZ'])
+        start, end = rng.randint(-5, 5100), rng.randint(-5, 5100)
+        assert outcome(cache.fetch, contig, start, end) == outcome(fasta.fetch, contig, start, end), (contig, start, end)
+    assert cache.fetch('chr2') == fasta.fetch('chr2')
+    assert len(cache._blocks) <= 16
+    assert cache.lengths == fasta.lengths and cache.length('chr2') == 1234
+
+
+def test_chrom_view_matches_str(reference):
+    path, seqs = reference
+    cache = ReferenceCache(path, block_size=64, max_blocks=8)
+    rng = random.Random(2)
+    for contig, seq in seqs.items():
+        view = cache.chrom(contig)
+        assert len(view) == len(seq)
+        for _ in range(2000):
+            i, j = rng.randint(-len(seq) - 3, len(seq) + 3), rng.randint(-len(seq) - 3, len(seq) + 3)
+            assert outcome(view.__getitem__, i) == outcome(seq.__getitem__, i)
+            assert view[i:j] == seq[i:j]
+            assert view[i:] == seq[i:] and view[:j] == seq[:j]
+        assert view[::3] == seq[::3]
+
+
+def test_pickles_as_path(reference):
+    path, seqs = reference
+    cache = pickle.loads(pickle.dumps(ReferenceCache(path, block_size=50)))
+    assert cache.block_size == 50 and cache.fetch('chrM') == seqs['chrM']
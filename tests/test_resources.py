@@ -0,0 +1,58 @@
+import threading
+
+from svpg.resources import ResourceGovernor, minigraph_mem, MINIGRAPH_BASE_MEM, MINIGRAPH_GRAPH_FACTOR
+
+GiB = 1 << 30
+
+
+def test_shares_and_pool_size():
+    governor = ResourceGovernor(16, 4 * GiB)
+    assert governor.pool_size() == 4
+    assert governor.share(governor.pool_size()) == 4
+    assert governor.mem_share(2) == 2 * GiB
+    assert ResourceGovernor(8).pool_size() == 8 and ResourceGovernor(8).mem_share(2) is None
+    assert ResourceGovernor(0).num_threads == 1 and ResourceGovernor(3).share(10) == 1
+
+
+def test_reserve_clamps_to_budget():
+    governor = ResourceGovernor(4, 2 * GiB)
+    with governor.reserve(100, 10 * GiB) as threads:
+        assert threads == 4
+        assert governor._free_threads == 0 and governor._free_mem == 0
+    assert governor._free_threads == 4 and governor._free_mem == 2 * GiB
+
+
+def test_reserve_waits_for_threads_and_memory():
+    governor = ResourceGovernor(4, 4 * GiB)
+    events = []
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold(threads, mem):
+        with governor.reserve(threads, mem):
+            events.append(('start', threads, mem))
+            holding.set()
+            release.wait(5)
+            events.append(('end', threads, mem))
+
+    pool = threading.Thread(target=hold, args=(3, GiB))
+    pool.start()
+    holding.wait(5)
+    holding.clear()
+    # more memory than is free must wait as well as more threads than are free
+    tools = [threading.Thread(target=hold, args=(2, GiB)), threading.Thread(target=hold, args=(1, 4 * GiB))]
+    for tool in tools:
+        tool.start()
+    assert not holding.wait(0.2)
+    release.set()
+    for thread in [pool] + tools:
+        thread.join(5)
+    assert events[:2] == [('start', 3, GiB), ('end', 3, GiB)]
+    assert sorted(events[2:]) == sorted([('start', 2, GiB), ('end', 2, GiB), ('start', 1, 4 * GiB), ('end', 1, 4 * GiB)])
+    assert governor._free_threads == 4 and governor._free_mem == 4 * GiB
+
+
+def test_minigraph_mem(tmp_path):
+    gfa = tmp_path / 'graph.gfa'
+    gfa.write_bytes(b'S\ts1\tACGT\n' * 100)
+    assert minigraph_mem(str(gfa)) == MINIGRAPH_BASE_MEM + MINIGRAPH_GRAPH_FACTOR * 1000
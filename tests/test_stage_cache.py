@@ -0,0 +1,80 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from svpg.SVSignature import SignatureDeletion, SignatureInsertion, SignatureTable, SignatureTranslocation
+from svpg.output_vcf import Candidate
+from svpg.stage_cache import StageCache
+
+FIELDS = ['type', 'contig', 'start', 'end', 'svlen', 'signature', 'read_name', 'pos_read', 'phase', 'read_seq',
+          'seq_offset', 'read_len', 'alt_seq', 'direction', 'pos1', 'contig2', 'pos2', 'source_direction',
+          'dest_direction', 'node_ls']
+
+
+def fields(sig):
+    """Attributes of a signature as a SignatureView of an in-memory table reports them."""
+    values = [getattr(sig, name, None) for name in FIELDS]
+    values[-1] = list(values[-1] or [])
+    return values
+
+
+@pytest.fixture
+def options(tmp_path):
+    bam = tmp_path / 'reads.bam'
+    bam.write_bytes(b'bam')
+    return SimpleNamespace(working_dir=str(tmp_path), resume=True, sub='call', bam=str(bam), contigs=['chr1'],
+                           read='hifi', min_mapq=20, min_sv_size=40, max_merge_threshold=500)
+
+
+def signatures():
+    read = 'ACGT' * 30
+    return [SignatureDeletion('chr1', 100, 80, 'cigar', 'r1', read_seq=read, pos_read=10, pan_node=[3, 4], phase=1),
+            SignatureInsertion('chr2', 500, 60, 'suppl', 'r2', alt_seq='G' * 60, pan_node=[7]),
+            SignatureInsertion('chr1', 900, 45, 'cigar', 'r1', read_seq=read, pos_read=50, alt_seq='<INS>'),
+            SignatureTranslocation('chr1', 300, 'fwd', 'chr2', 800, 'rev', 'suppl', 'r3')]
+
+
+def test_round_trip(options):
+    sigs = signatures()
+    table = SignatureTable.from_signatures(sigs)
+    clusters = {'INS': [[sigs[1]], [sigs[2], sigs[1]]], 'empty': []}
+    candidates = [Candidate('chr1', 100, 180, 'DEL', ['r1', 'r4'], ref_seq='A' * 80, alt_seq='A', pan_known=True,
+                            phase_list=[1, 2])]
+    cache = StageCache(options)
+    cache.save('collect', table, clusters, candidates)
+
+    loaded_table, loaded_clusters, loaded_candidates = cache.load('collect')
+    assert [fields(sig) for sig in loaded_table] == [fields(sig) for sig in table]
+    assert loaded_clusters.keys() == clusters.keys()
+    for name, cluster_list in clusters.items():
+        expected = [[fields(sig) for sig in SignatureTable.from_signatures(cluster)] for cluster in cluster_list]
+        assert [[fields(sig) for sig in cluster] for cluster in loaded_clusters[name]] == expected
+    assert [vars(c) for c in loaded_candidates] == [vars(c) for c in candidates]
+
+
+def test_changed_inputs_invalidate(options):
+    cache = StageCache(options)
+    cache.save('collect', SignatureTable.from_signatures(signatures()))
+    assert len(cache.load('collect')[0]) == 4
+
+    # downstream options do not invalidate the stage
+    options.min_support = 10
+    assert cache.load('collect') is not None
+
+    options.min_mapq = 30
+    assert cache.load('collect') is None
+    options.min_mapq = 20
+
+    os.utime(options.bam, ns=(0, 0))
+    assert cache.load('collect') is None
+
+
+def test_resume_off_and_unreadable(options):
+    StageCache(options).save('collect', SignatureTable.from_signatures(signatures()))
+    options.resume = False
+    assert StageCache(options).load('collect') is None
+    options.resume = True
+    with open(StageCache(options).path('collect'), 'wb') as f:
+        f.write(b'not a checkpoint')
+    assert StageCache(options).load('collect') is None